@@ -0,0 +1,8 @@
+"""
+Analyses over the full crawl output of the Torob crawlers
+
+Shared by torob_market_analysis.ipynb and the dashboard backend. Modules
+are imported on demand, so importing the package itself is cheap:
+
+    from analysis.sketches import MarketSketch
+"""
@@ -0,0 +1,180 @@
+"""
+Product categories parsed once per distinct categories string
+
+The crawler writes each product's page-level categories as one string:
+
+    ساعت مچی (ID: 116, Slug: watch) | کتاب کمک درسی (ID: 119, Slug: textbook)
+
+Every product of a listing page repeats the same string, so a product
+table with millions of rows has only a few thousand distinct values.
+parse_categories() is memoized on the string, and CategoryTable factorizes
+the column, parses each distinct string once and maps products to
+categories through integer arrays:
+
+    table = CategoryTable(products_df['categories'])
+    table.counts().head(20)          # products per category
+    table.pairs()                    # one (product, category_id) row per listing
+    mask = table.mask(table.find('116'))
+"""
+
+import re
+from functools import lru_cache
+
+import numpy as np
+import pandas as pd
+
+_ENTRY_RE = re.compile(r'([^|]+?)\s*\(ID:\s*([^,)]*?)\s*(?:,\s*Slug:\s*([^)]*?)\s*)?\)')
+
+
+@lru_cache(maxsize=65536)
+def parse_categories(categories):
+    """(id, title, slug) of every entry in a categories string; id is -1 when missing"""
+    entries = []
+    for title, cat_id, slug in _ENTRY_RE.findall(categories):
+        title = title.strip()
+        if title:
+            entries.append((int(cat_id) if cat_id.isdigit() else -1, title, slug or ''))
+    return tuple(entries)
+
+
+def category_titles(categories):
+    """Category titles in a categories string"""
+    return tuple(title for _, title, _ in parse_categories(categories))
+
+
+def count_titles(string_counts):
+    """Products per category title, given products per distinct categories string
+
+    string_counts is a Series (or dict) of categories string -> count, as
+    from value_counts() or a GROUP BY; the result is sorted largest first.
+    """
+    titles, counts = [], []
+    for categories, count in dict(string_counts).items():
+        for title in category_titles(str(categories)):
+            titles.append(title)
+            counts.append(count)
+    if not titles:
+        return pd.Series(dtype='int64')
+    totals = pd.Series(counts, dtype='int64').groupby(titles, sort=False).sum()
+    return totals.sort_values(ascending=False, kind='stable')
+
+
+class CategoryTable:
+    """Product -> category mapping of a categories column
+
+    Categories are identified by their Torob id, or by title when the id is
+    missing. ids, titles and slugs hold one entry per category code;
+    string_codes one distinct-string code per product (-1 for none).
+    """
+
+    def __init__(self, categories):
+        string_codes, strings = pd.factorize(pd.Series(categories, dtype=object), use_na_sentinel=True)
+        self.string_codes = string_codes.astype(np.int32)
+
+        index, ids, titles, slugs = {}, [], [], []
+        members, lengths = [], []
+        for value in strings:
+            entries = parse_categories(str(value))
+            for cat_id, title, slug in entries:
+                key = cat_id if cat_id >= 0 else title
+                if key not in index:
+                    index[key] = len(ids)
+                    ids.append(cat_id)
+                    titles.append(title)
+                    slugs.append(slug)
+                members.append(index[key])
+            lengths.append(len(entries))
+
+        self.ids = np.array(ids, dtype=np.int64)
+        self.titles = titles
+        self.slugs = slugs
+        # Categories of distinct string s are members[offsets[s]:offsets[s + 1]]
+        self._members = np.array(members, dtype=np.int32)
+        self._lengths = np.array(lengths, dtype=np.int64)
+        self._offsets = np.concatenate([[0], np.cumsum(self._lengths)])
+        self._string_of_member = np.repeat(np.arange(len(strings)), self._lengths)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _string_counts(self):
+        present = self.string_codes[self.string_codes >= 0]
+        return np.bincount(present, minlength=len(self._lengths))
+
+    def counts(self):
+        """Products listing each category, by title, largest first"""
+        weights = self._string_counts()[self._string_of_member]
+        totals = np.bincount(self._members, weights=weights, minlength=len(self)).astype(np.int64)
+        counts = pd.Series(totals, index=self.titles)
+        # Two ids can share a title
+        counts = counts.groupby(level=0, sort=False).sum()
+        return counts.sort_values(ascending=False, kind='stable')
+
+    def pairs(self):
+        """One row per (product position, category) listing: product, category_id, category"""
+        has = self.string_codes >= 0
+        rows = np.flatnonzero(has)
+        codes = self.string_codes[has]
+        repeats = self._lengths[codes]
+        product = np.repeat(rows, repeats)
+        # Position of each listing inside its string's member slice
+        starts = np.repeat(self._offsets[codes], repeats)
+        within = np.arange(len(product)) - np.repeat(np.cumsum(repeats) - repeats, repeats)
+        category = self._members[starts + within]
+        return pd.DataFrame({
+            'product': product,
+            'category_id': self.ids[category],
+            'category': np.array(self.titles, dtype=object)[category],
+        })
+
+    def primary(self):
+        """Code of each product's first listed category, -1 for none"""
+        first = np.full(len(self._lengths), -1, dtype=np.int64)
+        listed = self._lengths > 0
+        first[listed] = self._members[self._offsets[:-1][listed]]
+        codes = np.full(len(self.string_codes), -1, dtype=np.int64)
+        has = self.string_codes >= 0
+        codes[has] = first[self.string_codes[has]]
+        return codes
+
+    def find(self, category, key=str.strip):
+        """Codes of the categories a filter value names
+
+        Digits match the category id; anything else the title, compared
+        after key() (pass a Persian normalizer to ignore spelling variants).
+        """
+        category = category.strip()
+        if category.isdigit():
+            return np.flatnonzero(self.ids == int(category))
+        target = key(category)
+        return np.array([code for code, title in enumerate(self.titles) if key(title) == target], dtype=np.int64)
+
+    def mask(self, codes):
+        """Boolean mask of products listing any of the category codes"""
+        listed = np.isin(self._members, codes)
+        strings = np.unique(self._string_of_member[listed])
+        return np.isin(self.string_codes, strings)
+
+
+def primary_categories(frame, table=None):
+    """Primary category id and title of every product of a crawler frame
+
+    Taken from primary_category_id / primary_category when the crawl has
+    them, otherwise from the first entry of the categories column, or of
+    table: a CategoryTable already built for the frame or a categories
+    Series aligned with it. Products without a category get id -1; titles
+    is None when the frame has no titles.
+    """
+    if 'primary_category_id' in frame.columns:
+        ids = pd.to_numeric(frame['primary_category_id'], errors='coerce')
+        ids = ids.fillna(-1).to_numpy(dtype=np.int64)
+        titles = frame['primary_category'] if 'primary_category' in frame.columns else None
+        return ids, titles
+    if table is None:
+        table = CategoryTable(frame['categories'])
+    elif not isinstance(table, CategoryTable):
+        table = CategoryTable(table)
+    codes = table.primary()
+    ids = np.where(codes >= 0, table.ids[np.maximum(codes, 0)] if len(table) else -1, -1)
+    titles = np.array(table.titles + [''], dtype=object)[codes]
+    return ids, titles
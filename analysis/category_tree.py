@@ -0,0 +1,272 @@
+"""
+Category hierarchy of the crawl, with subtrees as integer intervals
+
+The crawler flattens each listing page's categories into two strings:
+
+    categories          هدفون (ID: 102, Slug: headphone) | کیف (ID: 115, Slug: bag)
+    parent_categories   کالای دیجیتال | مد و پوشاک
+
+Parents carry only a title and the list is deduplicated, so it lines up
+with the categories only when both have the same length. CategoryTree
+reads each distinct (categories, parent_categories) pair once and gives
+every category the parent it is listed with most often: one vote per
+product for the aligned parent, or a share of one vote for each parent
+when the lists do not line up.
+
+Nodes are numbered in preorder under a root node 0, so the subtree of
+node n is exactly the nodes n .. end[n] - 1 (nested-set / Euler-tour
+intervals) and "is a under b" is b <= a < end[b]. Products are tagged
+with the node of their primary category; every product under a category
+is then an integer range test instead of a match on category strings:
+
+    tree = CategoryTree.from_products(products_df)
+    leaf = tree.tag(products_df)
+    electronics = tree.find('کالای دیجیتال')
+    products_df[tree.mask(electronics, leaf)]
+    tree.rollup(depth=1)             # products per top-level category
+
+    python -m analysis.category_tree shop_products.csv -o category_tree.csv
+"""
+
+import sys
+import time
+import argparse
+from collections import defaultdict
+
+import numpy as np
+import pandas as pd
+
+from analysis.categories import parse_categories, primary_categories
+
+try:
+    import pyarrow
+except ImportError:
+    pyarrow = None
+
+ROOT = 0
+TREE_COLUMNS = ['categories', 'parent_categories', 'primary_category_id']
+PATH_SEPARATOR = ' > '
+
+
+def _parent_titles(parent_categories):
+    return [title.strip() for title in parent_categories.split('|') if title.strip()]
+
+
+class CategoryTree:
+    """Category nodes in preorder; node n's subtree is the nodes n .. end[n] - 1
+
+    Arrays hold one entry per node, the root (node 0, depth 0) first:
+    category_id (Torob id, -1 for the root and for parents, which have
+    none), title, slug, parent (-1 for the root), depth, end and products
+    (products whose primary category is that node, set by from_products()).
+    """
+
+    def __init__(self, category_ids, titles, slugs, parents):
+        """Build from nodes in any order; parents[i] is the position of node i's parent, -1 for top level"""
+        count = len(category_ids)
+        children = defaultdict(list)
+        for node, parent in enumerate(parents):
+            children[parent].append(node)
+
+        # Iterative preorder walk; children in title order so rebuilds number nodes the same way
+        order, depths, stack = [], [], [(-1, 0)]
+        while stack:
+            node, depth = stack.pop()
+            order.append(node)
+            depths.append(depth)
+            below = sorted(children.get(node, ()), key=lambda child: (titles[child], category_ids[child]))
+            stack.extend((child, depth + 1) for child in reversed(below))
+        if len(order) != count + 1:
+            raise ValueError("Category parents form a cycle")
+
+        original = np.array(order[1:], dtype=np.int64)
+        position = np.empty(count, dtype=np.int64)
+        position[original] = np.arange(1, count + 1)
+        parents = np.asarray(parents, dtype=np.int64)
+
+        self.category_id = np.concatenate([[-1], np.asarray(category_ids, dtype=np.int64)[original]])
+        self.title = np.array([''] + [titles[i] for i in original], dtype=object)
+        self.slug = np.array([''] + [slugs[i] for i in original], dtype=object)
+        parent = parents[original]
+        self.parent = np.concatenate([[-1], np.where(parent >= 0, position[np.maximum(parent, 0)], ROOT)])
+        self.depth = np.array(depths, dtype=np.int64)
+
+        # Subtree sizes, children before their parents
+        sizes = np.ones(count + 1, dtype=np.int64)
+        for node in range(count, 0, -1):
+            sizes[self.parent[node]] += sizes[node]
+        self.end = np.arange(count + 1) + sizes
+
+        self.products = np.zeros(count + 1, dtype=np.int64)
+        known = self.category_id >= 0
+        self._by_id = pd.Index(self.category_id[known])
+        self._id_nodes = np.flatnonzero(known)
+
+    def __len__(self):
+        return len(self.category_id)
+
+    def __repr__(self):
+        return (f"<CategoryTree {len(self) - 1:,} categories, {int((self.depth == 1).sum()):,} top level,"
+                f" depth {int(self.depth.max())}>")
+
+    @classmethod
+    def from_products(cls, frame, table=None):
+        """Tree of a crawler frame's categories and parent_categories, with product counts
+
+        table is an optional CategoryTable already built for the frame, used
+        to tag products when it has no primary_category_id.
+        """
+        category_codes, category_strings = pd.factorize(frame['categories'])
+        if 'parent_categories' in frame.columns:
+            parent_codes, parent_strings = pd.factorize(frame['parent_categories'])
+        else:
+            parent_codes, parent_strings = np.full(len(frame), -1), []
+        # Distinct (categories, parent_categories) pairs and their products
+        pair = category_codes.astype(np.int64) * (len(parent_strings) + 1) + (parent_codes + 1)
+        pairs, weights = np.unique(pair[category_codes >= 0], return_counts=True)
+
+        index, category_ids, titles, slugs = {}, [], [], []
+        parent_index = {}
+        votes = defaultdict(float)
+        for value, weight in zip(pairs.tolist(), weights.tolist()):
+            string, parent_code = divmod(value, len(parent_strings) + 1)
+            entries = parse_categories(str(category_strings[string]))
+            parents = _parent_titles(str(parent_strings[parent_code - 1])) if parent_code else []
+            keys = []
+            for cat_id, title, slug in entries:
+                key = cat_id if cat_id >= 0 else title
+                if key not in index:
+                    index[key] = len(category_ids)
+                    category_ids.append(cat_id)
+                    titles.append(title)
+                    slugs.append(slug)
+                keys.append(index[key])
+            for title in parents:
+                parent_index.setdefault(title, None)
+            if len(parents) == len(keys):
+                for node, title in zip(keys, parents):
+                    votes[node, title] += weight
+            elif parents:
+                for node in keys:
+                    for title in parents:
+                        votes[node, title] += weight / len(parents)
+
+        # Parents become nodes of their own after the categories
+        for title in parent_index:
+            parent_index[title] = len(category_ids)
+            category_ids.append(-1)
+            titles.append(title)
+            slugs.append('')
+        best = {}
+        for (node, title), weight in votes.items():
+            if node not in best or weight > best[node][1]:
+                best[node] = (parent_index[title], weight)
+        parents = [best[node][0] if node in best else -1 for node in range(len(index))]
+        parents += [-1] * len(parent_index)
+
+        tree = cls(category_ids, titles, slugs, parents)
+        leaf = tree.tag(frame, table)
+        tree.products = np.bincount(leaf[leaf >= 0], minlength=len(tree)).astype(np.int64)
+        return tree
+
+    def nodes(self, category_ids):
+        """Node of each Torob category id, -1 when the tree does not have it"""
+        position = self._by_id.get_indexer(np.asarray(category_ids, dtype=np.int64))
+        return np.where(position >= 0, self._id_nodes[np.maximum(position, 0)], -1)
+
+    def tag(self, frame, table=None):
+        """Node of every product's primary category (-1 for none), for range filters"""
+        ids, _ = primary_categories(frame, table)
+        return self.nodes(ids).astype(np.int32)
+
+    def find(self, category, key=str.strip):
+        """Nodes a filter value names: a Torob id, or a title compared after key()"""
+        category = category.strip()
+        if category.isdigit():
+            nodes = self.nodes([int(category)])
+            return nodes[nodes >= 0]
+        target = key(category)
+        return np.array([node for node in range(1, len(self)) if key(self.title[node]) == target], dtype=np.int64)
+
+    def mask(self, nodes, leaf):
+        """Mask of tagged products under any of nodes (each node's own products included)"""
+        nodes = np.asarray(nodes, dtype=np.int64)
+        if len(nodes) == 1:
+            return (leaf >= nodes[0]) & (leaf < self.end[nodes[0]])
+        # Mark the union of the intervals once, then look every product up in it
+        marks = np.zeros(len(self) + 1, dtype=np.int64)
+        np.add.at(marks, nodes, 1)
+        np.add.at(marks, self.end[nodes], -1)
+        covered = np.append(np.cumsum(marks)[:-1] > 0, False)
+        return covered[leaf]
+
+    def is_under(self, nodes, ancestor):
+        """Whether each of nodes is ancestor or lies in its subtree"""
+        nodes = np.asarray(nodes)
+        return (nodes >= ancestor) & (nodes < self.end[ancestor])
+
+    def subtree_products(self, products=None):
+        """Products in each node's subtree, from prefix sums over the preorder"""
+        products = self.products if products is None else products
+        total = np.concatenate([[0], np.cumsum(products)])
+        return total[self.end] - total[np.arange(len(self))]
+
+    def path(self, node):
+        """Titles from the top-level category down to node"""
+        titles = []
+        while node > ROOT:
+            titles.append(self.title[node])
+            node = self.parent[node]
+        return titles[::-1]
+
+    def frame(self):
+        """One row per category node (root excluded), in preorder"""
+        return pd.DataFrame({
+            'category_id': self.category_id,
+            'title': self.title,
+            'slug': self.slug,
+            'parent': self.parent,
+            'depth': self.depth,
+            'end': self.end,
+            'path': [PATH_SEPARATOR.join(self.path(node)) for node in range(len(self))],
+            'products': self.products,
+            'subtree_products': self.subtree_products(),
+        }).iloc[1:].rename_axis('node')
+
+    def rollup(self, depth=1, leaf=None):
+        """Products per category at depth, counting their whole subtree; largest first
+
+        leaf counts tagged products (e.g. a sample) instead of the products
+        the tree was built from.
+        """
+        products = self.products if leaf is None else np.bincount(leaf[leaf >= 0], minlength=len(self))
+        nodes = np.flatnonzero(self.depth == depth)
+        totals = pd.Series(self.subtree_products(products)[nodes], index=self.title[nodes], dtype='int64')
+        return totals.sort_values(ascending=False, kind='stable')
+
+
+def read_tree_columns(path):
+    """The columns CategoryTree.from_products() needs from a crawler CSV"""
+    header = pd.read_csv(path, nrows=0).columns
+    columns = [column for column in TREE_COLUMNS if column in header]
+    return pd.read_csv(path, usecols=columns, dtype={'categories': 'category', 'parent_categories': 'category'},
+                       engine='pyarrow' if pyarrow is not None else 'c')
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Category hierarchy of shop_products.csv")
+    parser.add_argument('path')
+    parser.add_argument('-o', '--output', help="Write one row per category node to this CSV")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    tree = CategoryTree.from_products(read_tree_columns(args.path))
+    print(f"✅ {tree!r} in {time.time() - started:.1f}s")
+    print(f"   products per top-level category:\n{tree.rollup(depth=1).to_string()}")
+    if args.output:
+        tree.frame().to_csv(args.output)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,307 @@
+"""
+Out-of-core product analyses over the full shop_products.csv
+
+The notebook used to load the first 100,000 products and run every analysis
+on that prefix. analyze_products() computes the same results (category
+counts, price statistics and price ranges, per-shop price summaries) over
+the whole file in one scan with bounded memory:
+
+- With DuckDB installed (pip install duckdb) the CSV is scanned in parallel
+  on every core, under a memory limit, spilling to disk when needed.
+  Price quantiles are exact.
+- Otherwise pyarrow's multi-threaded streaming CSV reader (or pandas'
+  chunked reader without pyarrow) feeds fixed-size batches to a thread
+  pool that aggregates each batch; the partial aggregates are merged as
+  they arrive. Memory is a few batches plus one row per shop and per
+  distinct categories string. Price quantiles come from a KLL sketch
+  (rank within about 1.3%, see analysis/sketches.py); everything else is
+  exact.
+
+    from analysis.engine import analyze_products
+    market = analyze_products('shop_products.csv')
+    market.category_counts.head(20)
+"""
+
+import os
+import sys
+import time
+import argparse
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import pandas as pd
+
+from analysis.categories import count_titles
+from analysis.sketches import PRICE_CEILING, QuantileSketch
+
+try:
+    import duckdb
+except ImportError:
+    duckdb = None
+
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pa_csv
+except ImportError:
+    pa = None
+
+ENGINES = ('auto', 'duckdb', 'pandas')
+SCAN_COLUMNS = ['shop_id', 'price', 'categories', 'name1']
+DEFAULT_QUANTILES = (0.25, 0.5, 0.75)
+# Bucket edges of the notebook's price ranges (toman)
+DEFAULT_PRICE_EDGES = (0, 100000, 500000, 1000000, 5000000)
+BLOCK_BYTES = 64 * 1024 * 1024
+CHUNK_ROWS = 500000
+SHOP_COLUMNS = ['shop_id', 'product_count', 'mean_price', 'min_price', 'max_price', 'std_price', 'named_products']
+
+
+class ProductAnalysis:
+    """Results of one analyze_products() scan"""
+
+    def __init__(self, engine, rows, category_counts, price, price_ranges, shop_stats, seconds):
+        self.engine = engine
+        self.rows = rows
+        # Category title -> number of products listing it, most common first
+        self.category_counts = category_counts
+        # count / mean / std / min / max of valid prices, quantiles and whether they are exact
+        self.price = price
+        # Products per price range, labelled like "[100000, 500000)"
+        self.price_ranges = price_ranges
+        # One row per shop with valid prices, columns SHOP_COLUMNS
+        self.shop_stats = shop_stats
+        self.seconds = seconds
+
+    def __repr__(self):
+        return (f"<ProductAnalysis {self.rows:,} products, {len(self.shop_stats):,} shops,"
+                f" {len(self.category_counts):,} categories via {self.engine} in {self.seconds:.1f}s>")
+
+
+def _range_labels(edges):
+    bounds = list(edges) + [None]
+    return [f"[{low:g}, {high:g})" if high is not None else f"[{low:g}, ∞)"
+            for low, high in zip(bounds[:-1], bounds[1:])]
+
+
+def analyze_products(path, engine='auto', quantiles=DEFAULT_QUANTILES, price_edges=DEFAULT_PRICE_EDGES,
+                     threads=None, memory_limit='2GB', progress=False):
+    """Category, price and per-shop statistics of every product in a CSV"""
+    if engine not in ENGINES:
+        raise ValueError(f"Unknown engine: {engine} (use one of {', '.join(ENGINES)})")
+    if engine == 'duckdb' and duckdb is None:
+        raise ImportError("engine='duckdb' needs the duckdb package (pip install duckdb)")
+
+    threads = threads or os.cpu_count() or 1
+    started = time.time()
+    if engine == 'duckdb' or (engine == 'auto' and duckdb is not None):
+        result = _analyze_duckdb(path, quantiles, price_edges, threads, memory_limit)
+    else:
+        result = _analyze_chunked(path, quantiles, price_edges, threads, progress)
+    result.seconds = time.time() - started
+    return result
+
+
+def _analyze_duckdb(path, quantiles, price_edges, threads, memory_limit):
+    connection = duckdb.connect()
+    try:
+        connection.execute(f"SET threads = {int(threads)}")
+        connection.execute(f"SET memory_limit = '{memory_limit}'")
+        connection.execute("SET preserve_insertion_order = false")
+
+        # Everything is read as text and cast like pandas' errors='coerce',
+        # so one malformed row cannot fail the scan
+        source = path.replace("'", "''")
+        connection.execute(f"""
+            CREATE TEMP TABLE products AS
+            SELECT TRY_CAST(shop_id AS BIGINT) AS shop_id,
+                   TRY_CAST(price AS DOUBLE) AS price,
+                   categories,
+                   name1 IS NOT NULL AS named
+            FROM read_csv('{source}', header = true, all_varchar = true)
+        """)
+        valid = f"price > 0 AND price < {PRICE_CEILING}"
+
+        rows = connection.execute("SELECT count(*) FROM products").fetchone()[0]
+        count, mean, std, low, high, values = connection.execute(f"""
+            SELECT count(price), avg(price), stddev_samp(price), min(price), max(price),
+                   quantile_cont(price, {list(map(float, quantiles))})
+            FROM products WHERE {valid}
+        """).fetchone()
+
+        edges = list(price_edges)
+        conditions = [f"price >= {low_edge}" + (f" AND price < {high_edge}" if high_edge is not None else "")
+                      for low_edge, high_edge in zip(edges, edges[1:] + [None])]
+        counts = connection.execute(
+            "SELECT " + ", ".join(f"count(*) FILTER (WHERE {c})" for c in conditions) + f" FROM products WHERE {valid}"
+        ).fetchone()
+
+        strings = connection.execute(
+            "SELECT categories, count(*) AS n FROM products WHERE categories IS NOT NULL GROUP BY categories"
+        ).df()
+        shop_stats = connection.execute(f"""
+            SELECT shop_id,
+                   count(*) AS product_count,
+                   avg(price) AS mean_price,
+                   min(price) AS min_price,
+                   max(price) AS max_price,
+                   stddev_samp(price) AS std_price,
+                   count(*) FILTER (WHERE named) AS named_products
+            FROM products WHERE {valid} AND shop_id IS NOT NULL
+            GROUP BY shop_id ORDER BY shop_id
+        """).df()
+    finally:
+        connection.close()
+
+    price = {
+        'count': int(count), 'mean': mean, 'std': std, 'min': low, 'max': high,
+        'quantiles': dict(zip(quantiles, values or [None] * len(quantiles))),
+        'quantiles_exact': True,
+    }
+    return ProductAnalysis(
+        engine='duckdb',
+        rows=int(rows),
+        category_counts=count_titles(dict(zip(strings['categories'], strings['n']))),
+        price=price,
+        price_ranges=pd.Series(counts, index=_range_labels(price_edges), dtype='int64'),
+        shop_stats=shop_stats.astype({'shop_id': 'int64', 'product_count': 'int64', 'named_products': 'int64'}),
+        seconds=0.0,
+    )
+
+
+def _batches(path):
+    """DataFrames of the scanned columns, a block at a time"""
+    if pa is not None:
+        header = pd.read_csv(path, nrows=0).columns
+        columns = [col for col in SCAN_COLUMNS if col in header]
+        reader = pa_csv.open_csv(
+            path,
+            read_options=pa_csv.ReadOptions(block_size=BLOCK_BYTES, use_threads=True),
+            parse_options=pa_csv.ParseOptions(newlines_in_values=True),
+            convert_options=pa_csv.ConvertOptions(
+                include_columns=columns,
+                column_types={col: pa.string() for col in columns},
+            ),
+        )
+        for batch in reader:
+            yield batch.to_pandas()
+    else:
+        yield from pd.read_csv(path, usecols=lambda col: col in SCAN_COLUMNS, dtype=str,
+                               chunksize=CHUNK_ROWS, low_memory=False)
+
+
+def _partial(frame, edges):
+    """Aggregates of one batch; runs on a worker thread"""
+    price = pd.to_numeric(frame['price'], errors='coerce')
+    shop_id = pd.to_numeric(frame['shop_id'], errors='coerce')
+    valid = ((price > 0) & (price < PRICE_CEILING)).to_numpy()
+    prices = price.to_numpy(dtype=float)[valid]
+
+    strings = frame['categories'].dropna().value_counts()
+    ranges = np.histogram(prices, bins=list(edges) + [np.inf])[0]
+
+    shops = pd.DataFrame({
+        'shop_id': shop_id.to_numpy()[valid],
+        'price': prices,
+        'named': frame['name1'].notna().to_numpy()[valid] if 'name1' in frame else True,
+    }).dropna(subset=['shop_id'])
+    grouped = shops.groupby('shop_id')
+    shop_parts = grouped.agg(n=('price', 'size'), total=('price', 'sum'), low=('price', 'min'),
+                             high=('price', 'max'), named=('named', 'sum'))
+    deviations = shops['price'] - grouped['price'].transform('mean')
+    shop_parts['m2'] = (deviations ** 2).groupby(shops['shop_id']).sum()
+    return len(frame), prices, strings, ranges, shop_parts
+
+
+def _merge_shops(current, part):
+    """Combine per-shop count/sum/min/max/M2 partials (Chan et al.)"""
+    if current is None:
+        return part
+    both = pd.concat([current, part])
+    both['mean'] = both['total'] / both['n']
+    grouped = both.groupby(level=0)
+    merged = grouped.agg(n=('n', 'sum'), total=('total', 'sum'), low=('low', 'min'),
+                         high=('high', 'max'), named=('named', 'sum'))
+    mean = merged['total'] / merged['n']
+    spread = both['n'] * (both['mean'] - mean.reindex(both.index).to_numpy()) ** 2
+    merged['m2'] = (both['m2'] + spread).groupby(level=0).sum()
+    return merged
+
+
+def _analyze_chunked(path, quantiles, price_edges, threads, progress):
+    rows = 0
+    sketch = QuantileSketch()
+    strings = pd.Series(dtype='int64')
+    ranges = np.zeros(len(price_edges), dtype=np.int64)
+    shops = None
+    started = time.time()
+
+    def absorb(result):
+        nonlocal rows, strings, ranges, shops
+        batch_rows, prices, batch_strings, batch_ranges, shop_parts = result
+        rows += batch_rows
+        sketch.update(prices)
+        strings = strings.add(batch_strings, fill_value=0)
+        ranges += batch_ranges
+        shops = _merge_shops(shops, shop_parts)
+        if progress:
+            print(f"   {rows:,} products ({time.time() - started:.0f}s)", file=sys.stderr)
+
+    # A bounded number of batches in flight keeps memory flat
+    with ThreadPoolExecutor(max_workers=threads) as pool:
+        pending = deque()
+        for frame in _batches(path):
+            pending.append(pool.submit(_partial, frame, price_edges))
+            if len(pending) >= 2 * threads:
+                absorb(pending.popleft().result())
+        while pending:
+            absorb(pending.popleft().result())
+
+    if shops is None or shops.empty:
+        shop_stats = pd.DataFrame(columns=SHOP_COLUMNS)
+    else:
+        shop_stats = pd.DataFrame({
+            'shop_id': shops.index.astype('int64'),
+            'product_count': shops['n'].astype('int64').to_numpy(),
+            'mean_price': (shops['total'] / shops['n']).to_numpy(),
+            'min_price': shops['low'].to_numpy(),
+            'max_price': shops['high'].to_numpy(),
+            'std_price': np.sqrt(shops['m2'] / (shops['n'] - 1)).where(shops['n'] > 1).to_numpy(),
+            'named_products': shops['named'].astype('int64').to_numpy(),
+        }).sort_values('shop_id', ignore_index=True)
+
+    price = {
+        'count': sketch.count, 'mean': sketch.mean, 'std': sketch.std,
+        'min': sketch.min if sketch.count else None, 'max': sketch.max if sketch.count else None,
+        'quantiles': dict(zip(quantiles, sketch.quantiles(quantiles))),
+        'quantiles_exact': False,
+        'rank_error': sketch.rank_error,
+    }
+    return ProductAnalysis(
+        engine='pandas',
+        rows=rows,
+        category_counts=count_titles(strings.astype('int64')),
+        price=price,
+        price_ranges=pd.Series(ranges, index=_range_labels(price_edges), dtype='int64'),
+        shop_stats=shop_stats,
+        seconds=0.0,
+    )
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Analyze every product in shop_products.csv out of core")
+    parser.add_argument('path')
+    parser.add_argument('--engine', choices=ENGINES, default='auto')
+    parser.add_argument('--threads', type=int)
+    parser.add_argument('--memory-limit', default='2GB', help="DuckDB memory limit")
+    args = parser.parse_args(argv)
+
+    market = analyze_products(args.path, engine=args.engine, threads=args.threads,
+                              memory_limit=args.memory_limit, progress=True)
+    print(f"✅ {market!r}")
+    print(f"   price: {market.price}")
+    print(f"   top categories:\n{market.category_counts.head(10).to_string()}")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
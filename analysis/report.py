@@ -0,0 +1,674 @@
+"""
+Headless market report: the notebook's sections as a DAG of cached stages
+
+    python -m analysis.report --data-dir . --output report/
+
+Every section of torob_market_analysis.ipynb is a stage here: a function
+of some input files and of the results of the stages it depends on. A
+stage's result is pickled in the cache directory under a key hashing
+
+- the stage's name and source code (and REPORT_VERSION),
+- the content of its input files (blake2b, reused while a file's size
+  and modification time are unchanged),
+- the digests of its dependencies' results,
+
+so a run recomputes only the stages whose code, data or upstream results
+changed; a stage that recomputes to the same result leaves the stages
+below it cached. Stages whose dependencies are ready run in parallel in a
+process pool, figures included: they are drawn with matplotlib's
+object-oriented API (no pyplot state) and come back as PNG bytes. The
+report directory gets report.json, report.md and one PNG per figure.
+
+The notebook reads its data from the same cache:
+
+    from analysis.report import ReportPipeline
+    pipeline = ReportPipeline('.')
+    market = pipeline.get('market')
+    shop_analysis = pipeline.get('shop_performance')['shop_analysis']
+"""
+
+import io
+import os
+import sys
+import json
+import time
+import pickle
+import logging
+import hashlib
+import inspect
+import argparse
+import importlib.util
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+
+import numpy as np
+import pandas as pd
+
+from analysis.category_tree import CategoryTree, read_tree_columns
+from analysis.engine import analyze_products
+from analysis.prices import PRICE_LOW, PRICE_OK, clean_prices, read_price_columns
+
+# Bump to invalidate every cached stage, e.g. after changing a helper the stages call
+REPORT_VERSION = 1
+INPUT_FILES = {
+    'shops_csv': 'torob_shops.csv',
+    'details_csv': 'shopinfo_detail.csv',
+    'products_csv': 'shop_products.csv',
+}
+DEFAULT_CACHE_DIR = '.report_cache'
+SAMPLE_ROWS = 100000
+SAMPLE_SEED = 42
+PERSIAN_FONTS = ['Vazirmatn', 'B Nazanin', 'Arial Unicode MS', 'DejaVu Sans']
+HASH_BLOCK = 8 * 1024 * 1024
+
+
+class Stage:
+    """One node of the report DAG"""
+
+    def __init__(self, function, inputs, after, figure):
+        self.name = function.__name__
+        self.function = function
+        self.inputs = tuple(inputs)  # Keys of INPUT_FILES, passed as paths
+        self.after = tuple(after)  # Stages whose results are passed by name
+        self.figure = figure  # Figures return PNG bytes
+
+    def __repr__(self):
+        return f"<Stage {self.name}>"
+
+
+STAGES = {}
+
+
+def stage(inputs=(), after=(), figure=False):
+    """Register a function as a stage; its parameters are named after its inputs and dependencies"""
+    def register(function):
+        STAGES[function.__name__] = Stage(function, inputs, after, figure)
+        return function
+    return register
+
+
+# --- Data stages -------------------------------------------------------------
+
+@stage(inputs=('shops_csv',))
+def shop_list(shops_csv):
+    return pd.read_csv(shops_csv)
+
+
+@stage(inputs=('details_csv',))
+def shop_details(details_csv):
+    details = pd.read_csv(details_csv)
+    if 'shop_score' in details.columns:
+        details['shop_score'] = pd.to_numeric(details['shop_score'], errors='coerce')
+    return details
+
+
+@stage(inputs=('products_csv',))
+def market(products_csv):
+    """Category, price and per-shop statistics of every product (analysis/engine.py)"""
+    return analyze_products(products_csv)
+
+
+@stage(inputs=('products_csv',), after=('market',))
+def sample(products_csv, market):
+    """Uniform random sample of SAMPLE_ROWS products for the charts"""
+    keep = min(1.0, SAMPLE_ROWS / max(market.rows, 1))
+    rng = np.random.default_rng(SAMPLE_SEED)
+    products = pd.read_csv(products_csv, skiprows=lambda row: row > 0 and rng.random() >= keep)
+    for column in ['min_price', 'max_price', 'price', 'shop_id', 'total_products_count']:
+        if column in products.columns:
+            products[column] = pd.to_numeric(products[column], errors='coerce')
+    return products
+
+
+@stage(inputs=('products_csv',))
+def price_cleaning(products_csv):
+    """Per-category robust price bounds over every product (analysis/prices.py)"""
+    return clean_prices(read_price_columns(products_csv)).bounds_only()
+
+
+@stage(after=('shop_list', 'market', 'sample'))
+def overview(shop_list, market, sample):
+    return {
+        'shops': len(shop_list),
+        'online_shops': int((shop_list['shop_type'] == 'online').sum()),
+        'cities': int(shop_list['city'].nunique()),
+        'products': market.rows,
+        'shops_with_prices': len(market.shop_stats),
+        'price_mean': market.price['mean'],
+        'price_max': market.price['max'],
+        'price_min': market.price['min'],
+        'sample_rows': len(sample),
+        'sample_missing_price': int(sample['price'].isna().sum()),
+        'sample_missing_name': int(sample['name1'].isna().sum()),
+    }
+
+
+@stage(after=('shop_list', 'shop_details'))
+def geography(shop_list, shop_details):
+    city_distribution = shop_list['city'].value_counts()
+    return {
+        'city_distribution': city_distribution,
+        'province_distribution': (shop_details['province'].value_counts().head(10)
+                                  if 'province' in shop_details.columns else None),
+        'shop_types': shop_list['shop_type'].value_counts(),
+        'scores': (shop_details['shop_score'].dropna().to_numpy()
+                   if 'shop_score' in shop_details.columns else np.empty(0)),
+        'top5_share': city_distribution.head(5).sum() / max(len(shop_list), 1) * 100,
+    }
+
+
+@stage(inputs=('products_csv',))
+def category_tree(products_csv):
+    """Category hierarchy with products per category (analysis/category_tree.py)"""
+    return CategoryTree.from_products(read_tree_columns(products_csv))
+
+
+@stage(after=('market', 'category_tree'))
+def categories(market, category_tree):
+    counts = market.category_counts
+    return {
+        'category_counts': counts,
+        'top_categories': counts.head(20).to_dict(),
+        'total_mentions': int(counts.sum()),
+        'top_level': category_tree.rollup(depth=1),
+    }
+
+
+@stage(after=('market', 'sample', 'price_cleaning'))
+def prices(market, sample, price_cleaning):
+    price = market.price
+    # Sample products within their category's robust price bounds
+    valid = sample[price_cleaning.flag(sample) == PRICE_OK]
+    top_shops = valid['shop_id'].value_counts().head(10).index
+    shop_means = (valid[valid['shop_id'].isin(top_shops)].groupby('shop_name')['price'].mean()
+                  .sort_values(ascending=False).head(10))
+    # The notebook's conservative estimate: two sales a day per product, at the
+    # mean price without category outliers
+    robust = price_cleaning.price_stats
+    daily_revenue = (robust['mean'] or 0) * robust['unfiltered_count'] * 2
+    return {
+        'stats': {
+            'mean': price['mean'], 'median': price['quantiles'][0.5], 'std': price['std'],
+            'min': price['min'], 'max': price['max'],
+            'q1': price['quantiles'][0.25], 'q3': price['quantiles'][0.75],
+        },
+        'count': price['count'],
+        'quantiles_exact': price['quantiles_exact'],
+        'robust': robust,
+        'outliers': int(price_cleaning.totals[PRICE_LOW:].sum()),
+        'revenue': {'daily': daily_revenue, 'monthly': daily_revenue * 30, 'yearly': daily_revenue * 365},
+        'price_ranges': market.price_ranges,
+        'sample_prices': valid['price'].to_numpy(),
+        'top_shop_mean_prices': shop_means,
+    }
+
+
+@stage(after=('shop_list', 'shop_details', 'market'))
+def shop_performance(shop_list, shop_details, market):
+    """Per-shop product and price summary joined to shop details, as in the notebook"""
+    summary = market.shop_stats.round(0)
+    summary.columns = ['shop_id', 'تعداد_محصول', 'میانگین_قیمت', 'حداقل_قیمت', 'حداکثر_قیمت', 'انحراف_قیمت', 'تعداد_نام']
+    detail_columns = ['id'] + [c for c in ['shop_score', 'upvotes', 'downvotes', 'province'] if c in shop_details.columns]
+
+    shop_analysis = shop_list.merge(summary, left_on='id', right_on='shop_id', how='inner')
+    shop_analysis = shop_analysis.merge(shop_details[detail_columns], on='id', how='left')
+    shop_analysis['تنوع_قیمت'] = shop_analysis['حداکثر_قیمت'] - shop_analysis['حداقل_قیمت']
+    if 'upvotes' in shop_analysis.columns and 'downvotes' in shop_analysis.columns:
+        shop_analysis['شاخص_محبوبیت'] = shop_analysis['upvotes'] - shop_analysis['downvotes']
+    else:
+        shop_analysis['شاخص_محبوبیت'] = 0
+    # Half a sale a month per product
+    shop_analysis['تخمین_درآمد_ماهانه'] = shop_analysis['تعداد_محصول'] * shop_analysis['میانگین_قیمت'] * 0.5
+
+    top_by_revenue = shop_analysis.nlargest(20, 'تخمین_درآمد_ماهانه')
+    total_revenue = shop_analysis['تخمین_درآمد_ماهانه'].sum()
+    return {
+        'shop_analysis': shop_analysis,
+        'top_by_products': shop_analysis.nlargest(20, 'تعداد_محصول'),
+        'top_by_revenue': top_by_revenue,
+        'top10_revenue_share': top_by_revenue.head(10)['تخمین_درآمد_ماهانه'].sum() / total_revenue * 100
+                               if total_revenue else 0.0,
+    }
+
+
+@stage(after=('shop_list', 'geography', 'categories', 'prices', 'shop_performance'))
+def insights(shop_list, geography, categories, prices, shop_performance):
+    shop_analysis = shop_performance['shop_analysis']
+    revenue = shop_analysis['تخمین_درآمد_ماهانه']
+    total_revenue = revenue.sum()
+    top_products = shop_performance['top_by_products']
+    top_categories = list(categories['top_categories'])
+    return {
+        'total_shops': len(shop_list),
+        'total_products': prices['count'],
+        'total_categories': len(categories['category_counts']),
+        'avg_products_per_shop': prices['count'] / len(shop_analysis) if len(shop_analysis) else 0,
+        'market_concentration': (shop_performance['top_by_revenue'].head(5)['تخمین_درآمد_ماهانه'].sum()
+                                 / total_revenue * 100) if total_revenue else 0.0,
+        'herfindahl_index': float(((revenue / total_revenue) ** 2).sum() * 10000) if total_revenue else 0.0,
+        'cities': int(shop_list['city'].nunique()),
+        'median_price': prices['stats']['median'],
+        'top_city': geography['city_distribution'].index[0] if len(geography['city_distribution']) else None,
+        'top_category': top_categories[0] if top_categories else None,
+        'largest_shop': top_products.iloc[0]['name'] if len(top_products) else None,
+        'largest_shop_products': int(top_products.iloc[0]['تعداد_محصول']) if len(top_products) else 0,
+    }
+
+
+# --- Figures -----------------------------------------------------------------
+
+def _figure(rows, cols, height):
+    from matplotlib.figure import Figure
+
+    figure = Figure(figsize=(14, height))
+    return figure, figure.subplots(rows, cols, squeeze=False)
+
+
+def _png(figure, title):
+    figure.suptitle(title, fontsize=16)
+    figure.tight_layout()
+    buffer = io.BytesIO()
+    figure.savefig(buffer, format='png', dpi=100, bbox_inches='tight')
+    return buffer.getvalue()
+
+
+def _barh(ax, series, title, xlabel, ylabel, color, fmt='{:,.0f}'):
+    series = series.iloc[::-1]  # Largest on top
+    ax.barh([str(label) for label in series.index], series.to_numpy(), color=color)
+    for i, value in enumerate(series.to_numpy()):
+        ax.text(value, i, fmt.format(value), va='center')
+    ax.set_title(title)
+    ax.set_xlabel(xlabel)
+    ax.set_ylabel(ylabel)
+
+
+def _hist(ax, values, bins, title, xlabel, ylabel, color):
+    if len(values):
+        ax.hist(values, bins=bins, color=color, edgecolor='black')
+        ax.set_title(title)
+        ax.set_xlabel(xlabel)
+        ax.set_ylabel(ylabel)
+    else:
+        ax.axis('off')
+
+
+def _pie(ax, series, title):
+    ax.pie(series.to_numpy(), labels=[str(label) for label in series.index], autopct='%1.1f%%', startangle=90)
+    ax.set_title(title)
+
+
+@stage(after=('geography',), figure=True)
+def figure_geography(geography):
+    figure, axs = _figure(2, 2, 10)
+    _barh(axs[0, 0], geography['city_distribution'].head(15), 'توزیع فروشگاه‌ها بر اساس شهر',
+          'تعداد فروشگاه', 'شهر', 'skyblue')
+    if geography['province_distribution'] is not None:
+        _pie(axs[0, 1], geography['province_distribution'], 'توزیع فروشگاه‌ها بر اساس استان')
+    else:
+        axs[0, 1].axis('off')
+    _pie(axs[1, 0], geography['shop_types'], 'نوع فروشگاه‌ها')
+    _hist(axs[1, 1], geography['scores'], 20, 'امتیاز فروشگاه‌ها', 'امتیاز', 'تعداد', 'orange')
+    return _png(figure, 'تحلیل جغرافیایی و توزیع فروشگاه‌های ترب')
+
+
+@stage(after=('categories', 'sample'), figure=True)
+def figure_categories(categories, sample):
+    figure, axs = _figure(2, 2, 10)
+    counts = categories['category_counts']
+    _barh(axs[0, 0], counts.head(15), '20 دسته‌بندی برتر', 'تعداد محصول', 'دسته‌بندی', 'seagreen')
+    _hist(axs[0, 1], counts.to_numpy(), 30, 'توزیع تعداد محصولات در دسته‌بندی‌ها',
+          'تعداد محصولات', 'تعداد دسته‌بندی‌ها', 'lightcoral')
+    if importlib.util.find_spec('squarify') is not None:
+        import squarify
+
+        top = counts.head(10)
+        squarify.plot(sizes=top.to_numpy(), label=list(top.index), alpha=.8, ax=axs[1, 0])
+        axs[1, 0].set_title('Treemap دسته‌بندی‌ها')
+    else:
+        axs[1, 0].axis('off')
+    priced = sample[sample['price'].notna() & sample['categories'].notna()]
+    priced = priced.sample(min(1000, len(priced)), random_state=SAMPLE_SEED)
+    if len(priced):
+        axs[1, 1].scatter(priced['price'], range(len(priced)), color='blue', alpha=0.6, s=10)
+        axs[1, 1].set_title('تحلیل قیمت بر اساس دسته‌بندی (نمونه)')
+        axs[1, 1].set_xlabel('قیمت محصولات')
+        axs[1, 1].set_ylabel('محصولات')
+    else:
+        axs[1, 1].axis('off')
+    return _png(figure, 'تحلیل جامع دسته‌بندی محصولات')
+
+
+@stage(after=('prices',), figure=True)
+def figure_prices(prices):
+    figure, axs = _figure(2, 2, 10)
+    _hist(axs[0, 0], prices['sample_prices'], 50, 'توزیع قیمت محصولات', 'قیمت', 'تعداد', 'lightblue')
+    if len(prices['sample_prices']):
+        axs[0, 1].boxplot(prices['sample_prices'])
+    axs[0, 1].set_title('جعبه‌ای قیمت‌ها')
+    axs[0, 1].set_ylabel('قیمت')
+    _barh(axs[1, 0], prices['top_shop_mean_prices'], 'میانگین قیمت فروشگاه‌ها', 'میانگین قیمت', 'فروشگاه‌ها', 'purple')
+    metrics = {
+        'میانگین قیمت': prices['stats']['mean'],
+        'حداکثر قیمت': prices['stats']['max'],
+        'تخمین درآمد روزانه': prices['revenue']['daily'],
+        'تخمین درآمد ماهانه': prices['revenue']['monthly'],
+        'تخمین درآمد سالانه': prices['revenue']['yearly'],
+    }
+    for i, (label, value) in enumerate(metrics.items()):
+        axs[1, 1].text(0.5, 1 - i * 0.15, f"{label}: {value:,.0f} تومان", ha='center', va='center', fontsize=14,
+                       bbox=dict(facecolor='white', alpha=0.8, edgecolor='gray', boxstyle='round,pad=0.3'))
+    axs[1, 1].axis('off')
+    return _png(figure, 'تحلیل جامع قیمت‌ها و معیارهای مالی بازار ترب')
+
+
+@stage(after=('shop_performance',), figure=True)
+def figure_shops(shop_performance):
+    figure, axs = _figure(3, 2, 15)
+    shop_analysis = shop_performance['shop_analysis']
+    by_products = shop_performance['top_by_products'].set_index('name')['تعداد_محصول']
+    by_revenue = shop_performance['top_by_revenue'].set_index('name')['تخمین_درآمد_ماهانه']
+    _barh(axs[0, 0], by_products, 'فروشگاه‌های برتر بر اساس تعداد محصول', 'تعداد محصول', 'فروشگاه‌ها', 'teal')
+    _barh(axs[0, 1], by_revenue, 'فروشگاه‌های برتر بر اساس درآمد تخمینی', 'درآمد تخمینی (تومان)', 'فروشگاه‌ها', 'firebrick')
+    axs[1, 0].scatter(shop_analysis['تعداد_محصول'], shop_analysis['میانگین_قیمت'], color='purple', alpha=0.6, s=10)
+    axs[1, 0].set_title('رابطه تعداد محصول و میانگین قیمت')
+    axs[1, 0].set_xlabel('تعداد محصول')
+    axs[1, 0].set_ylabel('میانگین قیمت')
+    scores = shop_analysis['shop_score'].dropna().to_numpy() if 'shop_score' in shop_analysis.columns else []
+    _hist(axs[1, 1], scores, 20, 'توزیع امتیاز فروشگاه‌ها', 'امتیاز', 'تعداد', 'orange')
+    cities = shop_analysis['city'].value_counts().head(5).index
+    city_prices = [shop_analysis.loc[shop_analysis['city'] == city, 'میانگین_قیمت'].dropna().to_numpy() for city in cities]
+    if len(cities):
+        axs[2, 0].boxplot(city_prices, tick_labels=[str(city) for city in cities])
+    axs[2, 0].set_title('تحلیل رقابت قیمتی (بر اساس شهر)')
+    axs[2, 0].set_ylabel('میانگین قیمت')
+    axs[2, 0].set_xlabel('شهرها')
+    if len(shop_analysis):
+        axs[2, 1].violinplot(shop_analysis['تعداد_محصول'].to_numpy())
+    axs[2, 1].set_title('توزیع تعداد محصول در فروشگاه‌ها')
+    axs[2, 1].set_ylabel('تعداد محصول')
+    return _png(figure, 'تحلیل جامع عملکرد فروشگاه‌ها و رقابت')
+
+
+@stage(after=('insights', 'geography', 'categories', 'shop_performance'), figure=True)
+def figure_insights(insights, geography, categories, shop_performance):
+    figure, axs = _figure(2, 3, 10)
+    shop_analysis = shop_performance['shop_analysis']
+    axs[0, 0].text(0.5, 0.5, f"تعداد کل فروشگاه‌ها: {insights['total_shops']:,}", ha='center', va='center', fontsize=16,
+                   bbox=dict(facecolor='lightblue', alpha=0.8, edgecolor='gray', boxstyle='round,pad=0.3'))
+    axs[0, 0].axis('off')
+    cities = geography['city_distribution']
+    concentration = pd.concat([cities.head(8), pd.Series({'سایر شهرها': cities.iloc[8:].sum()})])
+    _pie(axs[0, 1], concentration, 'تمرکز جغرافیایی')
+    _barh(axs[0, 2], categories['category_counts'].head(10), 'تنوع دسته‌بندی‌ها', 'تعداد محصولات', 'دسته‌بندی‌ها', 'seagreen')
+    competition = shop_analysis.groupby('city')['میانگین_قیمت'].std().sort_values(ascending=False).head(10)
+    axs[1, 0].scatter([str(city) for city in competition.index], competition.to_numpy(), color='purple', s=100, alpha=0.7)
+    axs[1, 0].set_title('سطح رقابت قیمتی')
+    axs[1, 0].set_xlabel('شهرها')
+    axs[1, 0].set_ylabel('انحراف معیار قیمت')
+    scores = shop_analysis['shop_score'].dropna().to_numpy() if 'shop_score' in shop_analysis.columns else []
+    _hist(axs[1, 1], scores, 10, 'کیفیت فروشگاه‌ها', 'امتیاز', 'تعداد', 'orange')
+    axs[1, 2].axis('off')
+    return _png(figure, 'داشبورد جامع بینش‌های بازار ترب')
+
+
+# --- Pipeline ----------------------------------------------------------------
+
+def _hash_file(path):
+    digest = hashlib.blake2b(digest_size=16)
+    with open(path, 'rb') as file:
+        for block in iter(lambda: file.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def _run_stage(name, kwargs, result_path):
+    """Worker side: load dependency results, run the stage, store its result; returns its digest and run time"""
+    args = {}
+    for key, (kind, value) in kwargs.items():
+        if kind == 'result':
+            with open(value, 'rb') as file:
+                args[key] = pickle.load(file)
+        else:
+            args[key] = value
+    started = time.time()
+    if STAGES[name].figure:
+        import matplotlib
+
+        # One 'font not found' line per missing fallback font and figure otherwise
+        logging.getLogger('matplotlib.font_manager').setLevel(logging.ERROR)
+        with matplotlib.rc_context({'font.family': PERSIAN_FONTS, 'axes.unicode_minus': False}):
+            result = STAGES[name].function(**args)
+    else:
+        result = STAGES[name].function(**args)
+    data = pickle.dumps(result, protocol=pickle.HIGHEST_PROTOCOL)
+    digest = hashlib.blake2b(data, digest_size=16).hexdigest()
+    temporary = result_path + '.tmp'
+    with open(temporary, 'wb') as file:
+        file.write(data)
+    os.replace(temporary, result_path)
+    # The digest file marks the result complete
+    with open(result_path[:-len('.pkl')] + '.digest', 'w') as file:
+        file.write(digest)
+    return digest, time.time() - started
+
+
+class ReportPipeline:
+    """Runs report stages over the CSVs in data_dir, caching every result in cache_dir"""
+
+    def __init__(self, data_dir='.', cache_dir=None, workers=None):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir or os.path.join(data_dir, DEFAULT_CACHE_DIR)
+        self.workers = workers or os.cpu_count() or 1
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self._file_digests = None
+        self._results = {}  # name -> (result path, digest)
+        self.ran = []
+        self.cached = []
+
+    def path(self, input_name):
+        return os.path.join(self.data_dir, INPUT_FILES[input_name])
+
+    def _input_digests(self):
+        """Content digest of every input file, rehashing only files whose size or mtime changed"""
+        if self._file_digests is not None:
+            return self._file_digests
+        index_path = os.path.join(self.cache_dir, 'files.json')
+        known = {}
+        if os.path.exists(index_path):
+            with open(index_path, encoding='utf-8') as file:
+                known = json.load(file)
+
+        digests, stale = {}, []
+        for name in INPUT_FILES:
+            path = os.path.abspath(self.path(name))
+            stat = os.stat(path)
+            entry = known.get(path)
+            if entry and entry[:2] == [stat.st_size, stat.st_mtime_ns]:
+                digests[name] = entry[2]
+            else:
+                stale.append((name, path, stat))
+        with ThreadPoolExecutor(max_workers=len(stale) or 1) as pool:
+            for (name, path, stat), digest in zip(stale, pool.map(_hash_file, [path for _, path, _ in stale])):
+                digests[name] = digest
+                known[path] = [stat.st_size, stat.st_mtime_ns, digest]
+        if stale:
+            with open(index_path, 'w', encoding='utf-8') as file:
+                json.dump(known, file, indent=1)
+        self._file_digests = digests
+        return digests
+
+    def _key(self, stage):
+        digest = hashlib.blake2b(digest_size=16)
+        digest.update(f"{REPORT_VERSION}\0{stage.name}\0".encode())
+        digest.update(inspect.getsource(stage.function).encode())
+        files = self._input_digests()
+        for name in stage.inputs:
+            digest.update(f"\0{name}={files[name]}".encode())
+        for name in stage.after:
+            digest.update(f"\0{name}={self._results[name][1]}".encode())
+        return digest.hexdigest()
+
+    def _cached(self, result_path):
+        digest_path = result_path[:-len('.pkl')] + '.digest'
+        if os.path.exists(result_path) and os.path.exists(digest_path):
+            with open(digest_path) as file:
+                return file.read().strip() or None
+        return None
+
+    def _prune(self, name, keep):
+        """Drop results of a stage other than the current one"""
+        for entry in os.listdir(self.cache_dir):
+            stem, _, extension = entry.rpartition('.')
+            if stem.rpartition('-')[0] == name and extension in ('pkl', 'digest') and stem != keep:
+                os.remove(os.path.join(self.cache_dir, entry))
+
+    def resolve(self, targets=None, force=()):
+        """Bring targets (default: every stage) and their dependencies up to date
+
+        force names stages to recompute even when cached. Returns the
+        stages recomputed, in completion order.
+        """
+        targets = list(STAGES) if targets is None else list(targets)
+        needed, stack = set(), list(targets)
+        while stack:
+            name = stack.pop()
+            if name not in needed:
+                needed.add(name)
+                stack.extend(STAGES[name].after)
+
+        pending = needed - set(self._results)
+        running = {}
+        ran = []
+        pool = None
+        try:
+            while pending or running:
+                ready = [name for name in pending if all(dep in self._results for dep in STAGES[name].after)]
+                for name in sorted(ready):
+                    pending.discard(name)
+                    stage = STAGES[name]
+                    stem = f"{name}-{self._key(stage)}"
+                    result_path = os.path.join(self.cache_dir, stem + '.pkl')
+                    digest = None if name in force else self._cached(result_path)
+                    if digest is not None:
+                        self._results[name] = (result_path, digest)
+                        self.cached.append(name)
+                        continue
+                    kwargs = {key: ('path', self.path(key)) for key in stage.inputs}
+                    kwargs.update({key: ('result', self._results[key][0]) for key in stage.after})
+                    if pool is None:
+                        pool = ProcessPoolExecutor(max_workers=self.workers)
+                    running[pool.submit(_run_stage, name, kwargs, result_path)] = (name, stem)
+                if ready:
+                    continue  # Cache hits may have unblocked more stages
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name, stem = running.pop(future)
+                    digest, seconds = future.result()
+                    self._results[name] = (os.path.join(self.cache_dir, stem + '.pkl'), digest)
+                    self._prune(name, stem)
+                    ran.append(name)
+                    self.ran.append((name, seconds))
+        finally:
+            if pool is not None:
+                pool.shutdown(cancel_futures=True)
+        return ran
+
+    def get(self, name):
+        """Result of one stage, computed or read from the cache"""
+        self.resolve([name])
+        with open(self._results[name][0], 'rb') as file:
+            return pickle.load(file)
+
+    def run(self, output_dir, force=()):
+        """Write report.json, report.md and the figures of every stage to output_dir"""
+        names = [name for name, stage in STAGES.items() if not stage.figure or _has_matplotlib()]
+        self.resolve(names, force)
+        os.makedirs(output_dir, exist_ok=True)
+        figures = []
+        for name in names:
+            if STAGES[name].figure:
+                figures.append(f'{name}.png')
+                with open(os.path.join(output_dir, figures[-1]), 'wb') as file:
+                    file.write(self.get(name))
+        summary = {name: _jsonable(self.get(name)) for name in ('overview', 'categories', 'prices', 'insights')}
+        summary['geography'] = _jsonable({key: value for key, value in self.get('geography').items() if key != 'scores'})
+        with open(os.path.join(output_dir, 'report.json'), 'w', encoding='utf-8') as file:
+            json.dump(summary, file, ensure_ascii=False, indent=1)
+        with open(os.path.join(output_dir, 'report.md'), 'w', encoding='utf-8') as file:
+            file.write(_markdown(summary, figures))
+        return summary
+
+
+def _has_matplotlib():
+    return importlib.util.find_spec('matplotlib') is not None
+
+
+def _jsonable(value, limit=50):
+    """Stage results for report.json: series become {label: value} (first limit), arrays are dropped"""
+    if isinstance(value, dict):
+        return {str(key): _jsonable(item, limit) for key, item in value.items()
+                if not isinstance(item, (np.ndarray, pd.DataFrame))}
+    if isinstance(value, pd.Series):
+        return {str(key): _jsonable(item) for key, item in value.head(limit).items()}
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, float) and not np.isfinite(value):
+        return None
+    return value
+
+
+def _markdown(summary, figures):
+    overview, prices, insights = summary['overview'], summary['prices'], summary['insights']
+    lines = [
+        '# گزارش تحلیل بازار ترب',
+        '',
+        '## نمای کلی',
+        f"- تعداد کل فروشگاه‌ها: {overview['shops']:,}",
+        f"- تعداد شهرهای پوشش داده شده: {overview['cities']:,}",
+        f"- تعداد محصولات تحلیل شده: {overview['products']:,}",
+        f"- تعداد دسته‌بندی‌های منحصر به فرد: {insights['total_categories']:,}",
+        '',
+        '## قیمت‌ها',
+        f"- میانگین قیمت: {prices['stats']['mean'] or 0:,.0f} تومان",
+        f"- میانه قیمت: {prices['stats']['median'] or 0:,.0f} تومان",
+        f"- میانگین قیمت بدون قیمت‌های پرت هر دسته‌بندی: {prices['robust']['mean'] or 0:,.0f} تومان"
+        f" ({prices['outliers']:,} قیمت پرت)",
+        f"- تخمین درآمد سالانه بازار: {prices['revenue']['yearly'] or 0:,.0f} تومان",
+        '',
+        '## فروشگاه‌ها',
+        f"- تمرکز بازار: {insights['market_concentration']:.1f}% از درآمد در اختیار 5 فروشگاه برتر",
+        f"- شاخص هرفیندال: {insights['herfindahl_index']:.0f}",
+        f"- میانگین محصول هر فروشگاه: {insights['avg_products_per_shop']:.0f}",
+        f"- بزرگترین فروشگاه: {insights['largest_shop']} با {insights['largest_shop_products']:,} محصول",
+        '',
+        '## دسته‌بندی‌های پرطرفدار',
+    ]
+    lines += [f"{i}. {title}: {count:,}" for i, (title, count) in enumerate(list(summary['categories']['top_categories'].items())[:10], 1)]
+    lines += ['', '## گروه‌های اصلی دسته‌بندی']
+    lines += [f"- {title}: {count:,}" for title, count in summary['categories']['top_level'].items()]
+    lines += [''] + [f"![{name[:-4]}]({name})" for name in figures]
+    return '\n'.join(lines) + '\n'
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build the market report from cached stages")
+    parser.add_argument('--data-dir', default='.', help="Directory with the crawler CSVs")
+    parser.add_argument('--output', default='report', help="Directory for report.md, report.json and figures")
+    parser.add_argument('--cache-dir', help=f"Stage cache (default: DATA_DIR/{DEFAULT_CACHE_DIR})")
+    parser.add_argument('--workers', type=int, help="Processes (default: all cores)")
+    parser.add_argument('--force', nargs='*', default=(), metavar='STAGE', help="Recompute these stages")
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    pipeline = ReportPipeline(args.data_dir, args.cache_dir, args.workers)
+    if not _has_matplotlib():
+        print("⚠️ matplotlib is not installed: figures are skipped (pip install matplotlib)")
+    pipeline.run(args.output, force=set(args.force))
+    for name, seconds in pipeline.ran:
+        print(f"   ran {name} in {seconds:.1f}s")
+    print(f"✅ Report in {args.output}: {len(pipeline.ran)} stages ran, {len(pipeline.cached)} cached,"
+          f" {time.time() - started:.1f}s")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
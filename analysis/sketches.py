@@ -0,0 +1,484 @@
+"""
+Mergeable sketches of the product table, built in one streaming pass
+
+The full shop_products.csv does not fit in memory, and a head(100000)
+sample is biased towards whichever shops the crawler visited first. A
+MarketSketch reads the file in chunks and keeps a few kilobytes of state
+per statistic:
+
+- Price quantiles: a KLL sketch. With the default k=200 a quantile's rank
+  is within about 1.3% of the true rank (99% confidence): the reported
+  median lies between the true 48.7th and 51.3rd percentiles. Count, sum,
+  mean, standard deviation, min and max are exact.
+- Distinct shops and products: HyperLogLog with 2**14 registers, relative
+  standard error 1.04 / sqrt(2**14) = 0.81% (within 2.4% at 99.7%).
+- Top categories: count-min sketch (4 x 2048 counters) plus a candidate
+  list. Counts are never underestimated and overestimate by at most
+  e / 2048 * total (0.13% of all category mentions) with probability
+  1 - e**-4 = 98%.
+
+Sketches built from separate files or chunks can be merged, and are saved
+as JSON so the notebook and the backend load them instantly:
+
+    python -m analysis.sketches shop_products.csv -o products_sketch.json
+"""
+
+import sys
+import json
+import math
+import time
+import base64
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from analysis.categories import count_titles
+
+CHUNK_ROWS = 500000
+# Same sanity ceiling the notebook uses for prices (toman)
+PRICE_CEILING = 1e9
+DEFAULT_QUANTILES = (0.01, 0.1, 0.25, 0.5, 0.75, 0.9, 0.99)
+SKETCH_COLUMNS = ['shop_id', 'random_key', 'price', 'categories']
+
+
+def _encode_array(array):
+    return {'dtype': str(array.dtype), 'data': base64.b64encode(np.ascontiguousarray(array).tobytes()).decode('ascii')}
+
+
+def _decode_array(value, shape=None):
+    array = np.frombuffer(base64.b64decode(value['data']), dtype=value['dtype']).copy()
+    return array.reshape(shape) if shape is not None else array
+
+
+def _hash64(values):
+    """Stable 64-bit hashes of an array (same value -> same hash in every process)"""
+    return pd.util.hash_array(np.asarray(values))
+
+
+class QuantileSketch:
+    """KLL quantile sketch over floats
+
+    Items live in levels of compactors; an item on level h stands for 2**h
+    inputs. When a level outgrows its capacity it is sorted and every other
+    item (random offset) moves up a level.
+    """
+
+    def __init__(self, k=200, seed=0):
+        self.k = k
+        self.levels = [np.empty(0)]
+        self.count = 0
+        self.sum = 0.0
+        # Sum of squared deviations from the mean, merged with Chan's formula
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+        self._rng = np.random.default_rng(seed)
+
+    @property
+    def rank_error(self):
+        """Normalized rank error of one quantile at 99% confidence
+
+        Empirical fit published with Apache DataSketches' KLL sketch.
+        """
+        return 2.296 / self.k ** 0.9723
+
+    def _capacity(self, level):
+        depth = len(self.levels) - level - 1
+        return max(int(math.ceil(self.k * (2 / 3) ** depth)), 2)
+
+    def update(self, values):
+        values = np.asarray(values, dtype=float)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+        self._add_moments(len(values), float(values.sum()), float(np.square(values - values.mean()).sum()))
+        self.min = min(self.min, float(values.min()))
+        self.max = max(self.max, float(values.max()))
+        self.levels[0] = np.concatenate([self.levels[0], values])
+        self._compress()
+
+    def merge(self, other):
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for level, items in enumerate(other.levels):
+            self.levels[level] = np.concatenate([self.levels[level], items])
+        self._add_moments(other.count, other.sum, other.m2)
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self._compress()
+        return self
+
+    def _add_moments(self, count, total, m2):
+        if not count:
+            return
+        if self.count:
+            delta = total / count - self.sum / self.count
+            m2 += delta * delta * self.count * count / (self.count + count)
+        self.m2 += m2
+        self.count += count
+        self.sum += total
+
+    def _compress(self):
+        level = 0
+        while level < len(self.levels):
+            items = self.levels[level]
+            if len(items) > self._capacity(level):
+                if level + 1 == len(self.levels):
+                    self.levels.append(np.empty(0))
+                items = np.sort(items)
+                # An odd item out stays behind at its own weight
+                keep = items[-1:] if len(items) % 2 else items[:0]
+                pairs = items[:len(items) - len(keep)]
+                promoted = pairs[self._rng.integers(2)::2]
+                self.levels[level] = keep
+                self.levels[level + 1] = np.concatenate([self.levels[level + 1], promoted])
+                # Growing the stack shrinks lower capacities, so start over
+                level = 0
+                continue
+            level += 1
+
+    def _weighted(self):
+        items = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(items), 2 ** level, dtype=np.int64)
+                                  for level, items in enumerate(self.levels)])
+        order = np.argsort(items, kind='stable')
+        return items[order], np.cumsum(weights[order])
+
+    def quantiles(self, qs):
+        """Approximate values at each fraction in qs (0 gives min, 1 max)"""
+        if not self.count:
+            return [None for _ in qs]
+        items, cumulative = self._weighted()
+        total = cumulative[-1]
+        result = []
+        for q in qs:
+            if q <= 0:
+                result.append(self.min)
+            elif q >= 1:
+                result.append(self.max)
+            else:
+                result.append(float(items[min(np.searchsorted(cumulative, q * total), len(items) - 1)]))
+        return result
+
+    def quantile(self, q):
+        return self.quantiles([q])[0]
+
+    def rank(self, value):
+        """Approximate fraction of inputs <= value"""
+        if not self.count:
+            return 0.0
+        items, cumulative = self._weighted()
+        position = np.searchsorted(items, value, side='right')
+        return float(cumulative[position - 1] / cumulative[-1]) if position else 0.0
+
+    @property
+    def mean(self):
+        return self.sum / self.count if self.count else None
+
+    @property
+    def std(self):
+        """Sample standard deviation, like pandas' Series.std"""
+        if self.count < 2:
+            return None
+        return math.sqrt(self.m2 / (self.count - 1))
+
+    def to_dict(self):
+        return {
+            'k': self.k,
+            'levels': [_encode_array(items) for items in self.levels],
+            'count': self.count,
+            'sum': self.sum,
+            'm2': self.m2,
+            'min': self.min if self.count else None,
+            'max': self.max if self.count else None,
+        }
+
+    @classmethod
+    def from_dict(cls, value):
+        sketch = cls(k=value['k'])
+        sketch.levels = [_decode_array(items) for items in value['levels']]
+        sketch.count = value['count']
+        sketch.sum = value['sum']
+        sketch.m2 = value['m2']
+        sketch.min = value['min'] if value['min'] is not None else math.inf
+        sketch.max = value['max'] if value['max'] is not None else -math.inf
+        return sketch
+
+
+class HyperLogLog:
+    """Distinct count estimate from 2**p one-byte registers"""
+
+    def __init__(self, p=14):
+        self.p = p
+        self.registers = np.zeros(2 ** p, dtype=np.uint8)
+
+    @property
+    def relative_error(self):
+        """Relative standard error of count()"""
+        return 1.04 / math.sqrt(len(self.registers))
+
+    def update(self, values):
+        if not len(values):
+            return
+        hashes = _hash64(values)
+        index = (hashes >> np.uint64(64 - self.p)).astype(np.int64)
+        rest = hashes << np.uint64(self.p)
+        # Position of the first 1 bit in the remaining 64 - p bits; frexp
+        # is exact on 32-bit halves
+        high = (rest >> np.uint64(32)).astype(np.float64)
+        low = (rest & np.uint64(0xFFFFFFFF)).astype(np.float64)
+        leading = np.where(high > 0, 32 - np.frexp(high)[1], 64 - np.frexp(low)[1])
+        rho = np.minimum(leading + 1, 64 - self.p + 1).astype(np.uint8)
+        np.maximum.at(self.registers, index, rho)
+
+    def merge(self, other):
+        if other.p != self.p:
+            raise ValueError(f"Cannot merge HyperLogLog sketches with p={self.p} and p={other.p}")
+        np.maximum(self.registers, other.registers, out=self.registers)
+        return self
+
+    def count(self):
+        m = len(self.registers)
+        alpha = 0.7213 / (1 + 1.079 / m)
+        estimate = alpha * m * m / np.sum(np.ldexp(1.0, -self.registers.astype(np.int64)))
+        zeros = int(np.count_nonzero(self.registers == 0))
+        if estimate <= 2.5 * m and zeros:
+            # Small cardinalities: linear counting is more accurate
+            estimate = m * math.log(m / zeros)
+        return int(round(estimate))
+
+    def to_dict(self):
+        return {'p': self.p, 'registers': _encode_array(self.registers)}
+
+    @classmethod
+    def from_dict(cls, value):
+        sketch = cls(p=value['p'])
+        sketch.registers = _decode_array(value['registers'])
+        return sketch
+
+
+class TopK:
+    """Heavy hitters from a count-min sketch and a bounded candidate list"""
+
+    def __init__(self, k=50, width=2048, depth=4):
+        self.k = k
+        self.width = width
+        self.depth = depth
+        self.table = np.zeros((depth, width), dtype=np.int64)
+        self.total = 0
+        self.candidates = {}
+
+    @property
+    def max_overcount(self):
+        """Bound on how much any count is overestimated (probability 1 - e**-depth)"""
+        return int(math.ceil(math.e / self.width * self.total))
+
+    def _columns(self, items):
+        hashes = _hash64(np.asarray(items, dtype=object))
+        first = (hashes & np.uint64(0xFFFFFFFF)).astype(np.int64)
+        second = (hashes >> np.uint64(32)).astype(np.int64) | 1
+        return [(first + row * second) % self.width for row in range(self.depth)]
+
+    def _estimate(self, columns):
+        return np.min([self.table[row, cols] for row, cols in enumerate(columns)], axis=0)
+
+    def update(self, items, counts=None):
+        """Add items, each counts[i] times (once when counts is None)"""
+        items = list(items)
+        if not items:
+            return
+        counts = np.ones(len(items), dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+        columns = self._columns(items)
+        for row, cols in enumerate(columns):
+            np.add.at(self.table[row], cols, counts)
+        self.total += int(counts.sum())
+        estimates = self._estimate(columns)
+        for item, estimate in zip(items, estimates.tolist()):
+            self.candidates[item] = estimate
+        self._trim()
+
+    def _trim(self):
+        capacity = 4 * self.k
+        if len(self.candidates) > capacity:
+            kept = sorted(self.candidates.items(), key=lambda pair: pair[1], reverse=True)[:capacity]
+            self.candidates = dict(kept)
+
+    def merge(self, other):
+        if (other.width, other.depth) != (self.width, self.depth):
+            raise ValueError("Cannot merge count-min sketches of different shapes")
+        self.table += other.table
+        self.total += other.total
+        items = list(set(self.candidates) | set(other.candidates))
+        if items:
+            estimates = self._estimate(self._columns(items))
+            self.candidates = dict(zip(items, estimates.tolist()))
+        self._trim()
+        return self
+
+    def top(self, n=None):
+        """[(item, estimated count), ...], most frequent first"""
+        ranked = sorted(self.candidates.items(), key=lambda pair: pair[1], reverse=True)
+        return ranked[:n or self.k]
+
+    def to_dict(self):
+        return {
+            'k': self.k,
+            'width': self.width,
+            'depth': self.depth,
+            'table': _encode_array(self.table),
+            'total': self.total,
+            'candidates': self.candidates,
+        }
+
+    @classmethod
+    def from_dict(cls, value):
+        sketch = cls(k=value['k'], width=value['width'], depth=value['depth'])
+        sketch.table = _decode_array(value['table'], shape=(sketch.depth, sketch.width))
+        sketch.total = value['total']
+        sketch.candidates = dict(value['candidates'])
+        return sketch
+
+
+class MarketSketch:
+    """Prices, distinct shops/products and top categories of a product table"""
+
+    VERSION = 1
+
+    def __init__(self, k=200, p=14, top_k=50):
+        self.rows = 0
+        self.prices = QuantileSketch(k=k)
+        self.shops = HyperLogLog(p=p)
+        self.products = HyperLogLog(p=p)
+        self.categories = TopK(k=top_k)
+
+    def update(self, frame):
+        """Add one chunk of the product table"""
+        self.rows += len(frame)
+
+        price = pd.to_numeric(frame['price'], errors='coerce').to_numpy(dtype=float, na_value=np.nan)
+        self.prices.update(price[(price > 0) & (price < PRICE_CEILING)])
+
+        shop_ids = pd.to_numeric(frame['shop_id'], errors='coerce').dropna()
+        self.shops.update(shop_ids.to_numpy(dtype=np.int64))
+        self.products.update(frame['random_key'].dropna().astype(str).to_numpy(dtype=object))
+
+        # Category strings repeat across a shop's products; parse each
+        # distinct one once and weight it by its row count
+        totals = count_titles(frame['categories'].dropna().astype(str).value_counts())
+        if len(totals):
+            self.categories.update(totals.index.tolist(), totals.to_numpy())
+        return self
+
+    def merge(self, other):
+        self.rows += other.rows
+        self.prices.merge(other.prices)
+        self.shops.merge(other.shops)
+        self.products.merge(other.products)
+        self.categories.merge(other.categories)
+        return self
+
+    @classmethod
+    def from_frame(cls, frame, chunk_rows=CHUNK_ROWS, **options):
+        sketch = cls(**options)
+        for start in range(0, len(frame), chunk_rows):
+            sketch.update(frame.iloc[start:start + chunk_rows])
+        return sketch
+
+    @classmethod
+    def from_csv(cls, path, chunk_rows=CHUNK_ROWS, progress=False, **options):
+        """One streaming pass over a shop_products.csv, reading only the needed columns"""
+        sketch = cls(**options)
+        started = time.time()
+        for chunk in pd.read_csv(path, usecols=lambda col: col in SKETCH_COLUMNS,
+                                 chunksize=chunk_rows, low_memory=False):
+            sketch.update(chunk)
+            if progress:
+                print(f"   {sketch.rows:,} products ({time.time() - started:.0f}s)", file=sys.stderr)
+        return sketch
+
+    def summary(self, quantiles=DEFAULT_QUANTILES, top=20):
+        """Plain dict of every estimate together with its error bound"""
+        return {
+            'rows': self.rows,
+            'price': {
+                'count': self.prices.count,
+                'mean': self.prices.mean,
+                'std': self.prices.std,
+                'min': self.prices.min if self.prices.count else None,
+                'max': self.prices.max if self.prices.count else None,
+                'quantiles': dict(zip((f"{q:g}" for q in quantiles), self.prices.quantiles(quantiles))),
+                'rank_error': round(self.prices.rank_error, 4),
+            },
+            'distinct_shops': {
+                'estimate': self.shops.count(),
+                'relative_error': round(self.shops.relative_error, 4),
+            },
+            'distinct_products': {
+                'estimate': self.products.count(),
+                'relative_error': round(self.products.relative_error, 4),
+            },
+            'top_categories': [
+                {'category': title, 'count': count} for title, count in self.categories.top(top)
+            ],
+            'category_mentions': self.categories.total,
+            'category_max_overcount': self.categories.max_overcount,
+        }
+
+    def to_dict(self):
+        return {
+            'version': self.VERSION,
+            'rows': self.rows,
+            'prices': self.prices.to_dict(),
+            'shops': self.shops.to_dict(),
+            'products': self.products.to_dict(),
+            'categories': self.categories.to_dict(),
+        }
+
+    @classmethod
+    def from_dict(cls, value):
+        if value.get('version') != cls.VERSION:
+            raise ValueError(f"Unsupported sketch version: {value.get('version')}")
+        sketch = cls()
+        sketch.rows = value['rows']
+        sketch.prices = QuantileSketch.from_dict(value['prices'])
+        sketch.shops = HyperLogLog.from_dict(value['shops'])
+        sketch.products = HyperLogLog.from_dict(value['products'])
+        sketch.categories = TopK.from_dict(value['categories'])
+        return sketch
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_dict(), f, ensure_ascii=False)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding='utf-8') as f:
+            return cls.from_dict(json.load(f))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build a MarketSketch from shop_products.csv files")
+    parser.add_argument('paths', nargs='+', help="Product CSVs; their sketches are merged")
+    parser.add_argument('-o', '--output', default='products_sketch.json')
+    parser.add_argument('--k', type=int, default=200, help="KLL accuracy parameter")
+    parser.add_argument('--chunk-rows', type=int, default=CHUNK_ROWS)
+    args = parser.parse_args(argv)
+
+    started = time.time()
+    sketch = MarketSketch(k=args.k)
+    for path in args.paths:
+        sketch.merge(MarketSketch.from_csv(path, chunk_rows=args.chunk_rows, progress=True, k=args.k))
+    sketch.save(args.output)
+
+    summary = sketch.summary()
+    print(f"✅ {summary['rows']:,} products sketched in {time.time() - started:.1f}s → {args.output}")
+    print(f"   median price ≈ {summary['price']['quantiles']['0.5']:,.0f}"
+          f" (rank ±{summary['price']['rank_error']:.1%}),"
+          f" ≈ {summary['distinct_shops']['estimate']:,} shops,"
+          f" ≈ {summary['distinct_products']['estimate']:,} products")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,2 +1,2 @@
-products_url = 'https://api.torob.com/v4/internet-shop/base-product/list/?shop_id={shop_id}&available=true&page={page}&size=30000&source=next_desktop'
+products_url = 'https://api.torob.com/v4/internet-shop/base-product/list/?shop_id={shop_id}&available=true&page={page}&size={size}&source=next_desktop'
 
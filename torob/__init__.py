@@ -0,0 +1,43 @@
+"""
+The Torob crawlers as an importable package
+
+    python -m torob shops                  shop list -> torob_shops.csv
+    python -m torob details                shop details -> shopinfo_detail.csv
+    python -m torob census                 products per shop -> shop_census.csv
+    python -m torob products               every shop's products -> shop_products.csv
+    python -m torob reflatten DIR OUTPUT   a CSV rebuilt from archived raw responses
+
+Importing the package or any of its modules starts no crawl, and pandas,
+aiohttp and tqdm are imported only by the functions that use them. The
+fetch and flatten functions are also importable from the package itself,
+which loads their module on first use:
+
+    from torob import fetch_shop_products, flatten_product_data
+"""
+
+import importlib
+
+_EXPORTS = {
+    'fetch_shops': 'torob.shops',
+    'scrape_all_shops': 'torob.shops',
+    'fetch_shop_info': 'torob.details',
+    'flatten_shop_info': 'torob.details',
+    'fetch_shop_products': 'torob.products',
+    'crawl_all_pages_for_shop': 'torob.products',
+    'fetch_product_count': 'torob.products',
+    'flatten_product_data': 'torob.products',
+    'flatten_product_fields': 'torob.products',
+    'flatten_page_data': 'torob.products',
+    'ProductBuffer': 'torob.buffer',
+    'ProductStore': 'torob.store',
+    'ResponseArchive': 'torob.archive',
+}
+
+__all__ = list(_EXPORTS)
+
+
+def __getattr__(name):
+    module = _EXPORTS.get(name)
+    if module is None:
+        raise AttributeError(f"module 'torob' has no attribute {name!r}")
+    return getattr(importlib.import_module(module), name)
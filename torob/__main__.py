@@ -0,0 +1,83 @@
+"""
+Command line of the Torob crawlers: python -m torob <command> [options]
+
+Only argparse is loaded up front; a command imports its module when it
+runs, so --help and usage errors return at once. Options left out fall
+back to the defaults in the command's module (RESET_CRAWL, RAW_ARCHIVE_DIR,
+RUN_CENSUS, ...).
+"""
+
+import sys
+import time
+import argparse
+import importlib
+
+
+def _parser():
+    parser = argparse.ArgumentParser(prog='python -m torob', description="Torob crawlers")
+    commands = parser.add_subparsers(dest='command', required=True)
+
+    # dest names are the keyword arguments of each module's main()
+    command = commands.add_parser('shops', help="Crawl the shop list into torob_shops.csv")
+    command.add_argument('-o', '--output', dest='output', metavar='CSV')
+    command.add_argument('--pages', dest='total_pages', type=int, metavar='N', help="List pages to fetch (default 55)")
+    command.add_argument('--page-size', dest='page_size', type=int, metavar='N', help="Shops per page (default 3000)")
+
+    command = commands.add_parser('details', help="Crawl the details of every shop into shopinfo_detail.csv")
+    command.add_argument('--shops', dest='shops_file', metavar='CSV', help="Shop list (default torob_shops.csv)")
+    command.add_argument('-o', '--output', dest='final_filename', metavar='CSV')
+    command.add_argument('--archive', dest='archive_dir', metavar='DIR', help="Also keep raw responses in DIR")
+    command.add_argument('--concurrency', dest='concurrent_requests', type=int, metavar='N')
+
+    command = commands.add_parser('census', help="Count every shop's products into shop_census.csv")
+    command.add_argument('--shops', dest='shops_file', metavar='CSV', help="Shop list (default torob_shops.csv)")
+    command.add_argument('-o', '--output', dest='census_file', metavar='CSV')
+    command.add_argument('--concurrency', dest='concurrent_requests', type=int, metavar='N')
+
+    command = commands.add_parser('products', help="Crawl every shop's products into shop_products.csv")
+    command.add_argument('--shops', dest='shops_file', metavar='CSV', help="Shop list (default torob_shops.csv)")
+    command.add_argument('-o', '--output', dest='final_filename', metavar='CSV')
+    command.add_argument('--reset', dest='reset', action='store_true', default=None,
+                         help="Start fresh instead of resuming")
+    command.add_argument('--census', dest='census', action='store_true', default=None,
+                         help="Count every shop's products first, to skip empty shops and plan pages")
+    command.add_argument('--census-file', dest='census_file', metavar='CSV')
+    command.add_argument('--archive', dest='archive_dir', metavar='DIR', help="Also keep raw responses in DIR")
+    command.add_argument('--concurrency', dest='concurrent_requests', type=int, metavar='N')
+
+    command = commands.add_parser('reflatten', help="Rebuild a CSV from archived raw responses")
+    command.add_argument('directory')
+    command.add_argument('output')
+    command.add_argument('--workers', type=int, help="Processes (default: all cores)")
+    return parser
+
+
+COMMANDS = {
+    'shops': ('torob.shops', 'main'),
+    'details': ('torob.details', 'main'),
+    'census': ('torob.products', 'census_main'),
+    'products': ('torob.products', 'main'),
+}
+
+
+def main(argv=None):
+    args = _parser().parse_args(argv)
+
+    if args.command == 'reflatten':
+        from torob.archive import reflatten
+
+        started = time.time()
+        responses, rows = reflatten(args.directory, args.output, args.workers)
+        print(f"Flattened {responses} responses into {rows} rows of {args.output} in {time.time() - started:.1f}s")
+        return 0
+
+    import asyncio
+
+    module, function = COMMANDS[args.command]
+    options = {name: value for name, value in vars(args).items() if name != 'command' and value is not None}
+    asyncio.run(getattr(importlib.import_module(module), function)(**options))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
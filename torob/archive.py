@@ -0,0 +1,247 @@
+"""
+Append-only archive of raw Torob API responses
+
+The crawlers keep only flattened rows, so a new field used to mean a new
+crawl. With --archive DIR they also keep every raw response body, and
+reflatten re-runs the flatteners over the archive on all cores:
+
+    python -m torob reflatten ./raw_archive/products shop_products.csv --workers 8
+    python -m torob reflatten ./raw_archive/details shopinfo_detail.csv
+
+An archive directory holds
+    segment-00000.zst, ...   one zstd frame per response, appended
+    index.csv                one row per response: segment, offset and
+                             length of its frame, and what was fetched
+
+Every response is its own frame, so a record is one seek away and a crawl
+killed mid-write loses at most the response it was writing. Requires the
+zstandard package (pip install zstandard).
+"""
+
+import os
+import csv
+import json
+import time
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from torob.store import bump_generation, last_copies, product_keys
+
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
+
+SEGMENT_BYTES = 256 * 1024 * 1024  # Start a new segment past this size
+RECORDS_PER_TASK = 2000
+INDEX_FIELDS = ['segment', 'offset', 'length', 'kind', 'shop_id', 'page', 'size', 'shop_name', 'fetched_at']
+
+
+def _require_zstandard():
+    if zstandard is None:
+        raise ImportError("The raw response archive needs the zstandard package (pip install zstandard)")
+
+
+class PendingRecord:
+    """A response being compressed as its bytes arrive"""
+
+    def __init__(self, compressor):
+        self._stream = compressor.compressobj()
+        self._parts = []
+
+    def write(self, chunk):
+        self._parts.append(self._stream.compress(chunk))
+
+    def finish(self):
+        self._parts.append(self._stream.flush())
+        frame = b''.join(self._parts)
+        self._parts = []
+        return frame
+
+
+class ResponseArchive:
+    """Writer side of an archive directory; reopening it appends"""
+
+    def __init__(self, directory, kind, segment_bytes=SEGMENT_BYTES, level=3):
+        _require_zstandard()
+        self.directory = directory
+        self.kind = kind
+        self.segment_bytes = segment_bytes
+        self._compressor = zstandard.ZstdCompressor(level=level)
+        os.makedirs(directory, exist_ok=True)
+
+        segments = sorted(name for name in os.listdir(directory) if name.endswith('.zst'))
+        self._segment = int(segments[-1][len('segment-'):-len('.zst')]) if segments else 0
+        self._file = None
+
+        index_path = os.path.join(directory, 'index.csv')
+        new_index = not os.path.exists(index_path)
+        self._index_file = open(index_path, 'a', newline='', encoding='utf-8')
+        self._index = csv.DictWriter(self._index_file, fieldnames=INDEX_FIELDS)
+        if new_index:
+            self._index.writeheader()
+
+    def _segment_file(self):
+        if self._file is None or self._file.tell() >= self.segment_bytes:
+            if self._file is not None:
+                self._file.close()
+                self._segment += 1
+            path = os.path.join(self.directory, f'segment-{self._segment:05d}.zst')
+            self._file = open(path, 'ab')
+            if self._file.tell() >= self.segment_bytes:
+                return self._segment_file()
+        return self._file
+
+    def open_record(self):
+        """A record to feed body chunks into while the response streams in"""
+        return PendingRecord(self._compressor)
+
+    def append(self, body, **meta):
+        """Store one response (bytes or a PendingRecord) with its index row"""
+        frame = body.finish() if isinstance(body, PendingRecord) else self._compressor.compress(body)
+        segment = self._segment_file()
+        offset = segment.tell()
+        segment.write(frame)
+        segment.flush()
+        # The index row goes last, so every indexed frame is complete
+        self._index.writerow({
+            'segment': self._segment, 'offset': offset, 'length': len(frame), 'kind': self.kind,
+            'fetched_at': round(time.time(), 3), **meta,
+        })
+        self._index_file.flush()
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+        self._index_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def read_index(directory):
+    """Index rows of an archive, in the order they were written"""
+    with open(os.path.join(directory, 'index.csv'), newline='', encoding='utf-8') as file:
+        return list(csv.DictReader(file))
+
+
+def iter_records(directory, entries):
+    """(index row, response body) for each index row, in the given order"""
+    _require_zstandard()
+    decompressor = zstandard.ZstdDecompressor()
+    handles = {}
+    try:
+        for entry in entries:
+            segment = int(entry['segment'])
+            if segment not in handles:
+                handles[segment] = open(os.path.join(directory, f'segment-{segment:05d}.zst'), 'rb')
+            handle = handles[segment]
+            handle.seek(int(entry['offset']))
+            frame = handle.read(int(entry['length']))
+            yield entry, decompressor.decompressobj().decompress(frame)
+    finally:
+        for handle in handles.values():
+            handle.close()
+
+
+def _flatten_products(entry, body):
+    from torob.products import flatten_product_data
+
+    page_data = json.loads(body)
+    results = page_data.pop('results', None) or []
+    shop_id, page = int(entry['shop_id']), int(entry['page'])
+    for product in results:
+        yield flatten_product_data(product, shop_id, entry['shop_name'], page, page_data)
+
+
+def _flatten_details(entry, body):
+    from torob.details import flatten_shop_info
+
+    yield flatten_shop_info(json.loads(body))
+
+
+FLATTENERS = {'products': _flatten_products, 'details': _flatten_details}
+
+
+def _reflatten_task(directory, entries, part_path):
+    """Flatten one run of records into a headerless part CSV, one row at a time
+
+    The flatteners add columns as fields show up (details have one per
+    additional_info title), so columns are numbered in order of first
+    appearance and a row written before a column appeared is just shorter.
+    Returns the columns, the row count and, for products, the key of every
+    row so reflatten() can drop all but the last copy of a product.
+    """
+    columns, positions = [], {}
+    names, order = None, None
+    count, keys = 0, []
+    with open(part_path, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.writer(file)
+        for entry, body in iter_records(directory, entries):
+            shop_ids, random_keys = [], []
+            for row in FLATTENERS[entry['kind']](entry, body):
+                if tuple(row) != names:
+                    names = tuple(row)
+                    for name in names:
+                        if name not in positions:
+                            positions[name] = len(columns)
+                            columns.append(name)
+                    order = [positions[name] for name in names]
+                    if order == list(range(len(order))):
+                        order = None
+                if order is None:
+                    writer.writerow(row.values())
+                else:
+                    values = [''] * (max(order) + 1)
+                    for position, value in zip(order, row.values()):
+                        values[position] = value
+                    writer.writerow(values)
+                shop_ids.append(row.get('shop_id'))
+                random_keys.append(row.get('random_key'))
+                count += 1
+            if entry['kind'] == 'products':
+                keys.append(product_keys(shop_ids, random_keys))
+    return columns, count, np.concatenate(keys) if keys else None
+
+
+def reflatten(directory, output, workers=None):
+    """Rewrite output from the archived responses, flattening with a process pool
+
+    A shop crawled again (or resumed) is archived again, so like
+    ProductStore only the last copy of each (shop_id, random_key) is kept.
+    """
+    entries = read_index(directory)
+    # Read each segment front to back
+    entries.sort(key=lambda entry: (int(entry['segment']), int(entry['offset'])))
+    tasks = [entries[start:start + RECORDS_PER_TASK] for start in range(0, len(entries), RECORDS_PER_TASK)]
+    parts = [f'{output}.part{number:05d}' for number in range(len(tasks))]
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        results = list(pool.map(_reflatten_task, [directory] * len(tasks), tasks, parts))
+
+    fieldnames = sorted({name for names, _, _ in results for name in names})
+    keys = [part_keys for _, count, part_keys in results if count]
+    keep = last_copies(np.concatenate(keys)) if keys and all(part_keys is not None for part_keys in keys) else None
+
+    rows, written = 0, 0
+    with open(output, 'w', newline='', encoding='utf-8') as file:
+        writer = csv.DictWriter(file, fieldnames=fieldnames, restval='')
+        writer.writeheader()
+        for part, (columns, count, _) in zip(parts, results):
+            with open(part, newline='', encoding='utf-8') as part_file:
+                reader = csv.DictReader(part_file, fieldnames=columns, restval='')
+                if keep is not None:
+                    reader = itertools.compress(reader, keep[rows:rows + count])
+                for row in reader:
+                    writer.writerow(row)
+                    written += 1
+            rows += count
+            os.remove(part)
+    bump_generation(output)
+    return len(entries), written
+
@@ -0,0 +1,306 @@
+"""
+Column-wise storage of flattened products
+
+A crawl batch holds millions of flattened products before they are
+written. As dicts every product costs a hash table of some 45 keys plus
+its own copies of strings most products share, so ProductBuffer stores
+them by column instead:
+
+    numeric fields (price, image_count, ...)   typed 64-bit arrays
+    repeated strings (shop_name, badges, ...)  dictionary-encoded codes
+    mostly distinct strings (random_key, ...)  plain lists
+    page-level fields (categories, seo_*, ...) once per page
+
+    products = ProductBuffer()
+    products.append(flatten_product_fields(product, shop_id, shop_name, page))
+    products.end_page(flatten_page_data(page_data))
+    products.row(0)['price']              # ProductRow, a read-only mapping
+    csv.writer(file).writerows(products.rows(columns))
+
+A column whose values turn out not to fit its encoding (a string in a
+numeric field, say) falls back to a plain list, so any record goes in.
+"""
+
+from array import array
+from collections.abc import Mapping
+
+INT_COLUMNS = ('shop_id', 'page', 'price', 'image_count', 'media_count', 'estimated_sell')
+# Mostly distinct per product: dictionary encoding would only add overhead
+PLAIN_COLUMNS = (
+    'random_key', 'name1', 'name2', 'price_text', 'image_url', 'more_info_url',
+    'web_client_absolute_url', 'similar_api', 'media_search', 'media_urls', 'cta_url',
+)
+ROWS_PER_CHUNK = 10000
+
+
+class _IntColumn:
+    """int64 values with a presence flag per row (None is absent)"""
+
+    __slots__ = ('values', 'present')
+
+    def __init__(self):
+        self.values = array('q')
+        self.present = bytearray()
+
+    def __len__(self):
+        return len(self.present)
+
+    def __getitem__(self, i):
+        return self.values[i] if self.present[i] else None
+
+    def append(self, value):
+        if value is None:
+            self.values.append(0)
+            self.present.append(0)
+        elif type(value) is int:
+            # OverflowError past 64 bits, like TypeError, makes the column plain
+            self.values.append(value)
+            self.present.append(1)
+        else:
+            raise TypeError(value)
+
+    def extend_none(self, n):
+        self.values.extend(array('q', bytes(8 * n)))
+        self.present.extend(bytes(n))
+
+    def extend(self, other):
+        self.values.extend(other.values)
+        self.present.extend(other.present)
+
+    def take(self, indices):
+        values, present = self.values, self.present
+        return [values[i] if present[i] else None for i in indices]
+
+    def tolist(self):
+        return self.take(range(len(self)))
+
+
+class _DictColumn:
+    """Row codes into a list of the distinct values"""
+
+    __slots__ = ('codes', 'values', 'index')
+
+    def __init__(self):
+        self.codes = array('i')
+        self.values = []
+        self.index = {}
+
+    def __len__(self):
+        return len(self.codes)
+
+    def __getitem__(self, i):
+        return self.values[self.codes[i]]
+
+    def _code(self, value):
+        # Typed keys keep True, 1 and 1.0 apart
+        key = value if type(value) is str else (type(value), value)
+        code = self.index.get(key)
+        if code is None:
+            code = self.index[key] = len(self.values)
+            self.values.append(value)
+        return code
+
+    def append(self, value):
+        self.codes.append(self._code(value))
+
+    def extend_none(self, n):
+        self.codes.extend(array('i', [self._code(None)]) * n)
+
+    def extend(self, other):
+        recode = [self._code(value) for value in other.values]
+        self.codes.extend(array('i', map(recode.__getitem__, other.codes)))
+
+    def take(self, indices):
+        values, codes = self.values, self.codes
+        return [values[codes[i]] for i in indices]
+
+    def tolist(self):
+        return list(map(self.values.__getitem__, self.codes))
+
+
+class _PlainColumn:
+    """A list of values, for distinct strings and anything the others reject"""
+
+    __slots__ = ('values',)
+
+    def __init__(self, values=None):
+        self.values = values if values is not None else []
+
+    def __len__(self):
+        return len(self.values)
+
+    def __getitem__(self, i):
+        return self.values[i]
+
+    def append(self, value):
+        self.values.append(value)
+
+    def extend_none(self, n):
+        self.values.extend([None] * n)
+
+    def extend(self, other):
+        self.values.extend(other.tolist())
+
+    def take(self, indices):
+        values = self.values
+        return [values[i] for i in indices]
+
+    def tolist(self):
+        return self.values
+
+
+def _new_column(name):
+    if name in INT_COLUMNS:
+        return _IntColumn()
+    if name in PLAIN_COLUMNS:
+        return _PlainColumn()
+    return _DictColumn()
+
+
+class ProductRow(Mapping):
+    """Read-only mapping view of one product in a ProductBuffer"""
+
+    __slots__ = ('_buffer', '_index')
+
+    def __init__(self, buffer, index):
+        self._buffer = buffer
+        self._index = index
+
+    def __getitem__(self, name):
+        return self._buffer.value(self._index, name)
+
+    def __iter__(self):
+        return iter(self._buffer.columns)
+
+    def __len__(self):
+        return len(self._buffer.columns)
+
+    def __repr__(self):
+        return f"ProductRow({dict(self)!r})"
+
+
+class ProductBuffer:
+    """Flattened products stored by column; see the module docstring"""
+
+    def __init__(self):
+        self._columns = {}
+        self._appenders = {}  # Bound append() of each column
+        self._page_columns = {}
+        self._pages = []
+        self._page_codes = array('i')  # Index into _pages; rows of an open page point past its end
+        self._length = 0
+
+    @classmethod
+    def from_records(cls, records):
+        """Buffer of flattened product dicts"""
+        buffer = cls()
+        for record in records:
+            buffer.append(record)
+        return buffer
+
+    def __len__(self):
+        return self._length
+
+    def __iter__(self):
+        return (ProductRow(self, i) for i in range(self._length))
+
+    @property
+    def columns(self):
+        """Product columns in order of appearance, then page columns"""
+        return list(self._columns) + [name for name in self._page_columns if name not in self._columns]
+
+    def _put_column(self, name, column):
+        self._columns[name] = column
+        self._appenders[name] = column.append
+
+    def _set(self, name, value):
+        column = self._columns.get(name)
+        if column is None:
+            column = _new_column(name)
+            column.extend_none(self._length)
+            self._put_column(name, column)
+        try:
+            column.append(value)
+        except (TypeError, OverflowError):
+            # Unhashable or not an int: keep the column as plain values
+            column = _PlainColumn(column.tolist())
+            column.append(value)
+            self._put_column(name, column)
+
+    def append(self, fields):
+        """Add one product's fields; page-level fields come with end_page()"""
+        appenders = self._appenders
+        try:
+            for name, value in fields.items():
+                appenders[name](value)
+        except (KeyError, TypeError, OverflowError):
+            # A new column or a value its column cannot encode
+            for name, value in fields.items():
+                column = self._columns.get(name)
+                if column is None or len(column) == self._length:
+                    self._set(name, value)
+        if len(fields) != len(self._columns):
+            for column in self._columns.values():
+                if len(column) == self._length:
+                    column.append(None)
+        self._page_codes.append(len(self._pages))
+        self._length += 1
+
+    def end_page(self, page_fields):
+        """Attach fields shared by every product appended since the last page"""
+        self._pages.append(page_fields)
+        self._page_columns.update(dict.fromkeys(page_fields))
+
+    def _close_page(self):
+        if self._length and self._page_codes[-1] == len(self._pages):
+            self._pages.append({})
+
+    def extend(self, other):
+        """Append every product of another buffer"""
+        if not len(other):
+            return
+        self._close_page()
+        other._close_page()
+        for name in self._columns.keys() | other._columns.keys():
+            mine, theirs = self._columns.get(name), other._columns.get(name)
+            if mine is None:
+                mine = _new_column(name)
+                mine.extend_none(self._length)
+                self._put_column(name, mine)
+            if theirs is None:
+                mine.extend_none(len(other))
+            elif type(mine) is type(theirs):
+                mine.extend(theirs)
+            else:
+                self._put_column(name, _PlainColumn(mine.tolist() + theirs.tolist()))
+        base = len(self._pages)
+        self._pages.extend(other._pages)
+        self._page_columns.update(other._page_columns)
+        self._page_codes.extend(array('i', [code + base for code in other._page_codes]))
+        self._length += len(other)
+
+    def value(self, index, name):
+        column = self._columns.get(name)
+        if column is not None:
+            return column[index]
+        code = self._page_codes[index]
+        return self._pages[code].get(name) if code < len(self._pages) else None
+
+    def row(self, index):
+        return ProductRow(self, index)
+
+    def column(self, name, indices=None):
+        """Values of one column, for all rows or the given row indices"""
+        indices = range(self._length) if indices is None else indices
+        column = self._columns.get(name)
+        if column is not None:
+            return column.take(indices)
+        pages, codes = self._pages, self._page_codes
+        return [pages[codes[i]].get(name) if codes[i] < len(pages) else None for i in indices]
+
+    def rows(self, columns, indices=None):
+        """Value tuples in the order of columns (None for missing), ready for csv.writer"""
+        indices = range(self._length) if indices is None else indices
+        for start in range(0, len(indices), ROWS_PER_CHUNK):
+            chunk = indices[start:start + ROWS_PER_CHUNK]
+            yield from zip(*[self.column(name, chunk) for name in columns])
@@ -0,0 +1,330 @@
+"""
+Idempotent writes of crawled products to shop_products.csv
+
+A product is identified by (shop_id, random_key). ProductStore keeps a
+compact index of those pairs next to the CSV, so a product written again
+after an interrupted or repeated crawl replaces its earlier row instead
+of adding a duplicate, and it records which shops were crawled to the
+last page, so a resumed crawl redoes shops that were cut off.
+
+New products are appended to the CSV. Replacements of stored products are
+appended to a side file instead and applied in a single pass over the CSV
+at close(), or once MAX_PENDING_UPDATES have piled up, so an upsert costs
+one row write however large the CSV is. Until then the CSV still holds the
+earlier copies of those products.
+
+Files next to shop_products.csv:
+    shop_products.csv.keys.npy   sorted 64-bit hashes of every (shop_id, random_key)
+    shop_products.csv.done       ids of completely written shops, one per line
+    shop_products.csv.updates    replacement rows not yet applied to the CSV
+                                 (kept across an interrupted run)
+    shop_products.csv.generation how many times the CSV was rewritten or reset;
+                                 readers that index rows by position (the
+                                 dashboard's search index) rebuild when it changes
+
+Membership goes through a Bloom filter first, so a new product costs a
+few bit lookups; only possible repeats are confirmed against the sorted
+keys. A missing or stale index is rebuilt from the CSV.
+"""
+
+import os
+import csv
+
+import numpy as np
+import pandas as pd
+
+from torob.buffer import ProductBuffer
+
+KEY_COLUMNS = ['shop_id', 'random_key']
+BLOOM_BITS_PER_KEY = 16  # About 0.05% false positives with 7 hashes
+BLOOM_HASHES = 7
+MIN_BLOOM_KEYS = 1 << 16
+READ_CHUNK_ROWS = 500000
+MAX_PENDING_UPDATES = 1000000  # Replacement rows that trigger a rewrite before close()
+GENERATION_SUFFIX = '.generation'
+
+
+def product_keys(shop_ids, random_keys):
+    """64-bit key of each (shop_id, random_key); 0 where random_key is missing"""
+    shop_ids = pd.to_numeric(pd.Series(shop_ids, dtype=object), errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+    random_keys = pd.Series(random_keys, dtype=object)
+    missing = (random_keys.isna() | (random_keys == '')).to_numpy()
+    if not len(random_keys):
+        return np.empty(0, dtype=np.uint64)
+    # Hash both columns and mix them (boost::hash_combine on 64 bits)
+    keys = pd.util.hash_array(random_keys.astype(str).to_numpy(dtype=object), categorize=False)
+    with np.errstate(over='ignore'):
+        keys ^= pd.util.hash_array(shop_ids) + np.uint64(0x9E3779B97F4A7C15) + (keys << np.uint64(6)) + (keys >> np.uint64(2))
+    keys[keys == 0] = 1
+    keys[missing] = 0
+    return keys
+
+
+def read_generation(filename):
+    """Rewrite count of a CSV, 0 when it was only ever appended to"""
+    try:
+        with open(filename + GENERATION_SUFFIX, encoding='utf-8') as file:
+            return int(file.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def bump_generation(filename):
+    """Record that rows of filename may have changed or moved, not just been appended"""
+    path = filename + GENERATION_SUFFIX
+    generation = read_generation(filename) + 1
+    with open(path + '.tmp', 'w', encoding='utf-8') as file:
+        file.write(f"{generation}\n")
+    os.replace(path + '.tmp', path)
+    return generation
+
+
+def last_copies(keys):
+    """Mask of the last occurrence of each key; rows without a key (0) are always kept"""
+    _, last = np.unique(keys[::-1], return_index=True)
+    keep = np.zeros(len(keys), dtype=bool)
+    keep[len(keys) - 1 - last] = True
+    keep |= keys == 0
+    return keep
+
+
+class ProductIndex:
+    """Set of product keys: a Bloom filter in front of a sorted uint64 array"""
+
+    def __init__(self, keys=None):
+        self.keys = np.unique(np.asarray(keys if keys is not None else [], dtype=np.uint64))
+        self._pending = []
+        self._build_bloom(max(len(self.keys) * 2, MIN_BLOOM_KEYS))
+
+    def __len__(self):
+        return len(self.keys) + sum(len(part) for part in self._pending)
+
+    def _build_bloom(self, capacity):
+        self._capacity = capacity
+        self._bits = np.zeros((capacity * BLOOM_BITS_PER_KEY + 7) // 8, dtype=np.uint8)
+        self._set_bits(self.keys)
+        for part in self._pending:
+            self._set_bits(part)
+
+    def _positions(self, keys):
+        # Double hashing: bit i of a key is (h1 + i * h2) mod m
+        nbits = np.uint64(len(self._bits) * 8)
+        h1 = keys & np.uint64(0xFFFFFFFF)
+        h2 = (keys >> np.uint64(32)) | np.uint64(1)
+        return [(h1 + np.uint64(i) * h2) % nbits for i in range(BLOOM_HASHES)]
+
+    def _set_bits(self, keys):
+        for position in self._positions(keys):
+            np.bitwise_or.at(self._bits, (position >> np.uint64(3)).astype(np.int64),
+                             (np.uint8(1) << (position & np.uint64(7)).astype(np.uint8)))
+
+    def contains(self, keys):
+        """Boolean mask of keys already in the index"""
+        keys = np.asarray(keys, dtype=np.uint64)
+        maybe = np.ones(len(keys), dtype=bool)
+        for position in self._positions(keys):
+            maybe &= (self._bits[(position >> np.uint64(3)).astype(np.int64)]
+                      >> (position & np.uint64(7)).astype(np.uint8)) & np.uint8(1) == 1
+        candidates = np.flatnonzero(maybe)
+        if len(candidates):
+            wanted = keys[candidates]
+            exact = np.zeros(len(candidates), dtype=bool)
+            if len(self.keys):
+                found = np.minimum(np.searchsorted(self.keys, wanted), len(self.keys) - 1)
+                exact = self.keys[found] == wanted
+            if self._pending:
+                exact |= np.isin(wanted, np.concatenate(self._pending))
+            maybe[candidates] = exact
+        return maybe
+
+    def add(self, keys):
+        keys = np.asarray(keys, dtype=np.uint64)
+        if not len(keys):
+            return
+        self._pending.append(keys)
+        if len(self) > self._capacity:
+            self._merge()
+            self._build_bloom(len(self.keys) * 2)
+        else:
+            self._set_bits(keys)
+
+    def _merge(self):
+        if self._pending:
+            self.keys = np.unique(np.concatenate([self.keys] + self._pending))
+            self._pending = []
+
+    def save(self, path):
+        self._merge()
+        temporary = path + '.tmp.npy'
+        np.save(temporary, self.keys)
+        os.replace(temporary, path)
+
+    @classmethod
+    def load(cls, path):
+        return cls(np.load(path))
+
+    @classmethod
+    def from_csv(cls, filename):
+        """Index of every product already in a CSV, read in chunks"""
+        index = cls()
+        for chunk in pd.read_csv(filename, usecols=KEY_COLUMNS, dtype=str, chunksize=READ_CHUNK_ROWS):
+            keys = product_keys(chunk['shop_id'], chunk['random_key'])
+            index.add(keys[keys != 0])
+        return index
+
+
+class ProductStore:
+    """shop_products.csv with upserts by (shop_id, random_key) and per-shop completion markers"""
+
+    def __init__(self, filename, reset=False):
+        """Open filename, or with reset=True start it over, dropping its index and completion markers"""
+        self.filename = filename
+        self.index_path = filename + '.keys.npy'
+        self.done_path = filename + '.done'
+        self.updates_path = filename + '.updates'
+        if reset:
+            self.reset()
+        self.index = self._load_index()
+        self.pending_updates = self._count_updates()
+        if os.path.exists(filename) and not os.path.exists(self.done_path):
+            # Files from before completion markers: every shop present counts as done
+            shop_ids = pd.read_csv(filename, usecols=['shop_id'])['shop_id']
+            self.mark_complete(pd.to_numeric(shop_ids, errors='coerce').dropna().astype(int).unique())
+
+    def _load_index(self):
+        if not os.path.exists(self.filename):
+            return ProductIndex()
+        # Rows appended after the index was last saved are only in the CSV
+        if os.path.exists(self.index_path) and os.path.getmtime(self.index_path) >= os.path.getmtime(self.filename):
+            return ProductIndex.load(self.index_path)
+        print(f"Indexing products already in {self.filename}...")
+        index = ProductIndex.from_csv(self.filename)
+        index.save(self.index_path)
+        return index
+
+    def _count_updates(self):
+        # Left by a run that stopped before close()
+        if not os.path.exists(self.updates_path):
+            return 0
+        return sum(len(chunk) for chunk in pd.read_csv(self.updates_path, usecols=['shop_id'], chunksize=READ_CHUNK_ROWS))
+
+    def reset(self):
+        for path in (self.filename, self.index_path, self.done_path, self.updates_path):
+            if os.path.exists(path):
+                os.remove(path)
+        self.pending_updates = 0
+        self.index = ProductIndex()
+        bump_generation(self.filename)
+
+    def completed_shops(self):
+        """Ids of shops whose products were written to the last page"""
+        if not os.path.exists(self.done_path):
+            return set()
+        with open(self.done_path, encoding='utf-8') as file:
+            return {int(line) for line in file if line.strip()}
+
+    def _header(self):
+        if not os.path.exists(self.filename):
+            return None
+        with open(self.filename, newline='', encoding='utf-8') as file:
+            return next(csv.reader(file), None)
+
+    def write(self, products):
+        """Append new products; products already stored are replaced at close()
+
+        products is a ProductBuffer (or a list of flattened dicts). Returns
+        (inserted, updated) counts.
+        """
+        if not isinstance(products, ProductBuffer):
+            products = ProductBuffer.from_records(products)
+        if not len(products):
+            return 0, 0
+        keys = product_keys(products.column('shop_id'), products.column('random_key'))
+
+        # The last copy of a product within the batch wins
+        keep = last_copies(keys)
+        existing = self.index.contains(keys) & (keys != 0)
+
+        inserts = np.flatnonzero(keep & ~existing).tolist()
+        updates = np.flatnonzero(keep & existing).tolist()
+
+        header = self._header()
+        columns = sorted(products.columns)
+        if header is None:
+            header = columns
+            with open(self.filename, 'w', newline='', encoding='utf-8') as file:
+                csv.writer(file).writerow(header)
+        elif not set(columns) <= set(header):
+            # New columns mean one pass over the CSV anyway; pending updates go with it
+            header = sorted(set(header) | set(columns))
+            self._rewrite(header)
+
+        if inserts:
+            with open(self.filename, 'a', newline='', encoding='utf-8') as file:
+                csv.writer(file).writerows(products.rows(header, inserts))
+            new_keys = keys[keep & ~existing]
+            self.index.add(new_keys[new_keys != 0])
+        if updates:
+            # The side file always has the CSV's header: a header change applies and removes it
+            new_file = not os.path.exists(self.updates_path)
+            with open(self.updates_path, 'a', newline='', encoding='utf-8') as file:
+                writer = csv.writer(file)
+                if new_file:
+                    writer.writerow(header)
+                writer.writerows(products.rows(header, updates))
+            self.pending_updates += len(updates)
+        return len(inserts), len(updates)
+
+    def mark_complete(self, shop_ids):
+        """Record shops whose every page has been passed to write()"""
+        self.flush()
+        with open(self.done_path, 'a', encoding='utf-8') as file:
+            file.writelines(f"{int(shop_id)}\n" for shop_id in shop_ids)
+
+    def flush(self):
+        """Save the index; pending updates are applied once there are MAX_PENDING_UPDATES of them"""
+        if self.pending_updates >= MAX_PENDING_UPDATES:
+            self.apply_updates()
+        if os.path.exists(self.filename):
+            self.index.save(self.index_path)
+
+    def apply_updates(self):
+        """Rewrite the CSV with every pending replacement row"""
+        if self.pending_updates and os.path.exists(self.filename):
+            self._rewrite(self._header())
+
+    def _rewrite(self, header):
+        """Stream the CSV through a temporary file, with new columns and pending updates applied"""
+        updates = self._update_frame(header)
+        temporary = self.filename + '.tmp'
+        first = True
+        for chunk in pd.read_csv(self.filename, dtype=str, keep_default_na=False, chunksize=READ_CHUNK_ROWS):
+            chunk = chunk.reindex(columns=header, fill_value='')
+            if len(updates):
+                keys = product_keys(chunk['shop_id'], chunk['random_key']).astype(object)
+                replace = pd.Index(keys).isin(updates.index)
+                if replace.any():
+                    new_rows = updates.reindex(index=keys[replace], columns=header).fillna('')
+                    chunk.loc[replace, header] = new_rows.to_numpy()
+            chunk.to_csv(temporary, mode='w' if first else 'a', header=first, index=False, encoding='utf-8')
+            first = False
+        os.replace(temporary, self.filename)
+        # After the replace, so a reader never records the new stamp with the old rows
+        bump_generation(self.filename)
+        if os.path.exists(self.updates_path):
+            os.remove(self.updates_path)
+        self.pending_updates = 0
+
+    def _update_frame(self, header):
+        """Pending updates as a frame of header columns indexed by product key, the last copy of each"""
+        if not self.pending_updates or not os.path.exists(self.updates_path):
+            return pd.DataFrame(columns=header, dtype=object)
+        updates = pd.read_csv(self.updates_path, dtype=str, keep_default_na=False)
+        keys = product_keys(updates['shop_id'], updates['random_key'])
+        keep = last_copies(keys)
+        updates = updates[keep].set_axis(pd.Index(keys[keep].astype(object)))
+        return updates.reindex(columns=header, fill_value='')
+
+    def close(self):
+        self.apply_updates()
+        self.flush()
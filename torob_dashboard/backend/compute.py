@@ -0,0 +1,84 @@
+"""
+Execution layer for CPU-bound endpoint work
+
+Endpoints are async, but their pandas work is not: running a groupby on the
+event loop stalls every other request on the worker, /api/health included.
+ComputePool runs those functions on a thread pool instead (the frames live
+in this process and pandas releases the GIL in most of its kernels, so
+threads avoid copying multi-GB frames into worker processes). Concurrent
+requests with the same key share a single computation.
+
+The first element of a key names the task in the metrics.
+"""
+
+import os
+import time
+import asyncio
+import functools
+from contextvars import ContextVar
+from concurrent.futures import ThreadPoolExecutor
+
+# Set for a request whose compute work should stay on the calling thread
+# (the profiler only samples the event loop thread)
+run_inline = ContextVar('run_inline', default=False)
+
+
+def _timed(fn, args, kwargs):
+    started = time.perf_counter()
+    result = fn(*args, **kwargs)
+    return result, time.perf_counter() - started
+
+
+class ComputePool:
+    """Runs blocking callables off the event loop, coalescing identical calls"""
+
+    def __init__(self, max_workers=None, inline=False, metrics=None):
+        self.max_workers = max_workers or min(8, os.cpu_count() or 1)
+        self.inline = inline
+        self.metrics = metrics
+        self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix="compute")
+        self._inflight = {}
+        self.coalesced = 0
+
+    async def run(self, key, fn, *args, **kwargs):
+        """Return fn(*args, **kwargs), sharing the result with any in-flight call under key
+
+        key must capture everything the result depends on, including the
+        data snapshot version.
+        """
+        name = key[0] if isinstance(key, tuple) else str(key)
+
+        if self.inline or run_inline.get():
+            # Pre-offload behaviour, kept for load-test comparisons
+            result, seconds = _timed(fn, args, kwargs)
+            self._record(name, seconds, owner=True)
+            return result
+
+        future = self._inflight.get(key)
+        if future is not None:
+            self.coalesced += 1
+            if self.metrics is not None:
+                self.metrics.observe_coalesced()
+            result, seconds = await asyncio.shield(future)
+            self._record(name, seconds, owner=False)
+            return result
+
+        loop = asyncio.get_running_loop()
+        future = loop.run_in_executor(self._executor, functools.partial(_timed, fn, args, kwargs))
+        self._inflight[key] = future
+        future.add_done_callback(lambda _: self._inflight.pop(key, None))
+
+        # Shield so a client disconnecting does not cancel the shared work
+        result, seconds = await asyncio.shield(future)
+        self._record(name, seconds, owner=True)
+        return result
+
+    def _record(self, name, seconds, owner):
+        if self.metrics is None:
+            return
+        if owner:
+            self.metrics.observe_compute(name, seconds)
+        self.metrics.add_request_compute(seconds)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,221 @@
+"""
+Filtered bulk exports of the loaded datasets as Arrow or Parquet
+
+Filters are evaluated as boolean masks over whole columns of the snapshot
+frames, the selected rows are converted to an Arrow table column by column,
+and the table is streamed out in record batches (Arrow IPC stream) or row
+groups (Parquet). No row is ever turned into a dict.
+
+Read an export straight into pandas:
+    import pyarrow as pa, requests
+    r = requests.get("http://localhost:8000/api/export/products?city=تهران", stream=True)
+    df = pa.ipc.open_stream(r.raw).read_pandas()
+"""
+
+import re
+
+import numpy as np
+import pandas as pd
+
+from persian_text import normalize
+from analysis.categories import CategoryTable
+from analysis.category_tree import CategoryTree
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+
+DATASETS = ('shops', 'shop_details', 'products')
+FORMATS = {
+    'arrow': ('application/vnd.apache.arrow.stream', 'arrow'),
+    'parquet': ('application/vnd.apache.parquet', 'parquet'),
+}
+COMPRESSIONS = ('zstd', 'lz4', 'none')
+BATCH_ROWS = 65536
+
+
+class ExportError(ValueError):
+    """A filter or option the requested dataset cannot satisfy"""
+
+
+def matches_normalized(series, value):
+    """Mask of rows equal to value after Persian normalization
+
+    Only the distinct values are normalized, so this stays cheap on
+    million-row columns with a few hundred cities.
+    """
+    target = normalize(value).strip()
+    uniques = series.dropna().unique()
+    hits = [u for u in uniques if normalize(str(u)).strip() == target]
+    return series.isin(hits).to_numpy(dtype=bool, na_value=False)
+
+
+def category_mask(snap, category):
+    """Products whose primary category or category list includes category
+
+    A number matches category ids, anything else category names. The
+    category lists come from the snapshot's CategoryTable, which parses
+    each distinct list once, and also covers crawls from before the
+    primary_category columns. A parent category such as "کالای دیجیتال"
+    matches every product whose primary category lies under it in the
+    snapshot's CategoryTree.
+    """
+    products_df = snap.products_df
+    category = category.strip()
+    mask = np.zeros(len(products_df), dtype=bool)
+    if category.isdigit():
+        if 'primary_category_id' in products_df.columns:
+            ids = pd.to_numeric(products_df['primary_category_id'], errors='coerce')
+            mask = (ids == int(category)).to_numpy(dtype=bool, na_value=False)
+    elif 'primary_category' in products_df.columns:
+        mask = matches_normalized(products_df['primary_category'], category)
+
+    table = snap.memo('product_categories', lambda: CategoryTable(products_df['categories']))
+    mask |= table.mask(table.find(category, key=lambda text: normalize(text).strip()))
+
+    tree, leaf = category_tree(snap)
+    nodes = tree.find(category, key=lambda text: normalize(text).strip())
+    if len(nodes):
+        mask |= tree.mask(nodes, leaf)
+    return mask
+
+
+def category_tree(snap):
+    """The snapshot's CategoryTree and each product's node in it"""
+    products_df = snap.products_df
+
+    def build():
+        table = snap.memo('product_categories', lambda: CategoryTable(products_df['categories']))
+        tree = CategoryTree.from_products(products_df, table)
+        return tree, tree.tag(products_df, table)
+    return snap.memo('category_tree', build)
+
+
+def _shop_ids(frame, mask, column):
+    return frame.loc[mask, column].dropna().astype('int64').unique()
+
+
+def filter_dataset(snap, dataset, city=None, province=None, category=None, shop_type=None):
+    """Rows of one snapshot dataset that pass every given filter"""
+    shops_df, details_df, products_df = snap.shops_df, snap.shop_details_df, snap.products_df
+    frame = {'shops': shops_df, 'shop_details': details_df, 'products': products_df}[dataset]
+    mask = np.ones(len(frame), dtype=bool)
+
+    def need(df, label, filter_name):
+        if df is None:
+            raise ExportError(f"Filtering by {filter_name} needs {label}, which is not loaded")
+        return df
+
+    if dataset == 'shop_details':
+        if city:
+            mask &= matches_normalized(frame['city'], city)
+        if province:
+            mask &= matches_normalized(frame['province'], province)
+        if shop_type:
+            mask &= (frame['shop_type'] == shop_type).to_numpy(dtype=bool, na_value=False)
+    else:
+        # Shops and products are filtered through the set of matching shop
+        # ids, looked up in the snapshot's join index
+        if city or shop_type:
+            need(shops_df, "shop data", "city" if city else "shop_type")
+        if province:
+            need(details_df, "shop details", "province")
+        ids = None
+        if city or province or shop_type:
+            join = snap.aggregates['shop_join']
+            ids = np.sort(join.ids(join.filter_rows(city=city, province=province, shop_type=shop_type, exact=True)))
+
+        if category:
+            need(products_df, "product data", "category")
+            product_mask = category_mask(snap, category)
+            if dataset == 'products':
+                mask &= product_mask
+            else:
+                category_ids = _shop_ids(products_df, product_mask, 'shop_id')
+                ids = category_ids if ids is None else np.intersect1d(ids, category_ids)
+
+        if ids is not None:
+            column = 'id' if dataset == 'shops' else 'shop_id'
+            mask &= frame[column].isin(ids).to_numpy(dtype=bool, na_value=False)
+
+    return frame[mask] if not mask.all() else frame
+
+
+def to_arrow_table(frame, columns=None):
+    """Arrow table of a frame, built column by column without copying rows"""
+    if columns:
+        missing = [col for col in columns if col not in frame.columns]
+        if missing:
+            raise ExportError(f"Unknown columns: {', '.join(missing)}")
+        frame = frame[columns]
+
+    arrays = {}
+    for col in frame.columns:
+        series = frame[col]
+        # CSV columns with mixed values come back as object; Arrow needs
+        # one type per column
+        if series.dtype == object:
+            series = series.where(series.isna(), series.astype(str))
+        arrays[str(col)] = pa.array(series, from_pandas=True)
+    return pa.table(arrays)
+
+
+class _ChunkSink:
+    """Write-only file that hands its buffered bytes to a generator"""
+
+    def __init__(self):
+        self.chunks = []
+        self.closed = False
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def drain(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def stream_table(table, format='arrow', compression='zstd'):
+    """Yield the table as Arrow IPC stream or Parquet bytes, batch by batch"""
+    codec = None if compression == 'none' else compression
+    sink = _ChunkSink()
+    output = pa.PythonFile(sink, mode='w')
+
+    if format == 'parquet':
+        writer = pq.ParquetWriter(output, table.schema, compression=codec or 'none')
+        write = writer.write_table
+    else:
+        options = pa.ipc.IpcWriteOptions(compression=codec)
+        writer = pa.ipc.new_stream(output, table.schema, options=options)
+        write = writer.write_batch
+
+    for offset in range(0, max(table.num_rows, 1), BATCH_ROWS):
+        part = table.slice(offset, BATCH_ROWS)
+        if format == 'parquet':
+            write(part)
+        else:
+            for batch in part.to_batches():
+                write(batch)
+        data = sink.drain()
+        if data:
+            yield data
+
+    writer.close()
+    yield sink.drain()
+
+
+def export_filename(dataset, format, filters):
+    """Download name such as products_city-تهران.parquet"""
+    parts = [dataset] + [f"{key}-{value}" for key, value in filters.items() if value]
+    name = re.sub(r'[^\w.-]+', '_', '_'.join(parts))
+    return f"{name}.{FORMATS[format][1]}"
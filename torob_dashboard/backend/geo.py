@@ -0,0 +1,259 @@
+"""
+Offline geocoding and map aggregation
+
+Shop cities are matched against a bundled gazetteer of Iranian provinces
+and cities (data/iran_gazetteer.csv) instead of a hard-coded coordinate
+dict. Names are compared by a loose key, so Arabic/Persian letter variants,
+ZWNJ, spacing, "آ"/"ا" and prefixes such as "شهر"/"بندر" all resolve to the
+same place.
+
+MapLayers turns the per-city shop counts of one snapshot into ready-made
+GeoJSON features at three levels of detail; the map asks for the level that
+suits its zoom and only for the features inside its bounding box.
+"""
+
+import os
+import re
+import threading
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from persian_text import normalize
+
+GAZETTEER_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'data', 'iran_gazetteer.csv')
+
+# Prefixes that are often written, or left out, in front of a city name
+OPTIONAL_PREFIXES = ('شهرستان', 'شهر', 'بندر')
+
+Place = namedtuple('Place', ['name', 'province', 'lat', 'lon'])
+
+_NON_WORD = re.compile(r'[\W_]+')
+
+
+def place_key(name):
+    """Spelling-insensitive lookup key for a place name"""
+    return _NON_WORD.sub('', normalize(name).replace('آ', 'ا'))
+
+
+def _key_variants(name):
+    key = place_key(name)
+    yield key
+    for prefix in OPTIONAL_PREFIXES:
+        prefix_key = place_key(prefix)
+        if key.startswith(prefix_key) and len(key) > len(prefix_key):
+            yield key[len(prefix_key):]
+
+
+class Gazetteer:
+    """Provinces and cities with coordinates, indexed by place_key"""
+
+    def __init__(self, rows):
+        self.provinces = {}
+        self.cities = {}
+        for row in rows:
+            place = Place(row['name'], row['province'], float(row['lat']), float(row['lon']))
+            names = [row['name']]
+            if isinstance(row.get('aliases'), str):
+                names += row['aliases'].split('|')
+            for name in names:
+                if row['kind'] == 'province':
+                    self.provinces[place_key(name)] = place
+                else:
+                    # Several cities share a name; keep all and let the
+                    # province decide
+                    self.cities.setdefault(place_key(name), []).append(place)
+
+    @classmethod
+    def load(cls, path=GAZETTEER_PATH):
+        return cls(pd.read_csv(path, dtype={'aliases': str}).to_dict('records'))
+
+    def find_province(self, name):
+        if not isinstance(name, str):
+            return None
+        for key in _key_variants(name):
+            if key in self.provinces:
+                return self.provinces[key]
+        return None
+
+    def find_city(self, name, province=None):
+        """Best gazetteer match for a city name, or None"""
+        if not isinstance(name, str):
+            return None
+        for key in _key_variants(name):
+            candidates = self.cities.get(key)
+            if not candidates:
+                continue
+            if province is not None and len(candidates) > 1:
+                wanted = self.find_province(province)
+                for place in candidates:
+                    if wanted is not None and place.province == wanted.name:
+                        return place
+            return candidates[0]
+        return None
+
+
+_gazetteer = None
+_gazetteer_lock = threading.Lock()
+
+
+def get_gazetteer():
+    """The bundled gazetteer, parsed on first use"""
+    global _gazetteer
+    with _gazetteer_lock:
+        if _gazetteer is None:
+            _gazetteer = Gazetteer.load()
+    return _gazetteer
+
+
+# Grid cells are about the same number of screen pixels wide at each zoom
+GRID_CELLS = {5: 1.0, 6: 0.5}
+
+
+def level_for_zoom(zoom):
+    """Aggregation level and grid cell size (degrees) for a map zoom"""
+    if zoom is None:
+        return 'city', None
+    if zoom < min(GRID_CELLS):
+        return 'province', None
+    if zoom in GRID_CELLS:
+        return 'grid', GRID_CELLS[zoom]
+    return 'city', None
+
+
+def parse_bbox(value):
+    """'min_lon,min_lat,max_lon,max_lat' -> tuple of floats"""
+    parts = [float(part) for part in value.split(',')]
+    if len(parts) != 4:
+        raise ValueError("bbox needs four numbers: min_lon,min_lat,max_lon,max_lat")
+    min_lon, min_lat, max_lon, max_lat = parts
+    if min_lon > max_lon or min_lat > max_lat:
+        raise ValueError("bbox minimum is greater than its maximum")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+class FeatureLayer:
+    """Point features with their coordinates kept in arrays for bbox filtering"""
+
+    def __init__(self, level, features):
+        self.level = level
+        self.features = features
+        self.lon = np.array([f['geometry']['coordinates'][0] for f in features], dtype=float)
+        self.lat = np.array([f['geometry']['coordinates'][1] for f in features], dtype=float)
+
+    def within(self, bbox=None):
+        if bbox is None:
+            return self.features
+        min_lon, min_lat, max_lon, max_lat = bbox
+        mask = (self.lon >= min_lon) & (self.lon <= max_lon) & (self.lat >= min_lat) & (self.lat <= max_lat)
+        return [self.features[i] for i in np.flatnonzero(mask)]
+
+
+def _feature(level, name, lon, lat, shop_count, **properties):
+    return {
+        "type": "Feature",
+        "properties": {
+            "name": name,
+            "level": level,
+            "shop_count": int(shop_count),
+            **properties,
+            "popup": f"{name}: {int(shop_count)} shops",
+        },
+        "geometry": {
+            "type": "Point",
+            "coordinates": [round(float(lon), 4), round(float(lat), 4)],
+        },
+    }
+
+
+class MapLayers:
+    """Geocoded shop counts of one snapshot, aggregated per zoom level"""
+
+    def __init__(self, city_counts, gazetteer):
+        # city_counts: shops per (city, province); province is None when the
+        # details table does not say
+        rows = []
+        unmatched = {}
+        province_only = {}
+        for (city, province_name), count in city_counts.items():
+            place = gazetteer.find_city(city, province_name)
+            if place is not None:
+                rows.append((place.name, place.province, place.lat, place.lon, int(count)))
+                continue
+            unmatched[city] = unmatched.get(city, 0) + int(count)
+            # Still count the shops towards their province if the details
+            # table tells us which one it is
+            province = gazetteer.find_province(province_name)
+            if province is not None:
+                province_only[province.name] = province_only.get(province.name, 0) + int(count)
+
+        cities = pd.DataFrame(rows, columns=['name', 'province', 'lat', 'lon', 'shop_count'])
+        # Different spellings of one city collapse onto the same place
+        self.cities = cities.groupby(['name', 'province', 'lat', 'lon'], as_index=False)['shop_count'].sum()
+        self.unmatched = pd.Series(unmatched, dtype='int64').sort_values(ascending=False)
+        self.matched_shops = int(self.cities['shop_count'].sum())
+
+        # Every level the map can ask for is built up front, once per snapshot
+        self._layers = {
+            ('city', None): self._city_layer(),
+            ('province', None): self._province_layer(gazetteer, province_only),
+        }
+        for cell in GRID_CELLS.values():
+            self._layers[('grid', cell)] = self._grid_layer(cell)
+
+    def _city_layer(self):
+        ordered = self.cities.sort_values('shop_count', ascending=False)
+        features = [
+            _feature('city', row.name, row.lon, row.lat, row.shop_count, city=row.name, province=row.province)
+            for row in ordered.itertuples(index=False)
+        ]
+        return FeatureLayer('city', features)
+
+    def _province_layer(self, gazetteer, province_only):
+        totals = self.cities.groupby('province').agg(
+            shop_count=('shop_count', 'sum'),
+            city_count=('name', 'size'),
+        )
+        for province, count in province_only.items():
+            if province not in totals.index:
+                totals.loc[province] = [0, 0]
+            totals.loc[province, 'shop_count'] += count
+
+        features = []
+        for province, row in totals.sort_values('shop_count', ascending=False).iterrows():
+            place = gazetteer.find_province(province)
+            features.append(_feature('province', province, place.lon, place.lat, row['shop_count'],
+                                     province=province, city_count=int(row['city_count'])))
+        return FeatureLayer('province', features)
+
+    def _grid_layer(self, cell):
+        cities = self.cities.sort_values('shop_count', ascending=False).assign(
+            col=np.floor(self.cities['lon'] / cell).astype(int),
+            row=np.floor(self.cities['lat'] / cell).astype(int),
+            lon_weighted=self.cities['lon'] * self.cities['shop_count'],
+            lat_weighted=self.cities['lat'] * self.cities['shop_count'],
+        )
+        bins = cities.groupby(['col', 'row']).agg(
+            shop_count=('shop_count', 'sum'),
+            city_count=('name', 'size'),
+            lon_weighted=('lon_weighted', 'sum'),
+            lat_weighted=('lat_weighted', 'sum'),
+            top_city=('name', 'first'),
+        ).sort_values('shop_count', ascending=False)
+
+        features = []
+        for (col, row), b in bins.iterrows():
+            # Place the marker at the shop-weighted centre of its cities
+            # rather than the cell centre so it stays on land
+            weight = max(b['shop_count'], 1)
+            features.append(_feature(
+                'grid', b['top_city'] if b['city_count'] == 1 else f"{b['top_city']} +{b['city_count'] - 1}",
+                b['lon_weighted'] / weight, b['lat_weighted'] / weight, b['shop_count'],
+                city_count=int(b['city_count']),
+                cell=[col * cell, row * cell, (col + 1) * cell, (row + 1) * cell],
+            ))
+        return FeatureLayer('grid', features)
+
+    def layer(self, level, cell=None):
+        return self._layers[(level, cell)]
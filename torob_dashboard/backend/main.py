@@ -1,16 +1,43 @@
-from fastapi import FastAPI, HTTPException
+from fastapi import FastAPI, HTTPException, Query, Request, Response
+from fastapi.responses import StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.middleware.gzip import GZipMiddleware
 import pandas as pd
+import numpy as np
 import json
-from typing import List, Dict, Optional
+from typing import List, Optional
 from pydantic import BaseModel
 import os
-from collections import Counter
+import sys
+import asyncio
+import hashlib
+from urllib.parse import quote
+
+sys.path.append(os.path.dirname(os.path.abspath(__file__)))
+# The analysis package lives at the repository root, next to the crawlers
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'))
+
+from snapshot import SnapshotManager
+from compute import ComputePool, run_inline
+from geo import GRID_CELLS, level_for_zoom, parse_bbox
+from responses import FORMATS, FastJSONResponse, dumps, ndjson_response
+import export
+from metrics import Metrics, MetricsMiddleware
+from persian_text import normalize
+from analysis.sketches import DEFAULT_QUANTILES, MarketSketch
+from analysis.categories import CategoryTable
+from analysis.prices import METHODS as PRICE_METHODS, clean_prices
+
+try:
+    from brotli_asgi import BrotliMiddleware
+except ImportError:
+    BrotliMiddleware = None
 
 app = FastAPI(
     title="Torob Market Geographical Dashboard API",
     description="API for analyzing Torob market data geographically",
-    version="1.0.0"
+    version="1.0.0",
+    default_response_class=FastJSONResponse
 )
 
 # CORS middleware
@@ -22,44 +49,125 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
-# Global variables for data
-shops_df = None
-shop_details_df = None
-products_df = None
+# Compress responses; brotli when the client accepts it, gzip otherwise
+if BrotliMiddleware is not None:
+    # Exports carry their own Arrow/Parquet compression
+    app.add_middleware(BrotliMiddleware, minimum_size=1000, gzip_fallback=True,
+                       excluded_handlers=[r"^/api/export/"])
+else:
+    app.add_middleware(GZipMiddleware, minimum_size=1000)
+
+# Per-route latency, payload size and compute time. With TOROB_PROFILING=1,
+# ?profile=1 from localhost (or with the TOROB_PROFILE_TOKEN in an
+# X-Profile-Token header) returns a pyinstrument profile instead
+metrics = Metrics()
+app.add_middleware(
+    MetricsMiddleware,
+    metrics=metrics,
+    profiling=os.environ.get("TOROB_PROFILING", "0") == "1",
+    profile_token=os.environ.get("TOROB_PROFILE_TOKEN") or None,
+    inline_compute=run_inline
+)
+
+# Data locations
+base_path = os.environ.get("TOROB_DATA_DIR", "/home/maede/Projects/torob_analysis")
+search_index_dir = os.environ.get("TOROB_SEARCH_INDEX", f"{base_path}/search_index")
+reload_interval = int(os.environ.get("TOROB_RELOAD_INTERVAL", "30"))
+# Hits one /api/products/search request may ask for
+MAX_SEARCH_RESULTS = 500
+# Written by `python -m analysis.sketches`; answers /api/analytics/sketch
+# while the product table is still loading
+sketch_path = os.environ.get("TOROB_SKETCH", f"{base_path}/products_sketch.json")
+
+# Set by `start_backend.py --production`: serve from memory-mapped Arrow
+# files shared by all uvicorn workers instead of parsing the CSVs
+shared_snapshot_dir = os.environ.get("TOROB_SHARED_SNAPSHOT")
+
+# All endpoints read from data.current; a reload swaps it atomically
+data = SnapshotManager(
+    base_path,
+    search_index_dir,
+    poll_interval=reload_interval,
+    shared_dir=shared_snapshot_dir
+)
+
+# Heavy pandas work runs here rather than on the event loop
+compute = ComputePool(
+    max_workers=int(os.environ.get("TOROB_COMPUTE_WORKERS", "0")) or None,
+    inline=os.environ.get("TOROB_COMPUTE_INLINE") == "1",
+    metrics=metrics
+)
 
 def load_data():
     """Load CSV data files"""
-    global shops_df, shop_details_df, products_df
-    
-    try:
-        # Load the CSV files
-        base_path = "/home/maede/Projects/torob_analysis"
-        
-        shops_df = pd.read_csv(f"{base_path}/torob_shops.csv")
-        print(f"Loaded {len(shops_df)} shops")
-        
-        # Load shop details (this might be large)
-        try:
-            shop_details_df = pd.read_csv(f"{base_path}/shopinfo_detail.csv")
-            print(f"Loaded {len(shop_details_df)} shop details")
-        except Exception as e:
-            print(f"Could not load shop details: {e}")
-            shop_details_df = None
-            
-        try:
-            products_df = pd.read_csv(f"{base_path}/shop_products.csv")
-            print(f"Loaded {len(products_df)} products")
-        except Exception as e:
-            print(f"Could not load products: {e}")
-            products_df = None
-            
-    except Exception as e:
-        print(f"Error loading data: {e}")
+    return data.reload()
 
-# Load data on startup
+# Start loading in the background so the server answers immediately;
+# the shops table is ready first and the product table streams in after
 @app.on_event("startup")
 async def startup_event():
-    load_data()
+    data.start(watch=reload_interval > 0)
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    data.stop_watching()
+    compute.shutdown()
+
+ATTRS = {
+    'shops': 'shops_df',
+    'shop_details': 'shop_details_df',
+    'products': 'products_df',
+    'search_index': 'search_index',
+}
+
+DATASET_LABELS = {
+    'shops': "Shop data",
+    'shop_details': "Shop details data",
+    'products': "Product data",
+    'search_index': "Product search index",
+}
+
+def require_loaded(snap, *datasets):
+    """Answer 503 while a dataset the endpoint needs is still being loaded"""
+    for name in datasets:
+        if getattr(snap, ATTRS[name]) is None and data.is_loading(name):
+            status = data.status[name]
+            raise HTTPException(
+                status_code=503,
+                detail=f"{DATASET_LABELS[name]} is still loading ({status['progress']:.0%})",
+                headers={"Retry-After": "5"}
+            )
+
+def mark_partial(response, snap, *datasets):
+    """Flag a response computed without optional datasets that are still loading"""
+    loading = [name for name in datasets if getattr(snap, ATTRS[name]) is None and data.is_loading(name)]
+    if loading:
+        response.headers["X-Datasets-Loading"] = ",".join(loading)
+    return loading
+
+# Precomputed lists are built from the snapshot by our own code, so they are
+# sent without a second per-item pass through their response_model. Set
+# TOROB_VALIDATE_RESPONSES=1 to validate them anyway while debugging.
+validate_responses = os.environ.get("TOROB_VALIDATE_RESPONSES") == "1"
+
+def check_format(format):
+    if format not in FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format} (use {' or '.join(FORMATS)})")
+
+def send_trusted(content, response=None, format="json", items=None):
+    """Send trusted precomputed content, as JSON or streamed as NDJSON
+
+    items selects the list to stream when content wraps it in an object.
+    """
+    headers = {}
+    if response is not None and "X-Datasets-Loading" in response.headers:
+        headers["X-Datasets-Loading"] = response.headers["X-Datasets-Loading"]
+
+    if format == "ndjson":
+        return ndjson_response(content if items is None else content[items], headers=headers)
+    if validate_responses:
+        return content
+    return FastJSONResponse(content, headers=headers)
 
 # Pydantic models
 class ShopLocation(BaseModel):
@@ -92,99 +200,125 @@ async def root():
 
 @app.get("/api/health")
 async def health_check():
+    snap = data.current
     return {
         "status": "healthy",
-        "shops_loaded": shops_df is not None,
-        "shop_details_loaded": shop_details_df is not None,
-        "products_loaded": products_df is not None,
-        "total_shops": len(shops_df) if shops_df is not None else 0
+        "data_version": snap.version,
+        "data_loaded_at": snap.loaded_at,
+        "shared_snapshot": data.shared_dir is not None,
+        "last_reload_error": data.last_error,
+        "datasets": data.status,
+        "shops_loaded": snap.shops_df is not None,
+        "shop_details_loaded": snap.shop_details_df is not None,
+        "products_loaded": snap.products_df is not None,
+        "search_index_loaded": snap.search_index is not None,
+        "total_shops": len(snap.shops_df) if snap.shops_df is not None else 0
     }
 
+@app.get("/metrics")
+async def get_metrics(format: str = "prometheus"):
+    """Request metrics of this worker, Prometheus text or a JSON summary (format=json)"""
+    if format == "json":
+        return metrics.summary()
+    return Response(metrics.prometheus(), media_type="text/plain; version=0.0.4")
+
+@app.post("/api/admin/reload")
+async def reload_data():
+    """Rebuild the data snapshot now instead of waiting for the watcher"""
+    # Build off the event loop so requests keep being served meanwhile
+    loop = asyncio.get_running_loop()
+    if not await loop.run_in_executor(None, data.reload):
+        raise HTTPException(status_code=500, detail=f"Reload failed: {data.last_error}")
+    return {"data_version": data.current.version}
+
 @app.get("/api/shops/by-city", response_model=List[CityStats])
-async def get_shops_by_city():
-    """Get shop statistics grouped by city"""
+async def get_shops_by_city(response: Response, format: str = "json"):
+    """Get shop statistics grouped by city (format=ndjson streams one city per line)"""
+    check_format(format)
+    snap = data.current
+    shops_df = snap.shops_df
+    require_loaded(snap, 'shops')
+    mark_partial(response, snap, 'shop_details')
     if shops_df is None:
         raise HTTPException(status_code=500, detail="Shop data not loaded")
     
-    # Group by city
-    city_groups = shops_df.groupby('city').agg({
+    result = await compute.run(('by-city', snap.version), compute_shops_by_city, snap)
+    return send_trusted(result, response, format)
+
+def compute_shops_by_city(snap):
+    # The (city, province) x shop type table is counted once per snapshot;
+    # provinces come from each shop's own details row
+    table = snap.aggregates['city_shop_types']
+
+    def counts(shop_type):
+        return table[shop_type].tolist() if shop_type in table.columns else [0] * len(table)
+
+    # Plain dicts in CityStats layout, largest cities first; see send_trusted
+    return [
+        {
+            "city": city,
+            "province": province,
+            "shop_count": shop_count,
+            "online_shops": online,
+            "offline_shops": offline,
+            "mixed_shops": mixed,
+            "total_products": None
+        }
+        for (city, province), shop_count, online, offline, mixed in zip(
+            table.index, table.sum(axis=1).tolist(),
+            counts('online'), counts('offline'), counts('online-offline'))
+    ]
+
+@app.get("/api/shops/by-province", response_model=List[ProvinceStats])
+async def get_shops_by_province(format: str = "json"):
+    """Get shop statistics grouped by province (format=ndjson streams one province per line)"""
+    check_format(format)
+    snap = data.current
+    shop_details_df = snap.shop_details_df
+    require_loaded(snap, 'shop_details')
+    if shop_details_df is None:
+        raise HTTPException(status_code=404, detail="Shop details data not available")
+    
+    # Errors become HTTP errors here, not in the worker, whose result every coalesced waiter shares
+    try:
+        result = await compute.run(('by-province', snap.version), compute_shops_by_province, shop_details_df)
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Error processing province data: {str(e)}")
+    return send_trusted(result, format=format)
+
+def compute_shops_by_province(shop_details_df):
+    # Group by province
+    province_groups = shop_details_df.groupby('province').agg({
         'id': 'count',
-        'shop_type': lambda x: (x == 'online').sum(),
-        'shop_type': lambda x: (x == 'offline').sum() if 'offline' in x.values else 0,
-        'shop_type': lambda x: (x == 'online-offline').sum() if 'online-offline' in x.values else 0
+        'city': lambda x: list(set(x)),
+        'shop_type': lambda x: x.mode().iloc[0] if len(x.mode()) > 0 else 'unknown'
     }).reset_index()
     
-    # Get province info if available
-    province_mapping = {}
-    if shop_details_df is not None:
-        try:
-            province_data = shop_details_df[['city', 'province']].drop_duplicates()
-            province_mapping = dict(zip(province_data['city'], province_data['province']))
-        except:
-            pass
-    
-    # Process shop types properly
     result = []
-    for city in shops_df['city'].unique():
-        if pd.isna(city):
+    for _, row in province_groups.iterrows():
+        if pd.isna(row['province']):
             continue
             
-        city_data = shops_df[shops_df['city'] == city]
-        shop_types = city_data['shop_type'].value_counts()
-        
-        result.append(CityStats(
-            city=city,
-            province=province_mapping.get(city),
-            shop_count=len(city_data),
-            online_shops=shop_types.get('online', 0),
-            offline_shops=shop_types.get('offline', 0),
-            mixed_shops=shop_types.get('online-offline', 0)
-        ))
+        result.append({
+            "province": row['province'],
+            "shop_count": int(row['id']),
+            "cities": row['city'],
+            "dominant_shop_type": row['shop_type']
+        })
     
     # Sort by shop count
-    result.sort(key=lambda x: x.shop_count, reverse=True)
+    result.sort(key=lambda x: x["shop_count"], reverse=True)
     return result
 
-@app.get("/api/shops/by-province", response_model=List[ProvinceStats])
-async def get_shops_by_province():
-    """Get shop statistics grouped by province"""
-    if shop_details_df is None:
-        raise HTTPException(status_code=404, detail="Shop details data not available")
-    
-    try:
-        # Group by province
-        province_groups = shop_details_df.groupby('province').agg({
-            'id': 'count',
-            'city': lambda x: list(set(x)),
-            'shop_type': lambda x: x.mode().iloc[0] if len(x.mode()) > 0 else 'unknown'
-        }).reset_index()
-        
-        result = []
-        for _, row in province_groups.iterrows():
-            if pd.isna(row['province']):
-                continue
-                
-            result.append(ProvinceStats(
-                province=row['province'],
-                shop_count=row['id'],
-                cities=row['city'],
-                dominant_shop_type=row['shop_type']
-            ))
-        
-        # Sort by shop count
-        result.sort(key=lambda x: x.shop_count, reverse=True)
-        return result
-        
-    except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error processing province data: {str(e)}")
-
 @app.get("/api/shops/top-cities")
 async def get_top_cities(limit: int = 20):
     """Get top cities by shop count"""
-    if shops_df is None:
+    snap = data.current
+    require_loaded(snap, 'shops')
+    if snap.shops_df is None:
         raise HTTPException(status_code=500, detail="Shop data not loaded")
     
-    city_counts = shops_df['city'].value_counts().head(limit)
+    city_counts = snap.aggregates['city_counts'].head(limit)
     
     return {
         "cities": [
@@ -198,60 +332,122 @@ async def search_shops(
     city: Optional[str] = None,
     province: Optional[str] = None,
     shop_type: Optional[str] = None,
-    limit: int = 100
+    limit: int = 100,
+    format: str = "json"
 ):
-    """Search shops by various criteria"""
+    """Search shops by various criteria (format=ndjson streams one shop per line)"""
+    check_format(format)
+    snap = data.current
+    shops_df, shop_details_df = snap.shops_df, snap.shop_details_df
+    require_loaded(snap, 'shops')
+    if province:
+        require_loaded(snap, 'shop_details')
     if shops_df is None:
         raise HTTPException(status_code=500, detail="Shop data not loaded")
     
-    filtered_df = shops_df.copy()
-    
+    result = await compute.run(
+        ('shops-search', snap.version, city, province, shop_type, limit),
+        compute_shop_search, snap, city, province, shop_type, limit
+    )
+    return send_trusted(result, format=format, items="shops")
+
+def compute_shop_search(snap, city, province, shop_type, limit):
+    shops_df, join = snap.shops_df, snap.aggregates['shop_join']
+
+    # City and province match as substrings of the distinct names; the
+    # matching rows come from the join index instead of scanning the table
+    rows = join.filter_rows(city=city, province=province if snap.shop_details_df is not None else None,
+                            shop_type=shop_type)
+    if rows is None:
+        rows = np.arange(len(shops_df))
+    rows = rows[:max(limit, 0)]
+
+    page = shops_df.iloc[rows]
+    columns = {
+        "id": join.ids(rows).tolist(),
+        "name": page['name'].tolist(),
+        "city": page['city'].tolist(),
+        "province": join.province.name_of(join.province.codes[rows]).tolist(),
+        "shop_type": page['shop_type'].tolist(),
+        "domain": page['domain'].tolist() if 'domain' in page.columns else [''] * len(rows),
+        "score_percentile": page['score_percentile'].tolist() if 'score_percentile' in page.columns else [0] * len(rows),
+    }
+    result = [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+    return {"shops": result, "total": len(result)}
+
+@app.get("/api/products/search")
+async def search_products(
+    q: str,
+    shop_id: Optional[int] = None,
+    city: Optional[str] = None,
+    min_price: Optional[float] = None,
+    max_price: Optional[float] = None,
+    limit: int = Query(20, ge=1, le=MAX_SEARCH_RESULTS)
+):
+    """Full-text search over product names, ranked by BM25"""
+    snap = data.current
+    shops_df, search_index = snap.shops_df, snap.search_index
+    require_loaded(snap, 'search_index')
     if city:
-        filtered_df = filtered_df[filtered_df['city'].str.contains(city, case=False, na=False)]
-    
-    if shop_type:
-        filtered_df = filtered_df[filtered_df['shop_type'] == shop_type]
+        require_loaded(snap, 'shops')
+    if search_index is None:
+        raise HTTPException(status_code=404, detail="Product search index not available")
+    if city and shops_df is None:
+        raise HTTPException(status_code=500, detail="Shop data not loaded")
     
-    # If province filter and we have shop details
-    if province and shop_details_df is not None:
-        try:
-            province_cities = shop_details_df[
-                shop_details_df['province'].str.contains(province, case=False, na=False)
-            ]['city'].unique()
-            filtered_df = filtered_df[filtered_df['city'].isin(province_cities)]
-        except:
-            pass
+    return await compute.run(
+        ('products-search', snap.version, q, shop_id, city, min_price, max_price, limit),
+        compute_product_search, snap, q, shop_id, city, min_price, max_price, limit
+    )
+
+def compute_product_search(snap, q, shop_id, city, min_price, max_price, limit):
+    search_index = snap.search_index
     
-    # Limit results
-    filtered_df = filtered_df.head(limit)
+    # Restrict to the requested shop and/or the shops located in a city
+    shop_ids = None
+    if shop_id is not None:
+        shop_ids = {shop_id}
+    if city:
+        join = snap.aggregates['shop_join']
+        city_ids = set(join.ids(join.filter_rows(city=city, exact=True)).tolist())
+        shop_ids = city_ids if shop_ids is None else shop_ids & city_ids
     
-    # Convert to list of dictionaries
-    result = []
-    for _, row in filtered_df.iterrows():
-        result.append({
-            "id": int(row['id']),
-            "name": row['name'],
-            "city": row['city'],
-            "shop_type": row['shop_type'],
-            "domain": row.get('domain', ''),
-            "score_percentile": row.get('score_percentile', 0)
-        })
+    result = search_index.search(
+        q,
+        shop_ids=shop_ids,
+        min_price=min_price,
+        max_price=max_price,
+        limit=limit
+    )
     
-    return {"shops": result, "total": len(result)}
+    return {"query": q, **result}
 
 @app.get("/api/analytics/overview")
-async def get_analytics_overview():
+async def get_analytics_overview(response: Response):
     """Get overall analytics overview"""
+    snap = data.current
+    shops_df = snap.shops_df
+    require_loaded(snap, 'shops')
+    loading = mark_partial(response, snap, 'shop_details', 'products')
     if shops_df is None:
         raise HTTPException(status_code=500, detail="Shop data not loaded")
     
+    overview = await compute.run(('overview', snap.version), compute_analytics_overview, snap)
+    return {**overview, "datasets_loading": loading}
+
+def compute_analytics_overview(snap):
+    shops_df, shop_details_df, products_df = snap.shops_df, snap.shop_details_df, snap.products_df
+    
     # Basic stats
+    city_shop_types = snap.aggregates['city_shop_types']
     total_shops = len(shops_df)
-    unique_cities = shops_df['city'].nunique()
-    shop_type_counts = shops_df['shop_type'].value_counts().to_dict()
+    unique_cities = len(snap.aggregates['city_counts'])
+    type_totals = city_shop_types.sum().drop('', errors='ignore').sort_values(ascending=False)
+    shop_type_counts = {shop_type: int(count) for shop_type, count in type_totals.items()}
     
     # Top cities
-    top_cities = shops_df['city'].value_counts().head(10).to_dict()
+    top_cities = snap.aggregates['city_counts'].head(10).to_dict()
     
     # Province stats if available
     province_stats = {}
@@ -284,54 +480,279 @@ async def get_analytics_overview():
         **product_stats
     }
 
+@app.get("/api/analytics/sketch")
+async def get_analytics_sketch(quantiles: Optional[str] = None, top: int = 20):
+    """Approximate price quantiles, distinct counts and top categories over all products
+
+    Every estimate comes with its error bound (see analysis/sketches.py).
+    quantiles is a comma-separated list of fractions such as 0.5,0.9,0.99.
+    """
+    try:
+        qs = [float(q) for q in quantiles.split(",")] if quantiles else list(DEFAULT_QUANTILES)
+    except ValueError:
+        raise HTTPException(status_code=400, detail=f"Invalid quantiles: {quantiles}")
+    if not qs or any(not 0 <= q <= 1 for q in qs):
+        raise HTTPException(status_code=400, detail="Quantiles must be between 0 and 1")
+
+    snap = data.current
+    if snap.products_df is not None:
+        sketch = await compute.run(('sketch', snap.version), compute_market_sketch, snap)
+        source = "snapshot"
+    elif os.path.exists(sketch_path):
+        sketch = await compute.run(('sketch-file', snap.version), load_sketch_file, snap)
+        source = "file"
+    else:
+        require_loaded(snap, 'products')
+        raise HTTPException(status_code=404, detail="Product data not available")
+
+    return {"source": source, **sketch.summary(qs, top)}
+
+def compute_market_sketch(snap):
+    return snap.memo('market_sketch', lambda: MarketSketch.from_frame(snap.products_df))
+
+def load_sketch_file(snap):
+    # Keyed on mtime so a rewritten file is picked up
+    return snap.memo(('sketch_file', os.path.getmtime(sketch_path)), lambda: MarketSketch.load(sketch_path))
+
+@app.get("/api/analytics/prices")
+async def get_price_bounds(method: str = "mad", threshold: Optional[float] = None, top: int = 20):
+    """Robust price bounds of every product category and the outliers outside them
+
+    Each category's bounds come from its own log prices: median +- threshold
+    MADs (method=mad, default 3.5) or Tukey fences (method=iqr, default 1.5);
+    see analysis/prices.py. Lists the top categories with the most outliers.
+    """
+    if method not in PRICE_METHODS:
+        raise HTTPException(status_code=400, detail=f"Unknown method: {method} (use mad or iqr)")
+    if threshold is not None and threshold <= 0:
+        raise HTTPException(status_code=400, detail="Threshold must be positive")
+
+    snap = data.current
+    require_loaded(snap, 'products')
+    if snap.products_df is None:
+        raise HTTPException(status_code=404, detail="Product data not available")
+
+    cleaning = await compute.run(('prices', snap.version, method, threshold),
+                                 compute_price_cleaning, snap, method, threshold)
+    return cleaning.summary(top)
+
+def compute_price_cleaning(snap, method, threshold):
+    def build():
+        products_df = snap.products_df
+        categories = None
+        if 'primary_category_id' not in products_df.columns:
+            categories = snap.memo('product_categories', lambda: CategoryTable(products_df['categories']))
+        # Bounds and totals only; the per-product flags are not kept
+        return clean_prices(products_df, categories, method=method, threshold=threshold).bounds_only()
+    return snap.memo(('price_cleaning', method, threshold), build)
+
+@app.get("/api/categories")
+async def get_category_tree(under: Optional[str] = None, depth: Optional[int] = None):
+    """Category hierarchy with product counts, in preorder
+
+    Nodes are numbered so that the subtree of node n is n .. end - 1.
+    under (a category id or name) limits the response to that subtree;
+    depth drops deeper levels (1 = top-level categories only).
+    """
+    snap = data.current
+    require_loaded(snap, 'products')
+    if snap.products_df is None:
+        raise HTTPException(status_code=404, detail="Product data not available")
+
+    nodes = await compute.run(('categories', snap.version, under, depth), compute_category_tree, snap, under, depth)
+    if nodes is None:
+        raise HTTPException(status_code=404, detail=f"Unknown category: {under}")
+    return nodes
+
+def compute_category_tree(snap, under, depth):
+    tree, _ = export.category_tree(snap)
+    first, end = 1, len(tree)
+    if under is not None:
+        matches = tree.find(under, key=lambda text: normalize(text).strip())
+        if not len(matches):
+            return None
+        first, end = int(matches[0]), int(tree.end[matches[0]])
+    frame = tree.frame().loc[first:end - 1]
+    if depth is not None:
+        frame = frame[frame['depth'] <= depth]
+    return frame.reset_index().to_dict('records')
+
 @app.get("/api/maps/geojson")
-async def get_geojson_data():
-    """Get GeoJSON data for map visualization"""
-    if shops_df is None:
+async def get_geojson_data(zoom: Optional[int] = None, bbox: Optional[str] = None,
+                           level: Optional[str] = None):
+    """Get GeoJSON data for map visualization
+
+    zoom picks the aggregation (provinces when zoomed out, grid bins in
+    between, every city when zoomed in) unless level is given explicitly;
+    bbox=min_lon,min_lat,max_lon,max_lat limits the response to the view.
+    """
+    snap = data.current
+    require_loaded(snap, 'shops')
+    if snap.shops_df is None:
         raise HTTPException(status_code=500, detail="Shop data not loaded")
-    
-    # For now, we'll create a simple city-based GeoJSON
-    # In a real implementation, you'd have actual coordinates
-    city_counts = shops_df['city'].value_counts()
-    
-    # Simple coordinate mapping for major Iranian cities (you should expand this)
-    city_coordinates = {
-        'تهران': [51.3890, 35.6892],
-        'اصفهان': [51.6746, 32.6546],
-        'مشهد': [59.6077, 36.2972],
-        'شیراز': [52.5387, 29.5926],
-        'تبریز': [46.2919, 38.0962],
-        'کرج': [50.9915, 35.8327],
-        'قم': [50.8764, 34.6401],
-        'اهواز': [48.6693, 31.3183],
-        'کرمانشاه': [47.0778, 34.3142],
-        'ارومیه': [45.0761, 37.5527]
-    }
-    
-    features = []
-    for city, count in city_counts.head(50).items():  # Top 50 cities
-        if city in city_coordinates:
-            feature = {
-                "type": "Feature",
-                "properties": {
-                    "city": city,
-                    "shop_count": int(count),
-                    "popup": f"{city}: {count} shops"
-                },
-                "geometry": {
-                    "type": "Point",
-                    "coordinates": city_coordinates[city]
-                }
-            }
-            features.append(feature)
-    
+
+    level_name, cell = level_for_zoom(zoom)
+    if level is not None:
+        if level not in ('province', 'grid', 'city'):
+            raise HTTPException(status_code=400, detail=f"Unknown level: {level}")
+        level_name = level
+        cell = GRID_CELLS.get(zoom, GRID_CELLS[max(GRID_CELLS)]) if level == 'grid' else None
+
+    bounds = None
+    if bbox:
+        try:
+            bounds = parse_bbox(bbox)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid bbox: {e}")
+
+    return await compute.run(('geojson', snap.version, level_name, cell, bounds),
+                             compute_geojson, snap, level_name, cell, bounds)
+
+def compute_geojson(snap, level, cell=None, bbox=None):
+    # Layers are geocoded and aggregated once per snapshot; a request only
+    # picks one and clips it to the view
+    layers = snap.aggregates['map_layers']
+    features = layers.layer(level, cell).within(bbox)
+
     geojson = {
         "type": "FeatureCollection",
-        "features": features
+        "features": features,
+        "metadata": {
+            "level": level,
+            "cell_size": cell,
+            "feature_count": len(features),
+            "geocoded_shops": layers.matched_shops,
+            "ungeocoded_shops": int(layers.unmatched.sum()),
+            "ungeocoded_cities": layers.unmatched.head(20).to_dict(),
+        }
     }
     
     return geojson
 
+# Schema of the /api/dashboard payload; bump it when the layout changes so
+# clients holding an old copy stop revalidating it
+DASHBOARD_SCHEMA = 1
+DASHBOARD_MAP_ZOOM = 6
+
+@app.get("/api/dashboard")
+async def get_dashboard(request: Request):
+    """Every panel of the dashboard page in one response
+
+    Health, overview, by-city and the initial map layer are built once per
+    data snapshot and sent with an ETag. Clients revalidate with
+    If-None-Match and get an empty 304 until the data changes.
+    """
+    snap = data.current
+    require_loaded(snap, 'shops')
+    if snap.shops_df is None:
+        raise HTTPException(status_code=500, detail="Shop data not loaded")
+
+    body, etag = await compute.run(('dashboard', snap.version), compute_dashboard, snap)
+    headers = {"ETag": etag, "Cache-Control": "no-cache"}
+    if etag_matches(request.headers.get("if-none-match"), etag):
+        return Response(status_code=304, headers=headers)
+    return Response(body, media_type="application/json", headers=headers)
+
+def etag_matches(if_none_match, etag):
+    if not if_none_match:
+        return False
+    tags = [tag.strip().removeprefix("W/") for tag in if_none_match.split(",")]
+    return "*" in tags or etag in tags
+
+def compute_dashboard(snap):
+    # Loading state is part of the payload, so it is part of the tag too
+    loading = [name for name in DATASET_LABELS if getattr(snap, ATTRS[name]) is None and data.is_loading(name)]
+    loaded = [name for name in DATASET_LABELS if getattr(snap, ATTRS[name]) is not None]
+
+    def build():
+        payload = {
+            "schema_version": DASHBOARD_SCHEMA,
+            "data_version": snap.version,
+            "data_loaded_at": snap.loaded_at,
+            "datasets_loading": loading,
+            "health": {
+                "status": "healthy",
+                "shops_loaded": True,
+                "shop_details_loaded": snap.shop_details_df is not None,
+                "products_loaded": snap.products_df is not None,
+                "search_index_loaded": snap.search_index is not None,
+                "total_shops": len(snap.shops_df),
+            },
+            "overview": {**compute_analytics_overview(snap), "datasets_loading": loading},
+            "cities": compute_shops_by_city(snap),
+            "map": compute_geojson(snap, *level_for_zoom(DASHBOARD_MAP_ZOOM)),
+        }
+        # Derived from the source files rather than data_version, which
+        # counts reloads per worker, so every worker agrees on the tag
+        source = json.dumps([DASHBOARD_SCHEMA, sorted(snap.fingerprint.items()), loaded, loading])
+        return dumps(payload), f'"{hashlib.sha1(source.encode()).hexdigest()[:20]}"'
+
+    return snap.memo(('dashboard', tuple(loading)), build)
+
+@app.get("/api/export/{dataset}")
+async def export_dataset(
+    dataset: str,
+    format: str = "arrow",
+    city: Optional[str] = None,
+    province: Optional[str] = None,
+    category: Optional[str] = None,
+    shop_type: Optional[str] = None,
+    columns: Optional[str] = None,
+    limit: Optional[int] = None,
+    compression: str = "zstd"
+):
+    """Bulk export of shops, shop_details or products as an Arrow IPC stream or Parquet
+
+    category matches a category name or id; shops and shop details are
+    exported when they sell at least one product in it.
+    """
+    if export.pa is None:
+        raise HTTPException(status_code=501, detail="Exports need pyarrow (pip install pyarrow)")
+    if dataset not in export.DATASETS:
+        raise HTTPException(status_code=404, detail=f"Unknown dataset: {dataset}")
+    if format not in export.FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format} (use arrow or parquet)")
+    if compression not in export.COMPRESSIONS:
+        raise HTTPException(status_code=400, detail=f"Unknown compression: {compression}")
+
+    snap = data.current
+    require_loaded(snap, dataset)
+    if city or shop_type or (province and dataset != 'shop_details'):
+        require_loaded(snap, 'shops')
+    if province and dataset != 'shop_details':
+        require_loaded(snap, 'shop_details')
+    if category:
+        require_loaded(snap, 'products')
+    if getattr(snap, ATTRS[dataset]) is None:
+        raise HTTPException(status_code=404, detail=f"{DATASET_LABELS[dataset]} not available")
+
+    column_list = [col.strip() for col in columns.split(',')] if columns else None
+    try:
+        table = await compute.run(
+            ('export', snap.version, dataset, city, province, category, shop_type, columns, limit),
+            compute_export, snap, dataset, city, province, category, shop_type, column_list, limit
+        )
+    except export.ExportError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
+    filename = export.export_filename(
+        dataset, format, {'city': city, 'province': province, 'category': category, 'shop_type': shop_type}
+    )
+    return StreamingResponse(
+        export.stream_table(table, format, compression),
+        media_type=export.FORMATS[format][0],
+        headers={
+            "Content-Disposition": f"attachment; filename*=UTF-8''{quote(filename)}",
+            "X-Row-Count": str(table.num_rows),
+        }
+    )
+
+def compute_export(snap, dataset, city, province, category, shop_type, columns, limit):
+    frame = export.filter_dataset(snap, dataset, city, province, category, shop_type)
+    if limit is not None:
+        frame = frame.head(limit)
+    return export.to_arrow_table(frame, columns)
+
 if __name__ == "__main__":
     import uvicorn
     uvicorn.run(app, host="0.0.0.0", port=8000)
@@ -0,0 +1,288 @@
+"""
+Request metrics and on-demand profiling
+
+MetricsMiddleware records, per route template, a latency histogram, a
+response size histogram (bytes on the wire) and how much of the request was
+spent in ComputePool work. /metrics renders them in the Prometheus text
+format, or as a JSON summary with estimated percentiles.
+
+Adding ?profile=1 (or an X-Profile: 1 header) to any request runs it under
+pyinstrument and returns the profile instead of the normal response:
+`html` (the default) opens pyinstrument's flame/call-tree view in the
+browser, `speedscope` returns JSON for https://www.speedscope.app. Compute
+work of a profiled request runs on the event loop thread so it shows up in
+the samples. Profiling is off unless the app enables it (TOROB_PROFILING=1),
+and then only answers clients on localhost or requests carrying the
+configured token in an X-Profile-Token header (TOROB_PROFILE_TOKEN).
+
+Each uvicorn worker keeps its own counters.
+"""
+
+import time
+import hmac
+import threading
+from contextvars import ContextVar
+from urllib.parse import parse_qs
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+SIZE_BUCKETS = (1e3, 1e4, 1e5, 1e6, 1e7, 1e8)
+LOOPBACK_HOSTS = ('127.0.0.1', '::1', 'localhost')
+
+# Compute seconds spent on behalf of the current request
+request_compute = ContextVar('request_compute', default=None)
+
+
+class Histogram:
+    """Cumulative-bucket histogram in the Prometheus style"""
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        else:
+            self.counts[-1] += 1
+        self.count += 1
+        self.sum += value
+        self.min = value if self.min is None else min(self.min, value)
+        self.max = value if self.max is None else max(self.max, value)
+
+    def quantile(self, q):
+        """Estimate a quantile by interpolating inside its bucket"""
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        lower = 0.0
+        estimate = self.max
+        for i, bound in enumerate(self.buckets):
+            if seen + self.counts[i] >= rank:
+                estimate = lower + (bound - lower) * (rank - seen) / max(self.counts[i], 1)
+                break
+            seen += self.counts[i]
+            lower = bound
+        # Never report outside what was actually observed
+        return min(max(estimate, self.min), self.max)
+
+    def prometheus(self, name, labels):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            lines.append(f'{name}_bucket{{{labels},le="{bound:g}"}} {cumulative}')
+        lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {self.count}')
+        lines.append(f'{name}_sum{{{labels}}} {self.sum:.6f}')
+        lines.append(f'{name}_count{{{labels}}} {self.count}')
+        return lines
+
+
+class Metrics:
+    """Registry for the request and compute histograms of this process"""
+
+    def __init__(self):
+        self.started = time.time()
+        self.routes = {}
+        self.compute = {}
+        self.statuses = {}
+        self.coalesced = 0
+        self._lock = threading.Lock()
+
+    def observe_request(self, route, status, seconds, size, compute_seconds):
+        with self._lock:
+            entry = self.routes.get(route)
+            if entry is None:
+                entry = self.routes[route] = {
+                    'latency': Histogram(LATENCY_BUCKETS),
+                    'size': Histogram(SIZE_BUCKETS),
+                    'compute': Histogram(LATENCY_BUCKETS),
+                }
+            entry['latency'].observe(seconds)
+            entry['size'].observe(size)
+            entry['compute'].observe(compute_seconds)
+            key = (route, status)
+            self.statuses[key] = self.statuses.get(key, 0) + 1
+
+    def observe_compute(self, name, seconds):
+        """Called by ComputePool once for every function it runs"""
+        with self._lock:
+            if name not in self.compute:
+                self.compute[name] = Histogram(LATENCY_BUCKETS)
+            self.compute[name].observe(seconds)
+
+    def observe_coalesced(self):
+        with self._lock:
+            self.coalesced += 1
+
+    def add_request_compute(self, seconds):
+        """Charge compute time to the request being served (coalesced ones included)"""
+        total = request_compute.get()
+        if total is not None:
+            total[0] += seconds
+
+    def prometheus(self):
+        families = [
+            ('latency', 'torob_http_request_duration_seconds'),
+            ('size', 'torob_http_response_size_bytes'),
+            ('compute', 'torob_http_request_compute_seconds'),
+        ]
+        lines = []
+        with self._lock:
+            # Each metric family has to be listed in one block
+            for field, name in families:
+                lines.append(f'# TYPE {name} histogram')
+                for route, entry in sorted(self.routes.items()):
+                    lines += entry[field].prometheus(name, f'route="{route}"')
+            lines.append('# TYPE torob_http_requests_total counter')
+            for (route, status), count in sorted(self.statuses.items()):
+                lines.append(f'torob_http_requests_total{{route="{route}",status="{status}"}} {count}')
+            lines.append('# TYPE torob_compute_duration_seconds histogram')
+            for name, histogram in sorted(self.compute.items()):
+                lines += histogram.prometheus('torob_compute_duration_seconds', f'task="{name}"')
+            lines.append('# TYPE torob_compute_coalesced_total counter')
+            lines.append(f'torob_compute_coalesced_total {self.coalesced}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """Per-route counts, mean/p50/p99 latency and mean payload size"""
+        def describe(h):
+            return {
+                'count': h.count,
+                'mean_ms': round(h.sum / h.count * 1000, 2) if h.count else 0.0,
+                'p50_ms': round(h.quantile(0.5) * 1000, 2),
+                'p99_ms': round(h.quantile(0.99) * 1000, 2),
+            }
+
+        with self._lock:
+            return {
+                'uptime_seconds': round(time.time() - self.started, 1),
+                'routes': {
+                    route: {
+                        **describe(entry['latency']),
+                        'compute_mean_ms': describe(entry['compute'])['mean_ms'],
+                        'mean_bytes': round(entry['size'].sum / entry['size'].count) if entry['size'].count else 0,
+                    }
+                    for route, entry in sorted(self.routes.items())
+                },
+                'compute': {name: describe(h) for name, h in sorted(self.compute.items())},
+                'coalesced': self.coalesced,
+            }
+
+
+def _profile_mode(scope):
+    """'html' / 'speedscope' when the request asks to be profiled, else None"""
+    query = parse_qs(scope.get('query_string', b'').decode('latin-1'))
+    value = query.get('profile', [None])[0]
+    if value is None:
+        for name, header in scope.get('headers', []):
+            if name == b'x-profile':
+                value = header.decode('latin-1')
+                break
+    if value is None or value.lower() in ('0', 'false', 'no'):
+        return None
+    return 'speedscope' if value.lower() == 'speedscope' else 'html'
+
+
+def _profile_allowed(scope, token):
+    """Token requests need the matching X-Profile-Token header, else only loopback clients may profile"""
+    if token:
+        sent = dict(scope.get('headers', [])).get(b'x-profile-token', b'')
+        return hmac.compare_digest(sent, token.encode('utf-8'))
+    client = scope.get('client') or ('',)
+    return client[0] in LOOPBACK_HOSTS
+
+
+class MetricsMiddleware:
+    """ASGI middleware timing every HTTP request and serving profiles on demand"""
+
+    def __init__(self, app, metrics, profiling=False, profile_token=None, inline_compute=None):
+        self.app = app
+        self.metrics = metrics
+        self.profiling = profiling
+        self.profile_token = profile_token
+        # ContextVar that makes ComputePool run inline for profiled requests
+        self.inline_compute = inline_compute
+
+    async def __call__(self, scope, receive, send):
+        if scope['type'] != 'http':
+            return await self.app(scope, receive, send)
+
+        mode = _profile_mode(scope) if self.profiling else None
+        if mode is not None:
+            if not _profile_allowed(scope, self.profile_token):
+                return await _send_text(send, 403, b"Profiling is only served to localhost or with X-Profile-Token")
+            return await self._profile(scope, receive, send, mode)
+
+        started = time.perf_counter()
+        compute_total = [0.0]
+        token = request_compute.set(compute_total)
+        state = {'status': 500, 'size': 0}
+
+        async def send_wrapper(message):
+            if message['type'] == 'http.response.start':
+                state['status'] = message['status']
+                # Server-Timing shows up in the browser's network panel
+                timing = (f"compute;dur={compute_total[0] * 1000:.1f}, "
+                          f"app;dur={(time.perf_counter() - started) * 1000:.1f}")
+                message.setdefault('headers', [])
+                message['headers'] = [*message['headers'], (b'server-timing', timing.encode())]
+            elif message['type'] == 'http.response.body':
+                state['size'] += len(message.get('body', b''))
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            request_compute.reset(token)
+            route = scope.get('route')
+            self.metrics.observe_request(
+                getattr(route, 'path', 'unmatched'),
+                state['status'],
+                time.perf_counter() - started,
+                state['size'],
+                compute_total[0],
+            )
+
+    async def _profile(self, scope, receive, send, mode):
+        if Profiler is None:
+            return await _send_text(send, 501, b"Profiling needs pyinstrument (pip install pyinstrument)")
+
+        async def discard(message):
+            pass
+
+        token = self.inline_compute.set(True) if self.inline_compute is not None else None
+        profiler = Profiler(interval=0.001, async_mode='enabled')
+        profiler.start()
+        try:
+            await self.app(scope, receive, discard)
+        finally:
+            profiler.stop()
+            if token is not None:
+                self.inline_compute.reset(token)
+
+        if mode == 'speedscope':
+            from pyinstrument.renderers import SpeedscopeRenderer
+            body = profiler.output(SpeedscopeRenderer()).encode('utf-8')
+            return await _send_text(send, 200, body, b'application/json')
+        return await _send_text(send, 200, profiler.output_html().encode('utf-8'), b'text/html; charset=utf-8')
+
+
+async def _send_text(send, status, body, content_type=b'text/plain; charset=utf-8'):
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [(b'content-type', content_type), (b'content-length', str(len(body)).encode())],
+    })
+    await send({'type': 'http.response.body', 'body': body})
@@ -0,0 +1,43 @@
+"""
+Persian text normalization and tokenization helpers
+"""
+
+import re
+
+# Arabic letter forms that show up in shop-entered product names, mapped to
+# the Persian forms Torob uses in its own titles
+_CHAR_MAP = {
+    'ي': 'ی',  # ي -> ی
+    'ى': 'ی',  # ى -> ی
+    'ك': 'ک',  # ك -> ک
+    'ة': 'ه',  # ة -> ه
+    'أ': 'ا',  # أ -> ا
+    'إ': 'ا',  # إ -> ا
+    'ٱ': 'ا',  # ٱ -> ا
+    'ؤ': 'و',  # ؤ -> و
+    'ۀ': 'ه',  # ۀ -> ه
+}
+
+# Persian (۰-۹) and Arabic-Indic (٠-٩) digits to ASCII
+for _i in range(10):
+    _CHAR_MAP[chr(0x06F0 + _i)] = str(_i)
+    _CHAR_MAP[chr(0x0660 + _i)] = str(_i)
+
+# Characters dropped entirely: ZWNJ/ZWJ, tatweel and harakat
+_DROP_CHARS = ['‌', '‍', 'ـ', 'ٰ'] + [chr(c) for c in range(0x064B, 0x0660)]
+
+_TRANSLATION = str.maketrans({**_CHAR_MAP, **{c: None for c in _DROP_CHARS}})
+
+_TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize(text):
+    """Normalize Persian text so that spelling variants compare equal"""
+    if text is None:
+        return ''
+    return str(text).translate(_TRANSLATION).lower()
+
+
+def tokenize(text):
+    """Split normalized text into search tokens"""
+    return _TOKEN_RE.findall(normalize(text))
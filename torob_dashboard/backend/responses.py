@@ -0,0 +1,97 @@
+"""
+Fast JSON and streaming responses
+
+FastAPI's default path validates every item of a response_model list and
+runs jsonable_encoder plus the stdlib json module over the result. For the
+large, precomputed lists the dashboard fetches this dominates the request
+time. FastJSONResponse serializes with orjson (numpy scalars included) and
+ndjson_response streams a list one line per item, so the client can start
+rendering before the whole payload is built.
+
+orjson is optional; without it the standard library encoder is used.
+"""
+
+import json
+import math
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+from fastapi.responses import JSONResponse, StreamingResponse
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# Lines per chunk written to the socket when streaming NDJSON
+NDJSON_BATCH = 1000
+FORMATS = ('json', 'ndjson')
+
+
+def _default(value):
+    """Values orjson/json do not know how to serialize"""
+    if hasattr(value, 'model_dump'):
+        return value.model_dump()
+    if isinstance(value, (datetime, date, pd.Timestamp)):
+        return value.isoformat()
+    if isinstance(value, np.generic):
+        return value.item()
+    if isinstance(value, np.ndarray):
+        return value.tolist()
+    if isinstance(value, (set, frozenset)):
+        return list(value)
+    if value is pd.NA or value is pd.NaT:
+        return None
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")
+
+
+def _clean_floats(value):
+    # The stdlib encoder writes NaN, which is not valid JSON; orjson
+    # already turns it into null
+    if isinstance(value, float) and not math.isfinite(value):
+        return None
+    if isinstance(value, dict):
+        return {k: _clean_floats(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_clean_floats(v) for v in value]
+    return value
+
+
+def dumps(content):
+    """Serialize to UTF-8 JSON bytes"""
+    if orjson is not None:
+        return orjson.dumps(
+            content,
+            default=_default,
+            option=orjson.OPT_SERIALIZE_NUMPY | orjson.OPT_NON_STR_KEYS,
+        )
+    return json.dumps(
+        _clean_floats(content),
+        default=_default,
+        ensure_ascii=False,
+        allow_nan=False,
+        separators=(',', ':'),
+    ).encode('utf-8')
+
+
+class FastJSONResponse(JSONResponse):
+    """JSONResponse rendered with orjson when it is installed"""
+
+    def render(self, content):
+        return dumps(content)
+
+
+def ndjson_response(items, headers=None):
+    """Stream an iterable as newline-delimited JSON, one item per line"""
+    def generate():
+        batch = []
+        for item in items:
+            batch.append(dumps(item))
+            if len(batch) >= NDJSON_BATCH:
+                yield b'\n'.join(batch) + b'\n'
+                batch = []
+        if batch:
+            yield b'\n'.join(batch) + b'\n'
+
+    return StreamingResponse(generate(), media_type='application/x-ndjson', headers=headers)
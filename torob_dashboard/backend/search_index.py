@@ -0,0 +1,321 @@
+#!/usr/bin/env python3
+"""
+Full-text search index over product names (name1/name2)
+
+The index is a directory of immutable segments. Each build run only reads the
+rows appended to shop_products.csv since the previous run and writes them as
+new segments, so re-running it after a crawl is cheap; when the crawler has
+rewritten rows in place (shop_products.csv.generation changed) it starts
+over. Every segment is a set
+of .npy arrays that are opened with mmap_mode='r', which keeps API startup
+fast and lets the OS page the postings in on demand.
+
+Build or update the index:
+    python search_index.py /path/to/shop_products.csv /path/to/search_index
+"""
+
+import os
+import sys
+import json
+import math
+import shutil
+import argparse
+from array import array
+from collections import Counter
+
+import numpy as np
+import pandas as pd
+
+from persian_text import tokenize
+
+INDEX_COLUMNS = ['shop_id', 'shop_name', 'random_key', 'name1', 'name2', 'price']
+SEGMENT_ROWS = 500000
+MAX_TERM_BYTES = 64
+MANIFEST = 'manifest.json'
+# Written next to the CSV by torob.store each time rows are rewritten in place
+GENERATION_SUFFIX = '.generation'
+
+# BM25 parameters
+K1 = 1.2
+B = 0.75
+
+
+def _encode_term(term):
+    return term.encode('utf-8')[:MAX_TERM_BYTES]
+
+
+class _Segment:
+    """One immutable, memory-mapped slice of the index"""
+
+    ARRAYS = ['vocab', 'post_off', 'post_doc', 'post_tf', 'doc_len', 'shop_id', 'price', 'docs_off', 'docs']
+
+    def __init__(self, path, base):
+        self.path = path
+        self.base = base
+        for name in self.ARRAYS:
+            setattr(self, name, np.load(os.path.join(path, f"{name}.npy"), mmap_mode='r'))
+        self.size = len(self.doc_len)
+
+    def postings(self, term):
+        """Return (doc ids, term frequencies) for an encoded term"""
+        idx = int(np.searchsorted(self.vocab, term))
+        if idx >= len(self.vocab) or self.vocab[idx] != term:
+            return None, None
+        start, end = self.post_off[idx], self.post_off[idx + 1]
+        return self.post_doc[start:end], self.post_tf[start:end]
+
+    def document(self, doc):
+        raw = self.docs[self.docs_off[doc]:self.docs_off[doc + 1]].tobytes()
+        return json.loads(raw.decode('utf-8'))
+
+
+def _write_segment(frame, seg_dir):
+    """Tokenize a chunk of products and write it as a segment directory"""
+    names = frame['name1'].fillna('').astype(str) + ' ' + frame['name2'].fillna('').astype(str)
+
+    term_ids = {}
+    post_term, post_doc, post_tf = array('i'), array('i'), array('H')
+    doc_len = np.zeros(len(frame), dtype=np.uint16)
+
+    for doc, text in enumerate(names):
+        counts = Counter(_encode_term(t) for t in tokenize(text))
+        doc_len[doc] = min(sum(counts.values()), 65535)
+        for term, tf in counts.items():
+            post_term.append(term_ids.setdefault(term, len(term_ids)))
+            post_doc.append(doc)
+            post_tf.append(min(tf, 65535))
+
+    # Sort the vocabulary so terms can be found with a binary search, and
+    # group postings by term in the same order
+    vocab = np.array(list(term_ids), dtype=f"S{MAX_TERM_BYTES}")
+    order = np.argsort(vocab, kind='stable')
+    rank = np.empty(len(order), dtype=np.int64)
+    rank[order] = np.arange(len(order))
+
+    post_term = rank[np.frombuffer(post_term, dtype=np.int32)] if len(post_term) else np.zeros(0, dtype=np.int64)
+    post_doc = np.frombuffer(post_doc, dtype=np.int32) if len(post_doc) else np.zeros(0, dtype=np.int32)
+    post_tf = np.frombuffer(post_tf, dtype=np.uint16) if len(post_tf) else np.zeros(0, dtype=np.uint16)
+    by_term = np.lexsort((post_doc, post_term))
+    post_off = np.zeros(len(vocab) + 1, dtype=np.int64)
+    np.cumsum(np.bincount(post_term, minlength=len(vocab)), out=post_off[1:])
+
+    # Stored fields returned with search hits
+    blobs = [
+        json.dumps({
+            'random_key': None if pd.isna(key) else str(key),
+            'name1': None if pd.isna(name1) else str(name1),
+            'name2': None if pd.isna(name2) else str(name2),
+            'shop_name': None if pd.isna(shop_name) else str(shop_name),
+        }, ensure_ascii=False).encode('utf-8')
+        for key, name1, name2, shop_name in zip(frame['random_key'], frame['name1'], frame['name2'], frame['shop_name'])
+    ]
+    docs_off = np.zeros(len(blobs) + 1, dtype=np.int64)
+    np.cumsum([len(b) for b in blobs], out=docs_off[1:])
+
+    arrays = {
+        'vocab': vocab[order],
+        'post_off': post_off,
+        'post_doc': post_doc[by_term],
+        'post_tf': post_tf[by_term],
+        'doc_len': doc_len,
+        'shop_id': pd.to_numeric(frame['shop_id'], errors='coerce').fillna(-1).astype(np.int64).to_numpy(),
+        'price': pd.to_numeric(frame['price'], errors='coerce').astype(np.float64).to_numpy(),
+        'docs_off': docs_off,
+        'docs': np.frombuffer(b''.join(blobs), dtype=np.uint8),
+    }
+
+    tmp_dir = seg_dir + '.tmp'
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+    os.makedirs(tmp_dir)
+    for name, values in arrays.items():
+        np.save(os.path.join(tmp_dir, f"{name}.npy"), values)
+    os.replace(tmp_dir, seg_dir)
+
+    return int(doc_len.sum())
+
+
+def _read_manifest(index_dir):
+    path = os.path.join(index_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def _write_manifest(index_dir, manifest):
+    path = os.path.join(index_dir, MANIFEST)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + '.tmp', path)
+
+
+def _source_generation(products_csv):
+    try:
+        with open(products_csv + GENERATION_SUFFIX, encoding='utf-8') as f:
+            return int(f.read().strip() or 0)
+    except FileNotFoundError:
+        return 0
+
+
+def build_index(products_csv, index_dir, reset=False):
+    """Index the rows of products_csv that are not yet in index_dir"""
+    os.makedirs(index_dir, exist_ok=True)
+    manifest = _read_manifest(index_dir)
+    # Read before the rows, so a rewrite during the build triggers a rebuild next time
+    source_generation = _source_generation(products_csv)
+    source_size = os.path.getsize(products_csv)
+
+    # New products are appended, but upserts rewrite rows in place and a
+    # reset starts over; either bumps the generation (or shrinks the file)
+    # and the existing segments no longer line up with the rows
+    if manifest and (reset or source_size < manifest.get('source_size', 0)
+                     or source_generation != manifest.get('source_generation', 0)):
+        print("Source was rewritten, rebuilding index from scratch")
+        for segment in manifest['segments']:
+            shutil.rmtree(os.path.join(index_dir, segment['name']), ignore_errors=True)
+        manifest = None
+
+    if manifest is None:
+        manifest = {'rows_indexed': 0, 'total_length': 0, 'source_size': 0, 'segments': []}
+    manifest['source_generation'] = source_generation
+
+    start = manifest['rows_indexed']
+    reader = pd.read_csv(
+        products_csv,
+        usecols=lambda c: c in INDEX_COLUMNS,
+        skiprows=range(1, start + 1),
+        chunksize=SEGMENT_ROWS,
+        dtype=str,
+    )
+
+    new_rows = 0
+    for chunk in reader:
+        if chunk.empty:
+            continue
+        for col in INDEX_COLUMNS:
+            if col not in chunk.columns:
+                chunk[col] = None
+
+        name = f"seg_{len(manifest['segments']):06d}"
+        total_length = _write_segment(chunk, os.path.join(index_dir, name))
+
+        manifest['segments'].append({'name': name, 'rows': len(chunk)})
+        manifest['rows_indexed'] += len(chunk)
+        manifest['total_length'] += total_length
+        new_rows += len(chunk)
+        _write_manifest(index_dir, manifest)
+        print(f"Indexed {manifest['rows_indexed']:,} products ({name})")
+
+    manifest['source_size'] = source_size
+    _write_manifest(index_dir, manifest)
+    print(f"Index up to date: {new_rows:,} new products, {manifest['rows_indexed']:,} total")
+    return manifest
+
+
+class SearchIndex:
+    """Read-only BM25 search over the segments listed in the manifest"""
+
+    def __init__(self, index_dir, manifest):
+        self.index_dir = index_dir
+        self.segments = []
+        base = 0
+        for segment in manifest['segments']:
+            self.segments.append(_Segment(os.path.join(index_dir, segment['name']), base))
+            base += segment['rows']
+        self.total_docs = base
+        self.avg_doc_len = manifest['total_length'] / base if base else 0.0
+
+    @classmethod
+    def open(cls, index_dir):
+        """Open an index directory, or return None if it was never built"""
+        manifest = _read_manifest(index_dir)
+        if manifest is None:
+            return None
+        return cls(index_dir, manifest)
+
+    def search(self, query, shop_ids=None, min_price=None, max_price=None, limit=20):
+        """Rank products matching any query term by BM25"""
+        terms = list(dict.fromkeys(_encode_term(t) for t in tokenize(query)))
+        if not terms or not self.total_docs:
+            return {'total': 0, 'results': []}
+
+        postings = [[seg.postings(term) for term in terms] for seg in self.segments]
+        doc_freq = [
+            sum(len(p[i][0]) for p in postings if p[i][0] is not None)
+            for i in range(len(terms))
+        ]
+        idf = [math.log(1 + (self.total_docs - df + 0.5) / (df + 0.5)) for df in doc_freq]
+        if shop_ids is not None:
+            shop_ids = np.asarray(list(shop_ids), dtype=np.int64)
+
+        hit_scores, hit_seg, hit_doc = [], [], []
+        for seg_idx, (seg, seg_postings) in enumerate(zip(self.segments, postings)):
+            docs, scores = [], []
+            for (term_docs, term_tf), term_idf in zip(seg_postings, idf):
+                if term_docs is None:
+                    continue
+                tf = term_tf.astype(np.float64)
+                dl = seg.doc_len[term_docs].astype(np.float64)
+                norm = K1 * (1 - B + B * dl / self.avg_doc_len)
+                docs.append(term_docs)
+                scores.append(term_idf * tf * (K1 + 1) / (tf + norm))
+            if not docs:
+                continue
+
+            matched, inverse = np.unique(np.concatenate(docs), return_inverse=True)
+            matched_scores = np.bincount(inverse, weights=np.concatenate(scores))
+
+            keep = np.ones(len(matched), dtype=bool)
+            if shop_ids is not None:
+                keep &= np.isin(seg.shop_id[matched], shop_ids)
+            if min_price is not None:
+                keep &= seg.price[matched] >= min_price
+            if max_price is not None:
+                keep &= seg.price[matched] <= max_price
+
+            hit_doc.append(matched[keep])
+            hit_scores.append(matched_scores[keep])
+            hit_seg.append(np.full(int(keep.sum()), seg_idx, dtype=np.int32))
+
+        if not hit_doc:
+            return {'total': 0, 'results': []}
+
+        hit_doc = np.concatenate(hit_doc)
+        hit_scores = np.concatenate(hit_scores)
+        hit_seg = np.concatenate(hit_seg)
+        total = len(hit_doc)
+
+        top = np.argsort(-hit_scores, kind='stable')[:limit]
+        results = []
+        for i in top:
+            seg = self.segments[hit_seg[i]]
+            doc = int(hit_doc[i])
+            price = float(seg.price[doc])
+            results.append({
+                'row': seg.base + doc,
+                'shop_id': int(seg.shop_id[doc]),
+                'price': None if math.isnan(price) else price,
+                'score': round(float(hit_scores[i]), 4),
+                **seg.document(doc),
+            })
+
+        return {'total': total, 'results': results}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build or update the product name search index")
+    parser.add_argument('products_csv', help="Path to shop_products.csv")
+    parser.add_argument('index_dir', help="Directory to write the index to")
+    parser.add_argument('--reset', action='store_true', help="Discard the existing index and rebuild")
+    args = parser.parse_args()
+
+    if not os.path.exists(args.products_csv):
+        print(f"❌ {args.products_csv} not found")
+        return 1
+
+    build_index(args.products_csv, args.index_dir, reset=args.reset)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+#!/usr/bin/env python3
+"""
+Read-only Arrow snapshot of the CSV datasets, shared between workers
+
+With `uvicorn --workers N` every worker would otherwise parse the CSVs and
+hold its own copy of every frame. Instead the CSVs are converted once into
+uncompressed Arrow IPC files; each worker memory-maps them and wraps the
+Arrow buffers in pandas ArrowDtype columns without copying, so all workers
+read the same pages from the OS page cache.
+
+Export (or refresh) the shared snapshot:
+    python shared_data.py /path/to/data /path/to/data/shared_snapshot
+
+Files are replaced atomically, so workers that watch the directory pick up
+a refreshed export while requests still reading the old mapping finish.
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+
+import pandas as pd
+
+try:
+    import pyarrow as pa
+except ImportError:
+    pa = None
+
+SOURCES = {
+    'shops': 'torob_shops.csv',
+    'shop_details': 'shopinfo_detail.csv',
+    'products': 'shop_products.csv',
+}
+MANIFEST = 'manifest.json'
+
+
+def arrow_path(shared_dir, name):
+    return os.path.join(shared_dir, f"{name}.arrow")
+
+
+def _require_pyarrow():
+    if pa is None:
+        raise RuntimeError("pyarrow is required for shared snapshots (pip install pyarrow)")
+
+
+def _source_stamp(path):
+    stat = os.stat(path)
+    return [stat.st_mtime_ns, stat.st_size]
+
+
+def _to_arrow(frame):
+    # CSV columns with mixed values come back as object; Arrow needs one
+    # type per column, so keep strings as strings and everything else as text
+    for col in frame.columns:
+        if frame[col].dtype == object:
+            frame[col] = frame[col].where(frame[col].isna(), frame[col].astype(str))
+    return pa.Table.from_pandas(frame, preserve_index=False)
+
+
+def export_snapshot(data_dir, shared_dir, force=False):
+    """Convert every source CSV that changed since the last export"""
+    _require_pyarrow()
+    os.makedirs(shared_dir, exist_ok=True)
+
+    manifest_path = os.path.join(shared_dir, MANIFEST)
+    manifest = {}
+    if os.path.exists(manifest_path):
+        with open(manifest_path, encoding='utf-8') as f:
+            manifest = json.load(f)
+
+    for name, filename in SOURCES.items():
+        source = os.path.join(data_dir, filename)
+        target = arrow_path(shared_dir, name)
+        if not os.path.exists(source):
+            print(f"⚠️  {filename} not found, skipping")
+            continue
+
+        stamp = _source_stamp(source)
+        if not force and manifest.get(name) == stamp and os.path.exists(target):
+            print(f"✅ {name}: up to date")
+            continue
+
+        started = time.time()
+        table = _to_arrow(pd.read_csv(source, low_memory=False))
+
+        # Write next to the target and rename so readers never see a partial file
+        with pa.OSFile(target + '.tmp', 'wb') as sink:
+            with pa.ipc.new_file(sink, table.schema) as writer:
+                writer.write_table(table)
+        os.replace(target + '.tmp', target)
+
+        manifest[name] = stamp
+        with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(manifest_path + '.tmp', manifest_path)
+
+        size_mb = os.path.getsize(target) / (1024 * 1024)
+        print(f"✅ {name}: {table.num_rows:,} rows, {size_mb:.1f} MB in {time.time() - started:.1f}s")
+
+    return manifest
+
+
+def load_shared_frame(path):
+    """Memory-map an exported Arrow file as an ArrowDtype-backed DataFrame"""
+    _require_pyarrow()
+    source = pa.memory_map(path, 'r')
+    table = pa.ipc.open_file(source).read_all()
+    # types_mapper keeps the columns as views over the mapped buffers
+    return table.to_pandas(types_mapper=pd.ArrowDtype)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export the CSV datasets as a shared Arrow snapshot")
+    parser.add_argument('data_dir', help="Directory containing the crawl CSVs")
+    parser.add_argument('shared_dir', help="Directory to write the Arrow files to")
+    parser.add_argument('--force', action='store_true', help="Re-export even if the CSVs did not change")
+    args = parser.parse_args()
+
+    export_snapshot(args.data_dir, args.shared_dir, force=args.force)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+Join index between the shops table and the shop details table
+
+Both tables are keyed by the Torob shop id, but only shop details know the
+province. ShopJoin resolves that join once per snapshot into integer arrays
+over the rows of shops_df: the position of each shop's details row, and
+codes for its city, province and shop type.
+
+A shop's province comes from its own details row. Shops without one take
+the province of their city only when every detailed shop in that city
+agrees on it; city names that exist in several provinces (بهار, ...) stay
+unattributed instead of being guessed.
+
+Filters resolve a name against a vocabulary of a few hundred distinct
+values and then take precomputed row lists, so no request scans the
+string columns.
+"""
+
+import numpy as np
+import pandas as pd
+
+from persian_text import normalize
+
+
+def _key(value):
+    return normalize(value).strip()
+
+
+class Vocabulary:
+    """Distinct values of a column as integer codes, compared after Persian normalization
+
+    codes holds one code per row (-1 where the value is missing), names the
+    most common spelling of every code. Spelling variants such as كرج and
+    کرج share a code.
+    """
+
+    def __init__(self, values):
+        raw_codes, uniques = pd.factorize(pd.Series(values, dtype=object), use_na_sentinel=True)
+        uniques = [str(value) for value in uniques]
+        keys, remap = np.unique(np.array([_key(value) for value in uniques], dtype=object),
+                                return_inverse=True)
+        remap = remap.astype(np.int32)
+
+        codes = np.full(len(raw_codes), -1, dtype=np.int32)
+        present = raw_codes >= 0
+        codes[present] = remap[raw_codes[present]]
+
+        # Show each code under the spelling most rows use
+        spelling_counts = np.bincount(raw_codes[present], minlength=len(uniques))
+        best = {}
+        for raw, code in enumerate(remap):
+            if code not in best or spelling_counts[raw] > spelling_counts[best[code]]:
+                best[code] = raw
+        self.names = [uniques[best[code]] for code in range(len(keys))]
+        self.keys = [str(key) for key in keys]
+        self.codes = codes
+        self._index = {key: code for code, key in enumerate(self.keys)}
+
+        # Rows of every code, ascending: rows of code c are order[offsets[c]:offsets[c + 1]]
+        self._order = np.argsort(codes, kind='stable')
+        self._offsets = np.searchsorted(codes[self._order], np.arange(len(self.keys) + 1))
+
+    def __len__(self):
+        return len(self.keys)
+
+    def lookup(self, name):
+        """Code of the value equal to name after normalization, or -1"""
+        return self._index.get(_key(name), -1)
+
+    def matching(self, text):
+        """Codes of every value containing text (case-insensitive)"""
+        needle = _key(text)
+        return [code for code, key in enumerate(self.keys) if needle in key]
+
+    def rows(self, codes):
+        """Ascending row positions whose value has one of the codes"""
+        parts = [self._order[self._offsets[code]:self._offsets[code + 1]] for code in codes if code >= 0]
+        if not parts:
+            return np.array([], dtype=np.int64)
+        return parts[0] if len(parts) == 1 else np.sort(np.concatenate(parts))
+
+    def name_of(self, codes):
+        """Names for an array of codes, None where the code is -1"""
+        names = np.array(self.names + [None], dtype=object)
+        return names[np.where(codes >= 0, codes, len(self.names))]
+
+
+class ShopJoin:
+    """shops_df rows joined to shop details, with city/province/type codes"""
+
+    def __init__(self, shops_df, shop_details_df=None):
+        self.shop_ids = pd.to_numeric(shops_df['id'], errors='coerce').fillna(-1).to_numpy(dtype=np.int64)
+        self.city = Vocabulary(shops_df['city'])
+        self.shop_type = Vocabulary(shops_df['shop_type'])
+
+        self.detail_row = np.full(len(shops_df), -1, dtype=np.int64)
+        provinces = np.full(len(shops_df), None, dtype=object)
+        if shop_details_df is not None and 'province' in shop_details_df.columns:
+            detail_ids = pd.to_numeric(shop_details_df['id'], errors='coerce')
+            # A shop crawled twice keeps its first details row
+            first = (~detail_ids.duplicated() & detail_ids.notna()).to_numpy()
+            positions = np.flatnonzero(first)
+            found = pd.Index(detail_ids.to_numpy()[first]).get_indexer(self.shop_ids)
+            matched = found >= 0
+            self.detail_row[matched] = positions[found[matched]]
+
+            detail_provinces = shop_details_df['province'].to_numpy(dtype=object)
+            provinces[matched] = detail_provinces[self.detail_row[matched]]
+
+            # Shops without details inherit an unambiguous city's province
+            by_city = self._unambiguous_provinces(shop_details_df)
+            # Code -1 (no city) picks the trailing ''
+            city_keys = np.array(self.city.keys + [''], dtype=object)[self.city.codes]
+            missing = pd.isna(provinces)
+            provinces[missing] = [by_city.get(key) for key in city_keys[missing]]
+        self.province = Vocabulary(provinces)
+
+    @staticmethod
+    def _unambiguous_provinces(shop_details_df):
+        """Normalized city -> province for cities all detailed shops place in one province"""
+        pairs = shop_details_df[['city', 'province']].dropna().drop_duplicates()
+        pairs = pd.DataFrame({
+            'city': pairs['city'].map(_key),
+            'province': pairs['province'],
+            'province_key': pairs['province'].map(_key),
+        })
+        distinct = pairs.drop_duplicates(['city', 'province_key'])
+        counts = distinct['city'].value_counts()
+        single = distinct[distinct['city'].isin(counts.index[counts == 1])]
+        return dict(zip(single['city'], single['province']))
+
+    def province_names(self):
+        """Attributed province of every shops row, None where unknown"""
+        return self.province.name_of(self.province.codes)
+
+    def filter_rows(self, city=None, province=None, shop_type=None, exact=False):
+        """Ascending shops_df positions passing every given filter
+
+        city and province match as substrings unless exact; shop_type
+        always matches exactly. Returns None when nothing was filtered.
+        """
+        rows = None
+        for vocabulary, value, substring in ((self.city, city, not exact),
+                                             (self.province, province, not exact),
+                                             (self.shop_type, shop_type, False)):
+            if not value:
+                continue
+            codes = vocabulary.matching(value) if substring else [vocabulary.lookup(value)]
+            matched = vocabulary.rows(codes)
+            rows = matched if rows is None else np.intersect1d(rows, matched, assume_unique=True)
+        return rows
+
+    def ids(self, rows):
+        """Shop ids of shops_df positions"""
+        return self.shop_ids[rows]
@@ -0,0 +1,306 @@
+"""
+Versioned data snapshots with background reload
+
+The API never reads the data files directly. It serves every request from a
+DataSnapshot: an immutable bundle of the loaded frames, the search index and
+the aggregates derived from them. SnapshotManager builds a new snapshot in a
+background thread whenever the crawl outputs change and then swaps a single
+reference, so requests that already hold the old snapshot finish on it and
+the old frames are released once the last of them is done.
+
+On a cold start the datasets are loaded in stages, smallest first, and a
+snapshot is published after each one. The shops table and its aggregates
+are available within about a second while the product table is still being
+parsed; SnapshotManager.status reports how far each dataset has got.
+
+When a shared_dir is given (multi-worker production mode) the frames are
+memory-mapped from the Arrow files written by shared_data.py instead of
+being parsed from CSV, so every worker shares one physical copy.
+"""
+
+import os
+import gc
+import time
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from search_index import SearchIndex, MANIFEST
+from shared_data import arrow_path, load_shared_frame
+from geo import MapLayers, get_gazetteer
+from shop_join import ShopJoin
+
+# Load order: small tables first so the dashboard can render early
+DATASETS = ['shops', 'shop_details', 'search_index', 'products']
+CSV_CHUNK_ROWS = 200000
+
+
+class DataSnapshot:
+    """Everything one request needs, loaded together and never mutated"""
+
+    def __init__(self, version, shops_df=None, shop_details_df=None, products_df=None,
+                 search_index=None, fingerprint=None, aggregates=None):
+        self.version = version
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        self.fingerprint = fingerprint or {}
+        self.shops_df = shops_df
+        self.shop_details_df = shop_details_df
+        self.products_df = products_df
+        self.search_index = search_index
+        # Passed in when the shops and details are the previous snapshot's
+        self.aggregates = self._build_aggregates() if aggregates is None else aggregates
+        self._memo = {}
+        self._memo_lock = threading.Lock()
+
+    def _build_aggregates(self):
+        """Precompute the lookups several endpoints share"""
+        aggregates = {}
+
+        if self.shops_df is not None:
+            join = ShopJoin(self.shops_df, self.shop_details_df)
+            aggregates['shop_join'] = join
+            # One pass over the shops shared by the overview, by-city,
+            # dashboard and map panels
+            table = count_city_shop_types(self.shops_df, join)
+            aggregates['city_shop_types'] = table
+            shop_counts = table.sum(axis=1)
+            aggregates['city_counts'] = shop_counts.groupby(level='city', sort=False).sum() \
+                .sort_values(ascending=False, kind='stable')
+            aggregates['map_layers'] = MapLayers(shop_counts, get_gazetteer())
+
+        return aggregates
+
+    def memo(self, key, build):
+        """build() once per snapshot; a snapshot never changes, so neither does the result"""
+        with self._memo_lock:
+            if key in self._memo:
+                return self._memo[key]
+        value = build()
+        with self._memo_lock:
+            return self._memo.setdefault(key, value)
+
+
+def count_city_shop_types(shops_df, join):
+    """Shops per (city, province) and shop type, largest first
+
+    Cities are grouped by their normalized name and provinces come from
+    the join index, so a city name used in two provinces gets two rows;
+    the province is None where it is unknown. Shops without a type are
+    counted in a '' column so row sums stay the shop count.
+    """
+    frame = pd.DataFrame({
+        'city': join.city.codes,
+        'province': join.province.codes,
+        'shop_type': shops_df['shop_type'].fillna('').to_numpy(dtype=object),
+    })
+    table = frame[frame['city'] >= 0].groupby(['city', 'province', 'shop_type']).size().unstack(fill_value=0)
+    table.columns.name = None
+    table.index = pd.MultiIndex.from_arrays([
+        join.city.name_of(table.index.get_level_values('city').to_numpy()),
+        join.province.name_of(table.index.get_level_values('province').to_numpy()),
+    ], names=['city', 'province'])
+    if table.empty:
+        return table
+    return table.loc[table.sum(axis=1).sort_values(ascending=False, kind='stable').index]
+
+
+class SnapshotManager:
+    """Owns the current snapshot and rebuilds it when the sources change"""
+
+    def __init__(self, base_path, search_index_dir, poll_interval=30, shared_dir=None):
+        self.base_path = base_path
+        self.search_index_dir = search_index_dir
+        self.shared_dir = shared_dir
+        self.poll_interval = poll_interval
+        self.current = DataSnapshot(version=0)
+        self.last_error = None
+        self.status = {
+            name: {'state': 'pending', 'progress': 0.0, 'rows': 0, 'error': None}
+            for name in DATASETS
+        }
+
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._watcher = None
+
+    @property
+    def sources(self):
+        if self.shared_dir:
+            return {
+                'shops': arrow_path(self.shared_dir, 'shops'),
+                'shop_details': arrow_path(self.shared_dir, 'shop_details'),
+                'products': arrow_path(self.shared_dir, 'products'),
+                'search_index': os.path.join(self.search_index_dir, MANIFEST),
+            }
+        return {
+            'shops': os.path.join(self.base_path, 'torob_shops.csv'),
+            'shop_details': os.path.join(self.base_path, 'shopinfo_detail.csv'),
+            'products': os.path.join(self.base_path, 'shop_products.csv'),
+            'search_index': os.path.join(self.search_index_dir, MANIFEST),
+        }
+
+    def fingerprint(self):
+        """(mtime, size) of every source; a change means a reload is due"""
+        result = {}
+        for name, path in self.sources.items():
+            try:
+                stat = os.stat(path)
+                result[name] = (stat.st_mtime_ns, stat.st_size)
+            except OSError:
+                result[name] = None
+        return result
+
+    def _set_status(self, name, **fields):
+        # Replace rather than mutate so readers never see a half update
+        self.status = {**self.status, name: {**self.status[name], **fields}}
+
+    def _read_csv(self, name, path):
+        """Parse a CSV in chunks, reporting progress by bytes consumed"""
+        size = os.path.getsize(path) or 1
+        chunks = []
+        with open(path, 'rb') as f:
+            for chunk in pd.read_csv(f, chunksize=CSV_CHUNK_ROWS, low_memory=False):
+                chunks.append(chunk)
+                self._set_status(
+                    name,
+                    rows=self.status[name]['rows'] + len(chunk),
+                    progress=round(min(f.tell() / size, 0.99), 3),
+                )
+        if not chunks:
+            return pd.read_csv(path)
+        return pd.concat(chunks, ignore_index=True)
+
+    def _load_dataset(self, name):
+        """Load one dataset, tracking its state; returns None if unavailable"""
+        self._set_status(name, state='loading', progress=0.0, rows=0, error=None)
+        started = time.time()
+        try:
+            if name == 'search_index':
+                value = SearchIndex.open(self.search_index_dir)
+                rows = value.total_docs if value is not None else 0
+            elif self.shared_dir:
+                value = load_shared_frame(self.sources[name])
+                rows = len(value)
+            else:
+                value = self._read_csv(name, self.sources[name])
+                rows = len(value)
+        except Exception as e:
+            print(f"Could not load {name}: {e}")
+            self._set_status(name, state='failed', error=str(e))
+            return None
+
+        if value is None:
+            print(f"No {name} at {self.sources[name]}")
+            self._set_status(name, state='missing')
+            return None
+
+        print(f"Loaded {rows} {name} in {time.time() - started:.1f}s")
+        # Still 'loading' until a published snapshot holds it (see reload())
+        self._set_status(name, progress=1.0, rows=rows)
+        return value
+
+    def _mark_loaded(self, loaded):
+        for name, value in loaded.items():
+            if value is not None and self.status[name]['state'] == 'loading':
+                self._set_status(name, state='loaded')
+
+    def reload(self, staged=False):
+        """Build a fresh snapshot and publish it; returns True on success
+
+        With staged=True a partial snapshot is published as soon as each
+        dataset is ready (used for the cold start). Otherwise the current
+        snapshot keeps serving until every dataset has been reloaded.
+        """
+        with self._build_lock:
+            fingerprint = self.fingerprint()
+            loaded = {}
+            for name in DATASETS:
+                loaded[name] = self._load_dataset(name)
+                if name == 'shops' and loaded[name] is None:
+                    self.last_error = self.status['shops']['error'] or "Shop data not found"
+                    print(f"Error loading data: {self.last_error}")
+                    for other in DATASETS:
+                        if self.status[other]['state'] == 'pending':
+                            self._set_status(other, state='skipped')
+                    return False
+                if staged:
+                    self._publish(loaded, fingerprint)
+                    self._mark_loaded(loaded)
+
+            if not staged:
+                self._publish(loaded, fingerprint)
+                self._mark_loaded(loaded)
+            self.last_error = None
+        return True
+
+    def _publish(self, loaded, fingerprint):
+        current = self.current
+        # Staged loads publish once per dataset; the aggregates only depend on the shop tables
+        shops_changed = (loaded.get('shops') is not current.shops_df
+                         or loaded.get('shop_details') is not current.shop_details_df)
+        snapshot = DataSnapshot(
+            version=self.current.version + 1,
+            shops_df=loaded.get('shops'),
+            shop_details_df=loaded.get('shop_details'),
+            products_df=loaded.get('products'),
+            search_index=loaded.get('search_index'),
+            fingerprint=fingerprint,
+            aggregates=None if shops_changed else current.aggregates,
+        )
+
+        # A single reference assignment is atomic: requests that already
+        # grabbed the old snapshot keep using it until they return
+        self.current = snapshot
+        del current
+        if shops_changed:
+            gc.collect()
+        print(f"Published data snapshot v{snapshot.version}")
+
+    def is_loading(self, name):
+        """True while a dataset the current snapshot lacks is on its way"""
+        return self.status[name]['state'] in ('pending', 'loading')
+
+    def start(self, watch=True):
+        """Load in a background thread, then keep watching for changes"""
+        def run():
+            started = time.time()
+            if self.reload(staged=True):
+                print(f"All data loaded in {time.time() - started:.1f}s")
+            if watch:
+                self.start_watching()
+
+        threading.Thread(target=run, name="snapshot-loader", daemon=True).start()
+
+    def start_watching(self):
+        """Poll the sources in a daemon thread and reload after they settle"""
+        if self._watcher is not None:
+            return
+        self._stop.clear()
+        self._watcher = threading.Thread(target=self._watch, name="snapshot-watcher", daemon=True)
+        self._watcher.start()
+
+    def stop_watching(self):
+        self._stop.set()
+        if self._watcher is not None:
+            self._watcher.join(timeout=5)
+            self._watcher = None
+
+    def _watch(self):
+        pending = None
+        while not self._stop.wait(self.poll_interval):
+            fingerprint = self.fingerprint()
+            if fingerprint == self.current.fingerprint:
+                pending = None
+                continue
+
+            # The crawler rewrites its CSVs in place; only reload once a
+            # change has stayed the same for a full poll interval
+            if fingerprint != pending:
+                pending = fingerprint
+                continue
+
+            started = time.time()
+            if self.reload():
+                print(f"Reloaded data in {time.time() - started:.1f}s")
+            pending = None
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Synthetic crawl outputs for benchmarking the dashboard backend
+
+Writes torob_shops.csv, shopinfo_detail.csv and shop_products.csv with the
+same columns as the crawlers, at any scale from a few thousand to tens of
+millions of products. The data is shaped like the real crawl: cities come
+from the backend gazetteer with a heavy skew towards Tehran (and some
+Arabic-letter spellings), shop sizes follow a power law, every product of a
+shop carries that shop's category facets, and prices are log-normal.
+
+Output is deterministic for a given --seed, so benchmark runs on different
+commits see identical inputs.
+
+    python generate_data.py /tmp/torob_bench --products 1M
+"""
+
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+import pandas as pd
+
+GAZETTEER = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend', 'data', 'iran_gazetteer.csv')
+CHUNK_ROWS = 500000
+
+SHOP_TYPES = np.array(['online', 'offline', 'online-offline'])
+SHOP_TYPE_WEIGHTS = [0.6, 0.15, 0.25]
+
+# (top-level category, [(leaf title, slug), ...])
+CATEGORY_TREE = [
+    ('کالای دیجیتال', [('گوشی موبایل', 'mobile'), ('لپ تاپ', 'laptop'), ('هدفون', 'headphone'), ('تبلت', 'tablet'), ('ساعت هوشمند', 'smart-watch')]),
+    ('لوازم خانگی', [('یخچال', 'refrigerator'), ('ماشین لباسشویی', 'washing-machine'), ('جاروبرقی', 'vacuum'), ('اجاق گاز', 'stove')]),
+    ('آرایشی بهداشتی', [('شامپو', 'shampoo'), ('کرم ضد آفتاب', 'sunscreen'), ('عطر', 'perfume'), ('مسواک برقی', 'toothbrush')]),
+    ('مد و پوشاک', [('کفش ورزشی', 'sneakers'), ('تی شرت', 't-shirt'), ('کیف', 'bag'), ('ساعت مچی', 'watch')]),
+    ('کتاب و لوازم التحریر', [('کتاب', 'book'), ('لوازم التحریر', 'stationery'), ('کتاب کمک درسی', 'textbook')]),
+    ('خودرو و موتور', [('لاستیک خودرو', 'tire'), ('روغن موتور', 'engine-oil'), ('لوازم یدکی', 'spare-parts')]),
+    ('ابزار', [('دریل', 'drill'), ('پیچ گوشتی', 'screwdriver'), ('فرز', 'grinder')]),
+    ('ورزش و سفر', [('دوچرخه', 'bicycle'), ('چادر مسافرتی', 'tent'), ('تردمیل', 'treadmill')]),
+    ('مادر و کودک', [('پوشک', 'diaper'), ('شیر خشک', 'formula'), ('اسباب بازی', 'toy')]),
+    ('خوراکی', [('قهوه', 'coffee'), ('چای', 'tea'), ('زعفران', 'saffron')]),
+]
+
+BRANDS = ['سامسونگ', 'شیائومی', 'اپل', 'ال جی', 'ایسوس', 'لنوو', 'سونی', 'بوش', 'فیلیپس', 'نایک',
+          'آدیداس', 'اسنوا', 'پارس خزر', 'گلرنگ', 'سینره', 'نستله', 'هواوی', 'انکر', 'توسن', 'رونیکس']
+QUALIFIERS = ['مدل', 'سری', 'نسخه', 'طرح', 'ظرفیت', 'سایز', 'رنگ مشکی', 'رنگ سفید', 'اصل', 'جدید']
+STOCK_STATUS = np.array(['in_stock', 'out_of_stock'])
+# Some shops write cities with Arabic letters; the backend has to cope
+ARABIC_VARIANTS = str.maketrans({'ی': 'ي', 'ک': 'ك'})
+
+
+def parse_count(value):
+    """'10k', '2.5M' or '10000000' -> int"""
+    value = value.strip().lower()
+    scale = {'k': 1000, 'm': 1000000}.get(value[-1])
+    return int(float(value[:-1]) * scale) if scale else int(value)
+
+
+def build_categories():
+    """Leaf categories with their ids, slugs and top-level parent"""
+    leaves = []
+    cat_id = 100
+    for parent, children in CATEGORY_TREE:
+        for title, slug in children:
+            leaves.append({'id': cat_id, 'title': title, 'slug': slug, 'parent': parent})
+            cat_id += 1
+    return leaves
+
+
+def generate_shops(rng, n_shops):
+    gazetteer = pd.read_csv(GAZETTEER)
+    cities = gazetteer[gazetteer['kind'] == 'city'].reset_index(drop=True)
+
+    # Zipf-like popularity over gazetteer order (Tehran province first, and
+    # each province's capital before its smaller cities)
+    weights = 1.0 / np.arange(1, len(cities) + 1) ** 1.1
+    weights[0] *= 8
+    weights /= weights.sum()
+    city_idx = rng.choice(len(cities), size=n_shops, p=weights)
+
+    city_names = cities['name'].to_numpy()[city_idx].astype(object)
+    arabic = rng.random(n_shops) < 0.05
+    city_names[arabic] = [name.translate(ARABIC_VARIANTS) for name in city_names[arabic]]
+
+    ids = np.arange(1, n_shops + 1)
+    shop_types = rng.choice(SHOP_TYPES, size=n_shops, p=SHOP_TYPE_WEIGHTS)
+    shops = pd.DataFrame({
+        'id': ids,
+        'name': [f"فروشگاه {i}" for i in ids],
+        'domain': [f"shop{i}.ir" for i in ids],
+        'city': city_names,
+        'shop_type': shop_types,
+        'score_percentile': rng.integers(0, 101, n_shops),
+        'is_marketplace': rng.random(n_shops) < 0.02,
+        'shop_logo': [f"https://storage.torob.com/shop-logo/{i}.png" for i in ids],
+    })
+
+    # Not every shop has a details page
+    has_details = rng.random(n_shops) < 0.85
+    detail_idx = np.flatnonzero(has_details)
+    details = pd.DataFrame({
+        'id': ids[detail_idx],
+        'name': shops['name'].to_numpy()[detail_idx],
+        'domain': shops['domain'].to_numpy()[detail_idx],
+        'province': cities['province'].to_numpy()[city_idx[detail_idx]],
+        'city': city_names[detail_idx],
+        'address': [f"خیابان {i % 300}، پلاک {i % 97}" for i in detail_idx],
+        'phone': [f"021{i:08d}" for i in detail_idx],
+        'shop_type': shop_types[detail_idx],
+        'shop_score': rng.integers(0, 6, len(detail_idx)),
+        'upvotes': rng.poisson(40, len(detail_idx)),
+        'downvotes': rng.poisson(6, len(detail_idx)),
+        'score_percentile': shops['score_percentile'].to_numpy()[detail_idx],
+        'enamad_level': rng.integers(0, 3, len(detail_idx)),
+        'date_added': pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, len(detail_idx)), unit='D'),
+    })
+    return shops, details
+
+
+def shop_facets(rng, n_shops, leaves):
+    """Category facet columns for every shop; products inherit them"""
+    facets = []
+    for _ in range(n_shops):
+        picked = sorted(rng.choice(len(leaves), size=rng.integers(1, 5), replace=False))
+        chosen = [leaves[i] for i in picked]
+        facets.append({
+            'categories': ' | '.join(f"{c['title']} (ID: {c['id']}, Slug: {c['slug']})" for c in chosen),
+            'parent_categories': ' | '.join(dict.fromkeys(c['parent'] for c in chosen)),
+            'primary_category': chosen[0]['title'],
+            'primary_category_id': chosen[0]['id'],
+            'primary_category_slug': chosen[0]['slug'],
+            'leaf_titles': [c['title'] for c in chosen],
+        })
+    return facets
+
+
+def product_chunk(rng, start, size, shop_ids, shop_weights, shop_names, facets, facet_frame):
+    shop_pos = rng.choice(len(shop_ids), size=size, p=shop_weights)
+    facet_frame = facet_frame.iloc[shop_pos].reset_index(drop=True)
+
+    brand = np.array(BRANDS, dtype=object)[rng.integers(0, len(BRANDS), size)]
+    qualifier = np.array(QUALIFIERS, dtype=object)[rng.integers(0, len(QUALIFIERS), size)]
+    # Product names start with one of the shop's leaf categories
+    leaf = np.array([facets[p]['leaf_titles'][k % len(facets[p]['leaf_titles'])]
+                     for p, k in zip(shop_pos, rng.integers(0, 4, size))], dtype=object)
+    model = rng.integers(10, 9999, size)
+    name1 = pd.Series(leaf) + ' ' + pd.Series(brand) + ' ' + pd.Series(qualifier) + ' ' + pd.Series(model).astype(str)
+    name2 = pd.Series(['Model ' + str(m) if m % 3 else '' for m in model])
+
+    price = np.round(rng.lognormal(mean=14.5, sigma=1.3, size=size), -3)
+    out_of_stock = rng.random(size) < 0.08
+    price[out_of_stock] = 0
+
+    keys = start + np.arange(size)
+    frame = pd.DataFrame({
+        'shop_id': shop_ids[shop_pos],
+        'shop_name': shop_names[shop_pos],
+        'page': 0,
+        'random_key': [f"{k:010x}" for k in keys],
+        'name1': name1,
+        'name2': name2,
+        'price': price.astype(np.int64),
+        'price_prefix': '',
+        'price_text': [f"{int(p):,} تومان" if p else 'ناموجود' for p in price],
+        'stock_status': STOCK_STATUS[out_of_stock.astype(int)],
+        'estimated_sell': rng.poisson(3, size),
+        'image_count': rng.integers(0, 8, size),
+        'is_adv': rng.random(size) < 0.01,
+        'card_type': 'product',
+        'more_info_url': [f"https://api.torob.com/v4/base-product/details/?prk={k:010x}" for k in keys],
+        **{col: facet_frame[col] for col in facet_frame.columns},
+        'category_is_leaf': False,
+        'total_products_count': 0,
+    })
+    # The crawler writes its columns in sorted order
+    return frame[sorted(frame.columns)]
+
+
+def generate(out_dir, n_products, n_shops=None, seed=42):
+    os.makedirs(out_dir, exist_ok=True)
+    rng = np.random.default_rng(seed)
+    n_shops = n_shops or int(min(max(n_products // 50, 200), 200000))
+
+    started = time.time()
+    shops, details = generate_shops(rng, n_shops)
+    shops.to_csv(os.path.join(out_dir, 'torob_shops.csv'), index=False)
+    details.to_csv(os.path.join(out_dir, 'shopinfo_detail.csv'), index=False)
+    print(f"✅ {n_shops:,} shops, {len(details):,} shop details")
+
+    # Power-law shop sizes: a few shops list most of the products
+    shop_weights = rng.pareto(1.2, n_shops) + 0.05
+    shop_weights /= shop_weights.sum()
+    facets = shop_facets(rng, n_shops, build_categories())
+    facet_frame = pd.DataFrame(facets).drop(columns='leaf_titles')
+
+    products_path = os.path.join(out_dir, 'shop_products.csv')
+    written = 0
+    while written < n_products:
+        size = min(CHUNK_ROWS, n_products - written)
+        chunk = product_chunk(rng, written, size, shops['id'].to_numpy(), shop_weights,
+                              shops['name'].to_numpy(), facets, facet_frame)
+        chunk.to_csv(products_path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += size
+        print(f"   {written:,}/{n_products:,} products ({time.time() - started:.0f}s)")
+
+    size_mb = os.path.getsize(products_path) / (1024 * 1024)
+    print(f"✅ {n_products:,} products ({size_mb:.0f} MB) in {time.time() - started:.1f}s → {out_dir}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic Torob crawl CSVs")
+    parser.add_argument('out_dir')
+    parser.add_argument('--products', default='100k', help="Number of products, e.g. 10k, 1M, 10M")
+    parser.add_argument('--shops', type=parse_count, help="Number of shops (default: products / 50)")
+    parser.add_argument('--seed', type=int, default=42)
+    args = parser.parse_args()
+
+    generate(args.out_dir, parse_count(args.products), args.shops, args.seed)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,251 @@
+#!/usr/bin/env python3
+"""
+In-process benchmark of the dashboard API
+
+Loads a dataset (usually one made by generate_data.py) into the FastAPI app
+in this process and replays what Dashboard.js does: many concurrent
+sessions that fetch /api/dashboard, pan and zoom the map, and come back
+later revalidating the dashboard with If-None-Match. Requests go through the full ASGI
+stack (middleware, serialization, compression) without sockets, so the
+numbers track backend cost rather than network noise.
+
+Reports data load time, throughput, p50/p99 latency per request and process
+RSS, and writes them as JSON so runs on different commits can be compared:
+
+    python generate_data.py /tmp/torob_bench --products 1M
+    python run_benchmark.py /tmp/torob_bench --output before.json
+    ... change the backend ...
+    python run_benchmark.py /tmp/torob_bench --output after.json --compare before.json
+"""
+
+import os
+import sys
+import json
+import math
+import time
+import random
+import asyncio
+import argparse
+import platform
+import resource
+import subprocess
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'backend')
+
+DASHBOARD_PATH = "/api/dashboard"
+
+# Map views a user pans/zooms to afterwards: (zoom, lon, lat)
+MAP_VIEWS = [
+    (4, 53.7, 32.4),
+    (5, 51.4, 35.7),
+    (7, 51.4, 35.7),
+    (8, 59.6, 36.3),
+    (8, 51.7, 32.7),
+    (9, 52.5, 29.6),
+]
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def rss_mb():
+    """Current resident set size of this process"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE') / (1024 * 1024)
+    except (OSError, ValueError):
+        return peak_rss_mb()
+
+
+def peak_rss_mb():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes, macOS bytes
+    return peak / (1024 * 1024) if sys.platform == 'darwin' else peak / 1024
+
+
+def map_view_path(zoom, lon, lat):
+    # Roughly the area a 1000x500 px map shows at this zoom
+    half_width = 360 / 2 ** zoom * 2
+    half_height = half_width / 2
+    bbox = f"{lon - half_width:.4f},{lat - half_height:.4f},{lon + half_width:.4f},{lat + half_height:.4f}"
+    return f"/api/maps/geojson?zoom={zoom}&bbox={bbox}"
+
+
+async def timed_get(client, label, path, latencies, errors, headers=None, expect=200):
+    started = time.perf_counter()
+    response = None
+    try:
+        response = await client.get(path, headers={"Accept-Encoding": "gzip, br", **(headers or {})})
+        ok = response.status_code == expect
+    except httpx.HTTPError:
+        ok = False
+    latencies.setdefault(label, []).append(time.perf_counter() - started)
+    if not ok:
+        errors[label] = errors.get(label, 0) + 1
+    return response
+
+
+async def dashboard_session(client, rng, map_moves, latencies, errors):
+    """One user opening the dashboard and moving the map around"""
+    started = time.perf_counter()
+    response = await timed_get(client, "dashboard", DASHBOARD_PATH, latencies, errors)
+    latencies.setdefault("page load", []).append(time.perf_counter() - started)
+
+    for zoom, lon, lat in rng.sample(MAP_VIEWS, k=min(map_moves, len(MAP_VIEWS))):
+        await timed_get(client, f"geojson z{zoom} bbox", map_view_path(zoom, lon, lat), latencies, errors)
+
+    # Reopening the page: the browser revalidates its cached copy
+    etag = response.headers.get("etag") if response is not None else None
+    if etag:
+        await timed_get(client, "dashboard 304", DASHBOARD_PATH, latencies, errors,
+                        headers={"If-None-Match": etag}, expect=304)
+
+
+async def run_sessions(app, sessions, concurrency, map_moves, seed):
+    latencies, errors = {}, {}
+    rng = random.Random(seed)
+    transport = httpx.ASGITransport(app=app)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def limited(client):
+        async with semaphore:
+            await dashboard_session(client, rng, map_moves, latencies, errors)
+
+    async with httpx.AsyncClient(transport=transport, base_url="http://benchmark", timeout=600) as client:
+        # Warm up once so first-call costs are not counted
+        await dashboard_session(client, rng, map_moves, {}, {})
+        started = time.perf_counter()
+        await asyncio.gather(*(limited(client) for _ in range(sessions)))
+        elapsed = time.perf_counter() - started
+
+    return latencies, errors, elapsed
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BACKEND_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(data_dir, sessions, concurrency, map_moves, seed):
+    os.environ["TOROB_DATA_DIR"] = data_dir
+    os.environ.setdefault("TOROB_SEARCH_INDEX", os.path.join(data_dir, "search_index"))
+    os.environ["TOROB_RELOAD_INTERVAL"] = "0"
+    sys.path.insert(0, os.path.abspath(BACKEND_DIR))
+
+    rss_before = rss_mb()
+    import main
+
+    started = time.perf_counter()
+    if not main.data.reload():
+        raise SystemExit(f"❌ Could not load data from {data_dir}: {main.data.last_error}")
+    load_seconds = time.perf_counter() - started
+    snap = main.data.current
+    rss_loaded = rss_mb()
+
+    latencies, errors, elapsed = asyncio.run(run_sessions(main.app, sessions, concurrency, map_moves, seed))
+    main.compute.shutdown()
+
+    requests_made = sum(len(values) for label, values in latencies.items() if label != "page load")
+    return {
+        "commit": git_commit(),
+        "python": platform.python_version(),
+        "data": {
+            "dir": data_dir,
+            "shops": len(snap.shops_df) if snap.shops_df is not None else 0,
+            "shop_details": len(snap.shop_details_df) if snap.shop_details_df is not None else 0,
+            "products": len(snap.products_df) if snap.products_df is not None else 0,
+        },
+        "load_seconds": round(load_seconds, 2),
+        "sessions": sessions,
+        "concurrency": concurrency,
+        "elapsed_seconds": round(elapsed, 2),
+        "sessions_per_second": round(sessions / elapsed, 2),
+        "requests_per_second": round(requests_made / elapsed, 2),
+        "rss_mb": {
+            "before_load": round(rss_before, 1),
+            "after_load": round(rss_loaded, 1),
+            "after_run": round(rss_mb(), 1),
+            "peak": round(peak_rss_mb(), 1),
+        },
+        "endpoints": {
+            label: {
+                "count": len(values),
+                "errors": errors.get(label, 0),
+                "p50_ms": round(percentile(values, 50) * 1000, 2),
+                "p99_ms": round(percentile(values, 99) * 1000, 2),
+                "max_ms": round(max(values) * 1000, 2),
+            }
+            for label, values in latencies.items()
+        },
+    }
+
+
+def print_report(report, baseline=None):
+    data = report["data"]
+    print(f"\n📊 {data['products']:,} products, {data['shops']:,} shops"
+          f" (commit {report['commit'] or 'unknown'})")
+    print(f"   load {report['load_seconds']}s, {report['sessions']} sessions at concurrency"
+          f" {report['concurrency']} in {report['elapsed_seconds']}s")
+    print(f"   {report['sessions_per_second']} sessions/s, {report['requests_per_second']} requests/s")
+    rss = report["rss_mb"]
+    print(f"   RSS {rss['before_load']} → {rss['after_load']} MB after load, {rss['after_run']} MB after run,"
+          f" peak {rss['peak']} MB")
+
+    header = f"   {'request':<22}{'n':>6}{'err':>5}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}"
+    if baseline:
+        header += f"{'p99 before':>12}{'change':>9}"
+    print(header)
+    for label, stats in report["endpoints"].items():
+        line = (f"   {label:<22}{stats['count']:>6}{stats['errors']:>5}"
+                f"{stats['p50_ms']:>10.1f}{stats['p99_ms']:>10.1f}{stats['max_ms']:>10.1f}")
+        before = (baseline or {}).get("endpoints", {}).get(label)
+        if before:
+            change = (stats['p99_ms'] - before['p99_ms']) / before['p99_ms'] * 100 if before['p99_ms'] else 0.0
+            line += f"{before['p99_ms']:>12.1f}{change:>+8.0f}%"
+        print(line)
+
+    if baseline:
+        print(f"   throughput {baseline['requests_per_second']} → {report['requests_per_second']} requests/s,"
+              f" peak RSS {baseline['rss_mb']['peak']} → {rss['peak']} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process dashboard API benchmark")
+    parser.add_argument("data_dir", help="Directory with torob_shops.csv, shopinfo_detail.csv, shop_products.csv")
+    parser.add_argument("--sessions", type=int, default=200, help="Dashboard sessions to replay")
+    parser.add_argument("--concurrency", type=int, default=20, help="Sessions running at once")
+    parser.add_argument("--map-moves", type=int, default=3, help="Map pans/zooms per session")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--output", help="Write the report as JSON")
+    parser.add_argument("--compare", help="Earlier JSON report to compare against")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+
+    print("⏱️  Torob Dashboard benchmark")
+    print("=" * 50)
+    report = run(os.path.abspath(args.data_dir), args.sessions, args.concurrency, args.map_moves, args.seed)
+    print_report(report, baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2, ensure_ascii=False)
+        print(f"\n💾 Report written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
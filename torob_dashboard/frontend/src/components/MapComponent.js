@@ -1,5 +1,5 @@
 import React from 'react';
-import { MapContainer, TileLayer, CircleMarker, Popup } from 'react-leaflet';
+import { MapContainer, TileLayer, CircleMarker, Popup, useMapEvents } from 'react-leaflet';
 import { Box, Typography } from '@mui/material';
 import L from 'leaflet';
 
@@ -11,7 +11,24 @@ L.Icon.Default.mergeOptions({
   shadowUrl: 'https://cdnjs.cloudflare.com/ajax/libs/leaflet/1.7.1/images/marker-shadow.png',
 });
 
-const MapComponent = ({ geoData, loading }) => {
+// Reports the visible area so the backend can send the matching
+// aggregation level and only the features inside the view
+const ViewWatcher = ({ onViewChange }) => {
+  const map = useMapEvents({
+    moveend: () => {
+      const bounds = map.getBounds();
+      onViewChange({
+        zoom: map.getZoom(),
+        bbox: [
+          bounds.getWest(), bounds.getSouth(), bounds.getEast(), bounds.getNorth()
+        ].map((value) => value.toFixed(4)).join(','),
+      });
+    },
+  });
+  return null;
+};
+
+const MapComponent = ({ geoData, loading, onViewChange }) => {
   if (loading) {
     return (
       <Box className="loading">
@@ -42,16 +59,18 @@ const MapComponent = ({ geoData, loading }) => {
         url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
       />
       
+      {onViewChange && <ViewWatcher onViewChange={onViewChange} />}
+
       {geoData.features.map((feature, index) => {
         const [lng, lat] = feature.geometry.coordinates;
-        const { city, shop_count } = feature.properties;
+        const { name, level, shop_count } = feature.properties;
         
         // Calculate circle size based on shop count
         const radius = Math.min(Math.max(shop_count / 100, 5), 50);
         
         return (
           <CircleMarker
-            key={index}
+            key={`${level}-${name}-${index}`}
             center={[lat, lng]}
             radius={radius}
             fillColor="#1976d2"
@@ -63,7 +82,7 @@ const MapComponent = ({ geoData, loading }) => {
             <Popup>
               <div style={{ direction: 'rtl', textAlign: 'right' }}>
                 <Typography variant="h6" component="div">
-                  {city}
+                  {name}
                 </Typography>
                 <Typography variant="body2">
                   تعداد فروشگاه: {shop_count.toLocaleString('fa-IR')}
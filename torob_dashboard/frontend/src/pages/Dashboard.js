@@ -25,33 +25,40 @@ const Dashboard = () => {
     loadDashboardData();
   }, []);
 
-  const loadDashboardData = async () => {
+  const loadDashboardData = async (refresh = false) => {
     try {
-      setLoading(true);
+      if (!refresh) {
+        setLoading(true);
+      }
       setError(null);
 
-      // Check API health first
-      const healthResponse = await apiService.healthCheck();
-      setHealthStatus(healthResponse.data);
+      // Right after a restart the backend answers 503 until it has loaded
+      // the shops table in the background, so keep asking
+      let response;
+      for (;;) {
+        try {
+          response = await apiService.getDashboard();
+          break;
+        } catch (err) {
+          if (err.response?.status !== 503) {
+            throw err;
+          }
+          await new Promise((resolve) => setTimeout(resolve, 1000));
+        }
+      }
 
-      if (!healthResponse.data.shops_loaded) {
-        throw new Error('داده‌های فروشگاه بارگذاری نشده است');
+      const dashboard = response.data;
+      setHealthStatus(dashboard.health);
+      setAnalytics(dashboard.overview);
+      setCityData(dashboard.cities);
+      if (!refresh) {
+        setGeoData(dashboard.map);
       }
 
-      // Load all dashboard data in parallel
-      const [
-        analyticsResponse,
-        cityResponse,
-        geoResponse
-      ] = await Promise.all([
-        apiService.getAnalyticsOverview(),
-        apiService.getShopsByCity(),
-        apiService.getGeoJsonData()
-      ]);
-
-      setAnalytics(analyticsResponse.data);
-      setCityData(cityResponse.data);
-      setGeoData(geoResponse.data);
+      // Product and detail panels fill in once the rest of the data is loaded
+      if (dashboard.datasets_loading.length > 0) {
+        setTimeout(() => loadDashboardData(true), 5000);
+      }
 
     } catch (err) {
       console.error('Error loading dashboard data:', err);
@@ -61,6 +68,16 @@ const Dashboard = () => {
     }
   };
 
+  // Panning or zooming the map fetches the aggregation for the new view
+  const handleMapViewChange = async (view) => {
+    try {
+      const geoResponse = await apiService.getGeoJsonData(view);
+      setGeoData(geoResponse.data);
+    } catch (err) {
+      console.error('Error loading map data:', err);
+    }
+  };
+
   if (loading) {
     return (
       <Box 
@@ -128,7 +145,7 @@ const Dashboard = () => {
             <Typography variant="body2" color="text.secondary" sx={{ mb: 2 }}>
               اندازه دایره‌ها نشان‌دهنده تعداد فروشگاه‌ها در هر شهر است
             </Typography>
-            <MapComponent geoData={geoData} loading={false} />
+            <MapComponent geoData={geoData} loading={false} onViewChange={handleMapViewChange} />
           </Paper>
         </Grid>
 
@@ -11,6 +11,11 @@ export const apiService = {
   // Health check
   healthCheck: () => api.get('/api/health'),
 
+  // Every dashboard panel in one response. The backend sends an ETag with
+  // Cache-Control: no-cache, so the browser revalidates its cached copy and
+  // only downloads the payload again when the data has changed.
+  getDashboard: () => api.get('/api/dashboard'),
+
   // Shop data endpoints
   getShopsByCity: () => api.get('/api/shops/by-city'),
   getShopsByProvince: () => api.get('/api/shops/by-province'),
@@ -23,7 +28,7 @@ export const apiService = {
   getAnalyticsOverview: () => api.get('/api/analytics/overview'),
   
   // Map data
-  getGeoJsonData: () => api.get('/api/maps/geojson'),
+  getGeoJsonData: (params) => api.get('/api/maps/geojson', { params }),
 };
 
 export default apiService;
@@ -0,0 +1,163 @@
+#!/usr/bin/env python3
+"""
+Load test for the Torob Dashboard API
+
+Simulates many browsers opening the dashboard at once: each page load calls
+/api/health and then, in parallel, the three requests Dashboard.js makes.
+A by-province request is mixed into every load to stand in for the slower
+endpoints. Reports p50/p99 latency per endpoint and per page load.
+
+Compare the event-loop-bound backend with the offloaded one:
+    python load_test.py --data-dir /home/maede/Projects/torob_analysis --compare
+
+Or hit a server that is already running:
+    python load_test.py --url http://localhost:8000
+"""
+
+import os
+import sys
+import math
+import time
+import asyncio
+import argparse
+import subprocess
+
+import httpx
+
+DASHBOARD_REQUESTS = [
+    "/api/analytics/overview",
+    "/api/shops/by-city",
+    "/api/maps/geojson",
+    "/api/shops/by-province",
+]
+
+def percentile(values, pct):
+    """Nearest-rank percentile"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+async def timed_get(client, path, latencies):
+    started = time.perf_counter()
+    try:
+        status = (await client.get(path)).status_code
+    except httpx.HTTPError:
+        status = None
+    latencies.setdefault(path, []).append(time.perf_counter() - started)
+    return status
+
+async def dashboard_load(client, latencies):
+    """One browser opening the dashboard"""
+    started = time.perf_counter()
+    health = await timed_get(client, "/api/health", latencies)
+    statuses = await asyncio.gather(*(timed_get(client, path, latencies) for path in DASHBOARD_REQUESTS))
+    latencies.setdefault("page load", []).append(time.perf_counter() - started)
+    return all(status == 200 for status in [health, *statuses])
+
+async def run_load(url, concurrency, rounds, timeout):
+    latencies = {}
+    failures = 0
+    limits = httpx.Limits(max_connections=concurrency * len(DASHBOARD_REQUESTS))
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as client:
+        # Warm up once so first-call costs are not counted
+        await dashboard_load(client, {})
+
+        started = time.perf_counter()
+        for _ in range(rounds):
+            results = await asyncio.gather(*(dashboard_load(client, latencies) for _ in range(concurrency)))
+            failures += results.count(False)
+        elapsed = time.perf_counter() - started
+
+    return latencies, failures, elapsed
+
+def print_report(title, latencies, failures, elapsed, loads):
+    print(f"\n📊 {title}")
+    print(f"   {loads} page loads in {elapsed:.1f}s ({loads / elapsed:.1f} loads/s), {failures} with errors")
+    print(f"   {'endpoint':<28}{'n':>6}{'p50 ms':>10}{'p99 ms':>10}{'max ms':>10}")
+    for path, values in latencies.items():
+        print(f"   {path:<28}{len(values):>6}"
+              f"{percentile(values, 50) * 1000:>10.1f}"
+              f"{percentile(values, 99) * 1000:>10.1f}"
+              f"{max(values) * 1000:>10.1f}")
+
+def wait_until_loaded(url, timeout=600):
+    """Wait for the backend to finish its background data load"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            health = httpx.get(f"{url}/api/health", timeout=5).json()
+            states = [d['state'] for d in health.get('datasets', {}).values()]
+            if states and not any(state in ('pending', 'loading') for state in states):
+                return True
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.5)
+    return False
+
+def start_server(data_dir, port, inline):
+    backend_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend")
+    env = {
+        **os.environ,
+        "TOROB_DATA_DIR": data_dir,
+        "TOROB_RELOAD_INTERVAL": "0",
+        "TOROB_COMPUTE_INLINE": "1" if inline else "0",
+    }
+    return subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+        cwd=backend_dir,
+        env=env,
+        stdout=subprocess.DEVNULL,
+    )
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent dashboard load test")
+    parser.add_argument("--url", help="Test an already running server instead of starting one")
+    parser.add_argument("--data-dir", default="/home/maede/Projects/torob_analysis")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--concurrency", type=int, default=50, help="Simultaneous dashboard loads")
+    parser.add_argument("--rounds", type=int, default=5)
+    parser.add_argument("--timeout", type=float, default=300, help="Per-request timeout in seconds")
+    parser.add_argument("--compare", action="store_true",
+                        help="Run against inline (event loop) and offloaded computation")
+    args = parser.parse_args()
+
+    print("🧪 Torob Dashboard load test")
+    print("=" * 50)
+    loads = args.concurrency * args.rounds
+
+    if args.url:
+        latencies, failures, elapsed = asyncio.run(run_load(args.url, args.concurrency, args.rounds, args.timeout))
+        print_report(args.url, latencies, failures, elapsed, loads)
+        return 0
+
+    modes = [("before: pandas on the event loop", True), ("after: offloaded + coalesced", False)]
+    if not args.compare:
+        modes = modes[1:]
+
+    summary = []
+    for title, inline in modes:
+        url = f"http://127.0.0.1:{args.port}"
+        server = start_server(args.data_dir, args.port, inline)
+        try:
+            if not wait_until_loaded(url):
+                print(f"❌ Backend did not finish loading data from {args.data_dir}")
+                return 1
+            latencies, failures, elapsed = asyncio.run(run_load(url, args.concurrency, args.rounds, args.timeout))
+        finally:
+            server.terminate()
+            server.wait()
+        print_report(title, latencies, failures, elapsed, loads)
+        summary.append((title, latencies))
+
+    if len(summary) == 2:
+        print("\n⚖️  p99 before → after")
+        before, after = summary[0][1], summary[1][1]
+        for path in before:
+            print(f"   {path:<28}{percentile(before[path], 99) * 1000:>10.1f} → "
+                  f"{percentile(after[path], 99) * 1000:.1f} ms")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,13 +1,37 @@
 #!/usr/bin/env python3
 """
 Simple script to start the Torob Dashboard Backend
+
+    python start_backend.py                           # development, auto-reload
+    python start_backend.py --production --workers 4  # multi-worker, shared data
 """
 
 import os
 import sys
+import argparse
 import subprocess
 
+def prepare_shared_snapshot():
+    """Export the CSVs to Arrow files that every worker memory-maps"""
+    sys.path.insert(0, os.path.abspath("backend"))
+    from shared_data import export_snapshot
+    
+    data_dir = os.environ.get("TOROB_DATA_DIR", "/home/maede/Projects/torob_analysis")
+    shared_dir = os.environ.get("TOROB_SHARED_SNAPSHOT", os.path.join(data_dir, "shared_snapshot"))
+    
+    print(f"📦 Preparing shared data snapshot in {shared_dir}")
+    export_snapshot(data_dir, shared_dir)
+    return shared_dir
+
 def main():
+    parser = argparse.ArgumentParser(description="Start the Torob Dashboard backend")
+    parser.add_argument("--production", action="store_true",
+                        help="Run several workers serving one shared, memory-mapped data snapshot")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 1,
+                        help="Number of uvicorn workers in production mode")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+    
     print("🚀 Starting Torob Market Geographical Dashboard Backend...")
     
     # Change to the dashboard directory
@@ -33,23 +57,36 @@ def main():
     except ImportError as e:
         print(f"❌ Missing package: {e}")
         print("Installing required packages...")
-        subprocess.run([sys.executable, "-m", "pip", "install", "fastapi", "uvicorn", "pandas", "pydantic"])
+        subprocess.run([sys.executable, "-m", "pip", "install", "fastapi", "uvicorn", "pandas", "pydantic", "pyarrow"])
+    
+    command = [
+        sys.executable, "-m", "uvicorn", 
+        "backend.main:app", 
+        "--host", "0.0.0.0", 
+        "--port", str(args.port)
+    ]
+    env = dict(os.environ)
+    
+    if args.production:
+        try:
+            env["TOROB_SHARED_SNAPSHOT"] = prepare_shared_snapshot()
+        except Exception as e:
+            print(f"❌ Could not prepare shared snapshot: {e}")
+            return 1
+        command += ["--workers", str(args.workers)]
+        print(f"🏭 Production mode: {args.workers} workers sharing one data snapshot")
+    else:
+        command.append("--reload")
     
     # Start the server
     print("\n🌟 Starting FastAPI server...")
-    print("📊 API will be available at: http://localhost:8000")
-    print("📚 API Documentation: http://localhost:8000/docs")
+    print(f"📊 API will be available at: http://localhost:{args.port}")
+    print(f"📚 API Documentation: http://localhost:{args.port}/docs")
     print("🔄 Press Ctrl+C to stop the server")
     print("-" * 50)
     
     try:
-        subprocess.run([
-            sys.executable, "-m", "uvicorn", 
-            "backend.main:app", 
-            "--host", "0.0.0.0", 
-            "--port", "8000", 
-            "--reload"
-        ])
+        subprocess.run(command, env=env)
     except KeyboardInterrupt:
         print("\n🛑 Server stopped by user")
     except Exception as e:
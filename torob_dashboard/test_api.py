@@ -13,11 +13,15 @@ def test_api_endpoint(url, description):
         print(f"🔍 Testing: {description}")
         print(f"   URL: {url}")
         
+        started = time.perf_counter()
         response = requests.get(url, timeout=10)
+        elapsed_ms = (time.perf_counter() - started) * 1000
         
         if response.status_code == 200:
             data = response.json()
             print(f"   ✅ Status: {response.status_code}")
+            print(f"   ⏱️ {elapsed_ms:.0f} ms, {len(response.content):,} bytes"
+                  f" (server: {response.headers.get('Server-Timing', 'n/a')})")
             
             # Print a summary of the data
             if isinstance(data, dict):
@@ -64,10 +68,21 @@ def main():
     
     for endpoint, description in endpoints:
         test_api_endpoint(f"{base_url}{endpoint}", description)
-        time.sleep(0.5)  # Small delay between requests
+    
+    # Per-route latency as the server recorded it
+    try:
+        summary = requests.get(f"{base_url}/metrics", params={"format": "json"}, timeout=5).json()
+        print("📈 Server-side latency")
+        for route, stats in summary["routes"].items():
+            print(f"   {route:<32} n={stats['count']:<4} p50={stats['p50_ms']:.1f} ms"
+                  f"  p99={stats['p99_ms']:.1f} ms  compute={stats['compute_mean_ms']:.1f} ms")
+        print()
+    except (requests.exceptions.RequestException, ValueError, KeyError):
+        print("⚠️  /metrics not available\n")
     
     print("🎉 API testing complete!")
     print(f"📚 Full API documentation: {base_url}/docs")
+    print(f"🔬 Profile any endpoint (backend started with TOROB_PROFILING=1): {base_url}/api/shops/by-city?profile=1")
 
 if __name__ == "__main__":
     main()